@@ -0,0 +1,335 @@
+import gzip
+import mimetypes
+import os
+import shutil
+import tarfile
+import zlib
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from .pipeline_config import RESULTS_DIR, feature_matrix_path
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; gzip is always available
+    zstandard = None
+
+# --- Configuration ---
+# Behind nginx, set to an `internal` location aliasing RESULTS_DIR (see
+# nginx.conf) and files are handed off with X-Accel-Redirect, so nginx sends
+# them with sendfile(), ranges and caching headers instead of the API
+ACCEL_PREFIX = os.environ.get('TRACE_ARTIFACT_ACCEL_PREFIX')
+CHUNK_SIZE = 1024 * 1024
+# Text outputs worth compressing; Parquet, PNG and gzipped files already are
+COMPRESSIBLE_EXTENSIONS = (".tsv", ".txt", ".html", ".wig", ".seg", ".csv", ".log", ".json")
+# Below this, compression saves less than the request overhead
+COMPRESS_MIN_BYTES = 1024
+# Precompressed siblings (`<file>.gz`, `<file>.zst`) written for larger text
+# outputs by a low-priority task after each job; 0 disables them
+PRECOMPRESS = os.environ.get('TRACE_ARTIFACT_PRECOMPRESS', '1') != '0'
+PRECOMPRESS_MIN_BYTES = int(os.environ.get('TRACE_ARTIFACT_PRECOMPRESS_MIN_BYTES', 64 * 1024))
+# Fast levels: most of the size reduction for a fraction of the CPU time
+PRECOMPRESS_GZIP_LEVEL = int(os.environ.get('TRACE_ARTIFACT_GZIP_LEVEL', 6))
+PRECOMPRESS_ZSTD_LEVEL = int(os.environ.get('TRACE_ARTIFACT_ZSTD_LEVEL', 3))
+# Compaction keeps only the gzip copy, for good, so it is worth the strongest level
+COMPACT_GZIP_LEVEL = 9
+# Retained text outputs at least this large are compacted: only `<file>.gz` is kept
+COMPACT_MIN_BYTES = int(os.environ.get('TRACE_ARTIFACT_COMPACT_MIN_BYTES', 4096))
+ENCODING_SUFFIXES = {"zstd": ".zst", "gzip": ".gz"}
+
+mimetypes.add_type("text/tab-separated-values", ".tsv")
+mimetypes.add_type("application/vnd.apache.parquet", ".parquet")
+
+
+# --- Catalogue ---
+def sample_dir(sample_id: str) -> str:
+    return os.path.join(RESULTS_DIR, sample_id)
+
+
+def compressible(path: str) -> bool:
+    return path.endswith(COMPRESSIBLE_EXTENSIONS)
+
+
+def _is_encoded_copy(path: str) -> bool:
+    """`<file>.gz` / `<file>.zst` of a text output: a precompressed sibling or a compacted output."""
+    base, extension = os.path.splitext(path)
+    return extension in ENCODING_SUFFIXES.values() and compressible(base)
+
+
+def stored_file(path: str):
+    """
+    (file on disk, its Content-Encoding) of an artifact: the file itself, or
+    its `.gz` once compacted. (None, None) if neither exists.
+    """
+    if os.path.isfile(path):
+        return path, None
+    if compressible(path) and os.path.isfile(path + ".gz"):
+        return path + ".gz", "gzip"
+    return None, None
+
+
+def matrix_outputs(sample_id: str) -> list:
+    """The sample's feature matrix and, if exported, its TSV copy."""
+    matrix = feature_matrix_path(sample_id)
+    return [matrix, os.path.splitext(matrix)[0] + ".tsv"]
+
+
+def list_artifacts(sample_id: str) -> dict:
+    """
+    {name: path} of a sample's outputs: its feature matrix (and TSV export)
+    plus every file under its results directory, named by relative path.
+    Compacted outputs are listed under their uncompressed name.
+    """
+    artifacts = {os.path.basename(p): p for p in matrix_outputs(sample_id) if stored_file(p)[0] is not None}
+    root = sample_dir(sample_id)
+    for directory, _, files in os.walk(root):
+        for filename in files:
+            path = os.path.join(directory, filename)
+            if _is_encoded_copy(path):
+                base, extension = os.path.splitext(path)
+                if extension != ".gz" or os.path.exists(base):
+                    continue
+                path = base
+            artifacts[os.path.relpath(path, root)] = path
+    return dict(sorted(artifacts.items()))
+
+
+def resolve(sample_id: str, name: str) -> Optional[str]:
+    """Path of one artifact, or None; names can never leave the sample's outputs."""
+    for path in matrix_outputs(sample_id):
+        if name == os.path.basename(path):
+            return path if stored_file(path)[0] is not None else None
+    root = os.path.realpath(sample_dir(sample_id))
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root or _is_encoded_copy(path) or stored_file(path)[0] is None:
+        return None
+    return path
+
+
+def media_type(path: str) -> str:
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def describe(path: str) -> dict:
+    """Listing entry of one artifact; `size` is what it occupies on disk."""
+    stored, encoding = stored_file(path)
+    stat = os.stat(stored)
+    return {
+        "size": stat.st_size,
+        "media_type": media_type(path),
+        "modified_at": datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+        "encoding": encoding,
+    }
+
+
+# --- Precompression ---
+def precompress(path: str, gzip_level: int = PRECOMPRESS_GZIP_LEVEL, zstd_level: Optional[int] = PRECOMPRESS_ZSTD_LEVEL):
+    """
+    Writes `<path>.gz` (and `<path>.zst` when zstandard is installed and
+    `zstd_level` is set) next to a text output.
+    """
+    encoders = [(".gz", lambda dst: gzip.GzipFile(fileobj=dst, mode="wb", compresslevel=gzip_level, mtime=0))]
+    if zstandard is not None and zstd_level is not None:
+        encoders.append((".zst", lambda dst: zstandard.ZstdCompressor(level=zstd_level).stream_writer(dst, closefd=False)))
+    for suffix, open_encoder in encoders:
+        target, partial = path + suffix, f"{path}{suffix}.part"
+        with open(path, "rb") as src, open(partial, "wb") as dst:
+            with open_encoder(dst) as encoder:
+                shutil.copyfileobj(src, encoder, CHUNK_SIZE)
+        os.replace(partial, target)
+
+
+def precompress_sample(sample_id: str) -> int:
+    """Precompresses a sample's larger text outputs; returns how many were written."""
+    written = 0
+    for path in list_artifacts(sample_id).values():
+        if compressible(path) and os.path.isfile(path) and os.path.getsize(path) >= PRECOMPRESS_MIN_BYTES:
+            precompress(path)
+            written += 1
+    return written
+
+
+def compact_sample(sample_id: str) -> int:
+    """
+    Replaces a sample's text outputs by their gzip copy, which downloads
+    serve transparently (decoded for clients without gzip). Returns the
+    bytes freed.
+    """
+    freed = 0
+    for path in list_artifacts(sample_id).values():
+        if not compressible(path) or not os.path.isfile(path) or os.path.getsize(path) < COMPACT_MIN_BYTES:
+            continue
+        before = os.path.getsize(path) + sum(os.path.getsize(path + s) for s in ENCODING_SUFFIXES.values() if os.path.isfile(path + s))
+        sibling = path + ".gz"
+        if not os.path.isfile(sibling) or os.stat(sibling).st_mtime < os.stat(path).st_mtime:
+            precompress(path, gzip_level=COMPACT_GZIP_LEVEL, zstd_level=None)
+        os.remove(path)
+        if os.path.isfile(path + ".zst"):
+            os.remove(path + ".zst")
+        freed += before - os.path.getsize(sibling)
+    return freed
+
+
+# --- Responses ---
+def _accepted_encodings(accept_encoding: str) -> list:
+    """Codings the client accepts, in our order of preference."""
+    offered = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = params.strip()[2:] if params.strip().startswith("q=") else "1"
+        try:
+            offered[coding.strip().lower()] = float(quality)
+        except ValueError:
+            continue
+    return [c for c in ENCODING_SUFFIXES if offered.get(c, offered.get("*", 0)) > 0]
+
+
+def _not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def _stream_compressed(path: str, encoding: str):
+    """Compresses a file chunk by chunk; nothing larger than one chunk is held in memory."""
+    if encoding == "zstd":
+        encoder = zstandard.ZstdCompressor(level=3).compressobj()
+    else:
+        encoder = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip framing
+    with open(path, "rb") as fh:
+        while chunk := fh.read(CHUNK_SIZE):
+            data = encoder.compress(chunk)
+            if data:
+                yield data
+    yield encoder.flush()
+
+
+def file_response(path: str, request_headers, download_name: str):
+    """
+    Serves one artifact. Identity responses support Range and conditional
+    requests and are streamed from disk (or handed to nginx); text artifacts
+    go out gzip/zstd encoded when the client accepts it, preferring a
+    precompressed sibling, unless a byte range was asked for.
+    """
+    headers = {"Vary": "Accept-Encoding"}
+    # Reports and plots open in the browser; tables and matrices download
+    disposition = "inline" if media_type(path).startswith(("text/html", "image/")) else "attachment"
+
+    def file(p, extra):
+        return FileResponse(
+            p, media_type=media_type(path), filename=download_name, headers={**headers, **extra},
+            stat_result=os.stat(p), content_disposition_type=disposition,
+        )
+
+    stored, encoding = stored_file(path)
+    if encoding is not None:
+        return _compacted_response(path, file(stored, {"Content-Encoding": encoding}), request_headers)
+    identity = file(path, {})
+    etag, stat = identity.headers["etag"], identity.stat_result
+
+    encodings = []
+    if compressible(path) and stat.st_size >= COMPRESS_MIN_BYTES and "range" not in request_headers:
+        encodings = _accepted_encodings(request_headers.get("accept-encoding", ""))
+    for encoding in encodings:
+        sibling = path + ENCODING_SUFFIXES[encoding]
+        if os.path.isfile(sibling) and os.stat(sibling).st_mtime >= stat.st_mtime:
+            return _conditional(file(sibling, {"Content-Encoding": encoding}), request_headers)
+    for encoding in encodings:
+        if encoding == "zstd" and zstandard is None:
+            continue
+        encoded_etag = f'W/{etag[:-1]}-{encoding}"'
+        if _not_modified(request_headers.get("if-none-match"), encoded_etag):
+            return Response(status_code=304, headers={**headers, "ETag": encoded_etag})
+        return StreamingResponse(
+            _stream_compressed(path, encoding),
+            media_type=media_type(path),
+            headers={
+                **headers, "Content-Encoding": encoding, "ETag": encoded_etag,
+                "Last-Modified": identity.headers["last-modified"],
+                "Content-Disposition": identity.headers["content-disposition"],
+            },
+        )
+
+    if ACCEL_PREFIX:
+        relative = os.path.relpath(path, RESULTS_DIR)
+        return Response(headers={
+            "X-Accel-Redirect": f"{ACCEL_PREFIX.rstrip('/')}/{relative}",
+            "Content-Type": media_type(path),
+            "Content-Disposition": identity.headers["content-disposition"],
+        })
+    return _conditional(identity, request_headers)
+
+
+def _compacted_response(path: str, encoded: FileResponse, request_headers):
+    """A compacted output: its gzip file as is, or decoded on the fly (without ranges) for other clients."""
+    if "gzip" in _accepted_encodings(request_headers.get("accept-encoding", "")):
+        return _conditional(encoded, request_headers)
+    etag = f'W/{encoded.headers["etag"][:-1]}-identity"'
+    headers = {"Vary": "Accept-Encoding", "ETag": etag, "Last-Modified": encoded.headers["last-modified"]}
+    if _not_modified(request_headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return StreamingResponse(
+        _stream_decompressed(encoded.path),
+        media_type=media_type(path),
+        headers={**headers, "Accept-Ranges": "none", "Content-Disposition": encoded.headers["content-disposition"]},
+    )
+
+
+def _stream_decompressed(path: str):
+    decoder = zlib.decompressobj(31)
+    with open(path, "rb") as fh:
+        while chunk := fh.read(CHUNK_SIZE):
+            yield decoder.decompress(chunk)
+    yield decoder.flush()
+
+
+def _conditional(response: FileResponse, request_headers):
+    """A 304 for a file response whose ETag the client already has."""
+    etag = response.headers["etag"]
+    if _not_modified(request_headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept-Encoding", "Last-Modified": response.headers["last-modified"]})
+    return response
+
+
+# --- Bundles ---
+def _tar_members(prefix: str, artifacts: dict):
+    """(tar header, path, size) per file, sized up front so the archive length is known."""
+    members = []
+    for name, path in artifacts.items():
+        # Compacted outputs go in as they are stored, as `<name>.gz`
+        path, encoding = stored_file(path)
+        name += ENCODING_SUFFIXES[encoding] if encoding else ""
+        stat = os.stat(path)
+        info = tarfile.TarInfo(f"{prefix}/{name}")
+        info.size, info.mtime, info.mode = stat.st_size, int(stat.st_mtime), 0o644
+        members.append((info.tobuf(format=tarfile.PAX_FORMAT), path, stat.st_size))
+    return members
+
+
+def _stream_tar(members):
+    for header, path, size in members:
+        yield header
+        remaining = size
+        with open(path, "rb") as fh:
+            while remaining:
+                chunk = fh.read(min(remaining, CHUNK_SIZE))
+                if not chunk:
+                    raise IOError(f"{path} shrank while it was being archived")
+                remaining -= len(chunk)
+                yield chunk
+        yield b"\0" * (-size % tarfile.BLOCKSIZE)
+    yield b"\0" * (2 * tarfile.BLOCKSIZE)
+
+
+def bundle_response(sample_id: str, artifacts: dict):
+    """Streams artifacts as an uncompressed tar built on the fly; no archive is staged on disk."""
+    members = _tar_members(sample_id, artifacts)
+    length = sum(len(header) + size + (-size % tarfile.BLOCKSIZE) for header, _, size in members) + 2 * tarfile.BLOCKSIZE
+    return StreamingResponse(
+        _stream_tar(members),
+        media_type="application/x-tar",
+        headers={"Content-Length": str(length), "Content-Disposition": f'attachment; filename="{sample_id}.tar"'},
+    )
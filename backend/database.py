@@ -1,14 +1,55 @@
-from sqlalchemy import create_engine
+import os
+import random
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-# Define the database URL for a local SQLite database file
-SQLALCHEMY_DATABASE_URL = "sqlite:///./db_files/trace.db"
+# --- Configuration ---
+# Defaults to the local SQLite file; point it at a server database (e.g.
+# postgresql+psycopg2://trace:secret@db:5432/trace) to run many writers.
+SQLALCHEMY_DATABASE_URL = os.environ.get('DATABASE_URL', "sqlite:///./db_files/trace.db")
+# How long a SQLite writer waits for the lock before giving up
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('TRACE_SQLITE_BUSY_TIMEOUT_MS', 30000))
+# Connection pool for server databases, per process
+DB_POOL_SIZE = int(os.environ.get('TRACE_DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('TRACE_DB_MAX_OVERFLOW', 10))
+DB_POOL_RECYCLE_SECONDS = int(os.environ.get('TRACE_DB_POOL_RECYCLE_SECONDS', 1800))
+
+is_sqlite = make_url(SQLALCHEMY_DATABASE_URL).get_backend_name() == "sqlite"
 
 # Create the SQLAlchemy engine
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+if is_sqlite:
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+    )
+
+    @event.listens_for(engine, "connect")
+    def _configure_sqlite(dbapi_connection, connection_record):
+        """
+        WAL lets readers run alongside the single writer, busy_timeout makes
+        writers queue for the lock instead of failing with "database is
+        locked", and synchronous=NORMAL is durable under WAL with far fewer fsyncs.
+        """
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+else:
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE_SECONDS,
+        # Drop connections the server closed while a worker sat idle for hours
+        pool_pre_ping=True,
+    )
 
 # Create a sessionmaker to generate database sessions
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -16,10 +57,52 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Base class for declarative database models
 Base = declarative_base()
 
+
 # Dependency to get a database session for each request
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+@contextmanager
+def session_scope():
+    """A short-lived session that commits on success and rolls back on error."""
+    db = SessionLocal()
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+# Messages (SQLite) and SQLSTATEs (PostgreSQL/MySQL) that mean "try again"
+_CONTENTION_MESSAGES = ("database is locked", "database is busy", "deadlock", "could not serialize")
+_CONTENTION_CODES = ("40001", "40P01")
+
+
+def is_contention(error: OperationalError) -> bool:
+    code = getattr(error.orig, "pgcode", None) or getattr(error.orig, "sqlstate", None)
+    return code in _CONTENTION_CODES or any(m in str(error.orig).lower() for m in _CONTENTION_MESSAGES)
+
+
+def run_with_retry(work, attempts: int = 5, base_delay: float = 0.2):
+    """
+    Runs `work(db)` in its own transaction, retrying with jittered backoff
+    when the database reports lock contention. Other errors propagate at once.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            with session_scope() as db:
+                return work(db)
+        except OperationalError as e:
+            if attempt == attempts or not is_contention(e):
+                raise
+            delay = base_delay * 2 ** (attempt - 1) * (1 + random.random())
+            print(f"Database busy ({e.orig}); retrying in {delay:.2f}s (attempt {attempt}/{attempts})")
+            time.sleep(delay)
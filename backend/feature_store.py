@@ -0,0 +1,202 @@
+import argparse
+import fcntl
+import json
+import os
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional, Sequence
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from .pipeline_config import RESULTS_DIR
+
+# --- Configuration ---
+FEATURE_STORE_DIR = os.environ.get('TRACE_FEATURE_STORE_DIR', os.path.join(RESULTS_DIR, "feature_store"))
+
+# Layout:
+#   partitions/{partition_id}.parquet  immutable, one per completed job or batch
+#   manifest.json                      the current snapshot, replaced atomically
+#   .lock                              serializes writers; readers never take it
+#
+# The manifest maps every sample to the partition holding its latest features,
+# so a reader that loads it once sees a consistent snapshot even while new
+# partitions are being committed.
+
+
+def _manifest_path(store_dir: str) -> str:
+    return os.path.join(store_dir, "manifest.json")
+
+
+def _empty_manifest() -> dict:
+    return {"generation": 0, "partitions": {}, "samples": {}}
+
+
+def snapshot(store_dir: str = FEATURE_STORE_DIR) -> dict:
+    """Returns the current manifest. Partitions it references are never modified."""
+    try:
+        with open(_manifest_path(store_dir)) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return _empty_manifest()
+
+
+@contextmanager
+def _writer_lock(store_dir: str):
+    os.makedirs(store_dir, exist_ok=True)
+    with open(os.path.join(store_dir, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _atomic_write_json(path: str, data: dict):
+    tmp_path = f"{path}.tmp.{os.getpid()}.{uuid.uuid4().hex[:8]}"
+    with open(tmp_path, "w") as fh:
+        json.dump(data, fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, path)
+
+
+def commit(features: pd.DataFrame, partition_id: str, store_dir: str = FEATURE_STORE_DIR) -> dict:
+    """
+    Appends one partition of per-sample features (indexed by sample_id) to the store.
+
+    The partition file is fully written before the manifest is swapped, so a
+    crash leaves either the old or the new snapshot. Samples already in the
+    store are superseded by the new partition.
+    """
+    partition_dir = os.path.join(store_dir, "partitions")
+    os.makedirs(partition_dir, exist_ok=True)
+    features = features.copy()
+    features.index = features.index.astype(str).rename("sample_id")
+
+    filename = f"{partition_id}-{uuid.uuid4().hex[:8]}.parquet"
+    tmp_path = os.path.join(partition_dir, f".{filename}.tmp")
+    features.to_parquet(tmp_path, index=True)
+    os.replace(tmp_path, os.path.join(partition_dir, filename))
+
+    with _writer_lock(store_dir):
+        manifest = snapshot(store_dir)
+        manifest["generation"] += 1
+        manifest["partitions"][filename] = {
+            "partition_id": partition_id,
+            "samples": features.index.tolist(),
+            "columns": features.columns.tolist(),
+            "generation": manifest["generation"],
+            "committed_at": datetime.now(timezone.utc).isoformat(),
+        }
+        for sample_id in features.index:
+            manifest["samples"][sample_id] = filename
+        # Drop partitions no sample points to any more from the snapshot
+        live = set(manifest["samples"].values())
+        manifest["partitions"] = {k: v for k, v in manifest["partitions"].items() if k in live}
+        _atomic_write_json(_manifest_path(store_dir), manifest)
+    return manifest
+
+
+def remove(sample_ids: Sequence[str], store_dir: str = FEATURE_STORE_DIR) -> int:
+    """
+    Drops samples from the store, e.g. when their jobs are deleted. Partitions
+    no remaining sample points to are deleted once the new manifest is in
+    place. Returns the bytes freed.
+    """
+    freed = 0
+    with _writer_lock(store_dir):
+        manifest = snapshot(store_dir)
+        dropped = [sample_id for sample_id in sample_ids if sample_id in manifest["samples"]]
+        if not dropped:
+            return 0
+        manifest["generation"] += 1
+        for sample_id in dropped:
+            del manifest["samples"][sample_id]
+        live = set(manifest["samples"].values())
+        unused = [filename for filename in manifest["partitions"] if filename not in live]
+        manifest["partitions"] = {k: v for k, v in manifest["partitions"].items() if k in live}
+        _atomic_write_json(_manifest_path(store_dir), manifest)
+        for filename in unused:
+            path = os.path.join(store_dir, "partitions", filename)
+            try:
+                freed += os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return freed
+
+
+def read_matrix_file(matrix_path: str) -> pd.DataFrame:
+    """Reads a feature matrix file produced by the pipeline (Parquet or TSV), indexed by sample_id."""
+    if matrix_path.endswith(".parquet"):
+        return pd.read_parquet(matrix_path)
+    return pd.read_csv(matrix_path, sep="\t", index_col="sample_id")
+
+
+def write_matrix_file(features: pd.DataFrame, matrix_path: str):
+    """Writes a feature matrix file in the format its extension names, replacing any existing file atomically."""
+    tmp_path = f"{matrix_path}.tmp.{os.getpid()}.{uuid.uuid4().hex[:8]}"
+    if matrix_path.endswith(".parquet"):
+        features.to_parquet(tmp_path, engine="pyarrow", index=True)
+    else:
+        features.to_csv(tmp_path, sep="\t", index=True)
+    os.replace(tmp_path, matrix_path)
+
+
+def commit_matrix_file(matrix_path: str, partition_id: str, sample_ids: Optional[Sequence[str]] = None, store_dir: str = FEATURE_STORE_DIR) -> dict:
+    """Commits rows of a feature matrix file produced by the pipeline, optionally renaming its samples."""
+    features = read_matrix_file(matrix_path)
+    if sample_ids is not None:
+        features.index = pd.Index(list(sample_ids), name="sample_id")
+    return commit(features, partition_id, store_dir)
+
+
+def columns(manifest: dict) -> list:
+    """All feature columns present in a snapshot, in first-seen order."""
+    seen = {}
+    for partition in manifest["partitions"].values():
+        for col in partition["columns"]:
+            seen.setdefault(col, None)
+    return list(seen)
+
+
+def read(samples: Optional[Sequence[str]] = None, cols: Optional[Sequence[str]] = None, manifest: Optional[dict] = None, store_dir: str = FEATURE_STORE_DIR) -> pd.DataFrame:
+    """
+    Reads features for the selected samples and columns from one snapshot.
+    Only the partitions holding those samples are opened, and only the requested columns are decoded.
+    """
+    manifest = manifest or snapshot(store_dir)
+    wanted = list(manifest["samples"]) if samples is None else [s for s in samples if s in manifest["samples"]]
+    by_partition = {}
+    for sample_id in wanted:
+        by_partition.setdefault(manifest["samples"][sample_id], []).append(sample_id)
+
+    frames = []
+    for filename, sample_ids in by_partition.items():
+        available = manifest["partitions"][filename]["columns"]
+        read_cols = available if cols is None else [c for c in cols if c in available]
+        table = pq.read_table(os.path.join(store_dir, "partitions", filename), columns=read_cols + ["sample_id"])
+        frame = table.to_pandas()
+        if "sample_id" in frame.columns:
+            frame = frame.set_index("sample_id")
+        frames.append(frame.loc[frame.index.intersection(sample_ids)])
+
+    result_cols = columns(manifest) if cols is None else list(cols)
+    if not frames:
+        return pd.DataFrame(columns=result_cols, index=pd.Index([], name="sample_id"))
+    return pd.concat(frames).reindex(columns=result_cols)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a snapshot of the TRACE feature store.")
+    parser.add_argument("--output", required=True, help="Output matrix (.parquet or .tsv).")
+    parser.add_argument("--store", default=FEATURE_STORE_DIR)
+    args = parser.parse_args()
+    matrix = read(store_dir=args.store)
+    if args.output.endswith(".parquet"):
+        matrix.to_parquet(args.output, index=True)
+    else:
+        matrix.to_csv(args.output, sep="\t", index=True)
+    print(f"Exported {len(matrix)} samples x {matrix.shape[1]} columns to {args.output}")
@@ -3,6 +3,7 @@ import os
 from backend.database import Base, engine
 from backend import models # Import models to ensure SQLAlchemy knows about your tables
 
+
 def init_db():
     print("Attempting to create database tables via init-db service...")
     # This will create tables if they don't exist
@@ -14,5 +15,6 @@ def init_db():
         # Optionally, re-raise the exception if you want the container to fail on db init error
         # raise
 
+
 if __name__ == "__main__":
     init_db()
\ No newline at end of file
@@ -0,0 +1,345 @@
+import fcntl
+import glob
+import json
+import os
+import re
+import shutil
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.orm import Session
+
+from . import models, progress, result_cache, artifacts, feature_store
+from .database import session_scope, run_with_retry
+from .pipeline_config import PIPELINE_DIR, RESULTS_DIR, JOB_LOG_DIR, load_pipeline_config, run_log_path, sample_benchmark_dir
+from .uploads import UPLOAD_DIR, UPLOAD_SESSION_TTL_HOURS, partial_path
+
+# --- Configuration ---
+# Snakemake's working directory; data/raw, data/cache and rule logs live under it
+APP_DIR = os.path.dirname(PIPELINE_DIR)
+RAW_DATA_DIR = os.path.join(APP_DIR, "data", "raw")
+RULE_LOG_DIR = os.path.join(APP_DIR, "logs")
+# Once the results volume is fuller than the high watermark, evict until it is below the low one
+STORAGE_HIGH_WATERMARK = float(os.environ.get('TRACE_STORAGE_HIGH_WATERMARK', 0.85))
+STORAGE_LOW_WATERMARK = float(os.environ.get('TRACE_STORAGE_LOW_WATERMARK', 0.75))
+# Budget for evictable intermediates (finished jobs' uploads, the download cache) regardless of free space
+INTERMEDIATE_MAX_BYTES = int(os.environ.get('TRACE_INTERMEDIATE_MAX_BYTES', 100 * 1024 ** 3))
+# Finished jobs' text outputs are compacted once they are this old
+COMPACT_AFTER_HOURS = float(os.environ.get('TRACE_COMPACT_AFTER_HOURS', 24))
+# Files no job refers to are only removed once this old, so in-flight work is never touched
+ORPHAN_GRACE_HOURS = float(os.environ.get('TRACE_ORPHAN_GRACE_HOURS', 24))
+SWEEP_INTERVAL_SECONDS = int(os.environ.get('TRACE_STORAGE_SWEEP_INTERVAL_SECONDS', 3600))
+# On the results volume, so sweeps started on different hosts exclude each other
+SWEEP_LOCK_PATH = os.path.join(RESULTS_DIR, ".sweep.lock")
+
+# Subdirectories every sample's results directory has one of
+SAMPLE_OUTPUT_DIRS = ("qc", "fragmentomics", "methylomics", "dl_features")
+# Names download_data.py gives a sample's input under data/raw (plus an index)
+RAW_SUFFIXES = (".betas.tsv", ".bam.bai", ".bam")
+FEATURE_MATRIX_RE = re.compile(r"^TRACE_v[^_]+_(.+)_feature_matrix\.")
+
+
+def cleanup_intermediates() -> bool:
+    """`cleanup_intermediates` in the pipeline config (on unless disabled)."""
+    return bool(load_pipeline_config().get("cleanup_intermediates", True))
+
+
+def download_cache_dir() -> str:
+    return os.path.join(APP_DIR, load_pipeline_config()["download"]["cache_dir"])
+
+
+# --- Disk Helpers ---
+def disk_bytes(*paths) -> int:
+    """Bytes allocated to files and directory trees; hard links are counted once, symlinks not followed."""
+    seen, total = set(), 0
+    for path in paths:
+        files = [path] if not os.path.isdir(path) or os.path.islink(path) else (
+            os.path.join(d, f) for d, _, names in os.walk(path) for f in names
+        )
+        for file in files:
+            try:
+                stat = os.lstat(file)
+            except FileNotFoundError:
+                continue
+            if (stat.st_dev, stat.st_ino) not in seen:
+                seen.add((stat.st_dev, stat.st_ino))
+                total += stat.st_blocks * 512
+    return total
+
+
+def remove_paths(paths) -> int:
+    """Deletes files and directory trees that exist; returns the bytes freed."""
+    paths = [path for path in paths if path and os.path.lexists(path)]
+    freed = disk_bytes(*paths)
+    for path in paths:
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+    return freed
+
+
+def raw_inputs(sample_id: str) -> list:
+    """Links to a sample's input under data/raw, made by download_data.py."""
+    return [path for path in (os.path.join(RAW_DATA_DIR, sample_id + suffix) for suffix in RAW_SUFFIXES) if os.path.lexists(path)]
+
+
+def run_files(run_id: str) -> list:
+    """A run's feature matrix (with its TSV export and compressed copies), its run logs and its merge log."""
+    paths = [f"{path}{suffix}" for path in artifacts.matrix_outputs(run_id) for suffix in ("", ".gz", ".zst")]
+    paths += [run_log_path(run_id), run_log_path(f"{run_id}_remerge")]
+    paths.append(os.path.join(RULE_LOG_DIR, f"metadata_merge_{run_id}.log"))
+    return [path for path in paths if os.path.lexists(path)]
+
+
+def job_files(job) -> list:
+    """Everything on disk that belongs to one job."""
+    sample_id = job.sample_id
+    paths = [job.input_path, artifacts.sample_dir(sample_id), sample_benchmark_dir(sample_id)]
+    paths += raw_inputs(sample_id)
+    paths += glob.glob(os.path.join(glob.escape(RULE_LOG_DIR), "*", f"{glob.escape(sample_id)}.log"))
+    paths += run_files(sample_id)
+    return paths
+
+
+def output_bytes(sample_id: str) -> int:
+    """Bytes held by a sample's retained outputs."""
+    return disk_bytes(artifacts.sample_dir(sample_id), *run_files(sample_id))
+
+
+def timestamp(moment: datetime) -> float:
+    """POSIX time of a stored datetime; SQLite returns them naive, in UTC."""
+    return (moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)).timestamp()
+
+
+# --- Jobs ---
+def delete_job(db: Session, job) -> int:
+    """
+    Deletes a job and its files: its upload, data/raw links, results,
+    feature matrix, feature store rows and logs. A batch's shared files go
+    with its last job. Returns the bytes freed.
+    """
+    paths, batch_id, sample_id = job_files(job), job.batch_id, job.sample_id
+    db.delete(job)
+    db.commit()
+    if batch_id and not db.query(models.AnalysisJob.id).filter(models.AnalysisJob.batch_id == batch_id).first():
+        paths += run_files(batch_id)
+    return remove_paths(paths) + remove_features([sample_id])
+
+
+def discard_outputs(jobs, keep_logs: bool = True) -> int:
+    """
+    Removes what cancelled runs leave behind: partial results, published
+    features, data/raw links, rule logs and benchmarks. Uploads stay, and run
+    logs too unless `keep_logs` is off (the jobs were deleted). Returns the
+    bytes freed.
+    """
+    logs = {run_log_path(job.sample_id) for job in jobs} if keep_logs else set()
+    freed = remove_paths([path for job in jobs for path in job_files(job) if path != job.input_path and path not in logs])
+    return freed + remove_features([job.sample_id for job in jobs])
+
+
+def remove_features(sample_ids) -> int:
+    """Drops samples from the feature store; best effort, like file removal."""
+    try:
+        return feature_store.remove([sample_id for sample_id in sample_ids if sample_id])
+    except Exception as e:
+        print(f"Could not remove features of {list(sample_ids)}: {e}")
+        return 0
+
+
+def settle_jobs(jobs, batch_id: str = None):
+    """
+    Storage bookkeeping once jobs have finished: with cleanup_intermediates,
+    drops their data/raw links (and a batch's merged matrix, already split
+    per sample and published); records what their outputs occupy.
+    Best effort, like caching: never fails the job.
+    """
+    try:
+        if cleanup_intermediates():
+            remove_paths([path for job in jobs for path in raw_inputs(job.sample_id)])
+            if batch_id is not None:
+                remove_paths(artifacts.matrix_outputs(batch_id))
+        record_output_bytes(jobs)
+    except Exception as e:
+        print(f"Could not settle storage for jobs {[job.id for job in jobs]}: {e}")
+
+
+def record_output_bytes(jobs):
+    """Records what each job's outputs occupy now, e.g. after compressed copies were added."""
+    sizes = {job.id: output_bytes(job.sample_id) for job in jobs}
+
+    def work(db):
+        for job_id, size in sizes.items():
+            db.query(models.AnalysisJob).filter(models.AnalysisJob.id == job_id).update({"output_bytes": size}, synchronize_session=False)
+    run_with_retry(work)
+
+
+# --- Sweeper ---
+def volume_usage(path: str = RESULTS_DIR) -> float:
+    usage = shutil.disk_usage(path)
+    return usage.used / usage.total
+
+
+def compact_finished(db: Session, now: datetime) -> int:
+    """Compacts the text outputs of jobs finished more than COMPACT_AFTER_HOURS ago; returns bytes freed."""
+    Job = models.AnalysisJob
+    cutoff = now - timedelta(hours=COMPACT_AFTER_HOURS)
+    due = db.query(Job).filter(Job.status == "complete", Job.compacted_at.is_(None), Job.finished_at < cutoff).all()
+    freed = 0
+    for job in due:
+        try:
+            freed += artifacts.compact_sample(job.sample_id)
+        except OSError as e:
+            print(f"Could not compact outputs of job {job.id}: {e}")
+            continue
+        job.compacted_at = now
+        job.output_bytes = output_bytes(job.sample_id)
+        db.commit()
+    return freed
+
+
+def eviction_candidates(db: Session):
+    """
+    Intermediates that can be rebuilt or are no longer needed, as
+    (last used, paths, bytes, job id or None): finished jobs' uploads and
+    download cache entries. Jobs whose upload is already gone get their
+    input_path cleared.
+    """
+    Job = models.AnalysisJob
+    candidates, gone = [], []
+    finished = db.query(Job.id, Job.sample_id, Job.input_path, Job.finished_at, Job.created_at).filter(
+        Job.status.in_(progress.TERMINAL_STATUSES), Job.input_path.isnot(None)
+    ).all()
+    for job_id, sample_id, input_path, finished_at, created_at in finished:
+        if not os.path.exists(input_path):
+            # Removed already (e.g. a cache hit's upload); stop counting it against the user
+            gone.append(job_id)
+            continue
+        paths = [input_path] + raw_inputs(sample_id)
+        candidates.append((timestamp(finished_at or created_at), paths, disk_bytes(*paths), job_id))
+    cache_dir = download_cache_dir()
+    if os.path.isdir(cache_dir):
+        for entry in os.scandir(cache_dir):
+            if entry.is_dir(follow_symlinks=False):
+                meta = os.path.join(entry.path, "entry.json")
+                last_used = os.path.getmtime(meta) if os.path.exists(meta) else entry.stat().st_mtime
+                candidates.append((last_used, [entry.path], disk_bytes(entry.path), None))
+    if gone:
+        db.query(Job).filter(Job.id.in_(gone)).update({"input_path": None}, synchronize_session=False)
+        db.commit()
+    return sorted(candidates, key=lambda c: c[0])
+
+
+def evict_intermediates(db: Session) -> int:
+    """
+    Evicts intermediates, least recently used first, while they exceed
+    INTERMEDIATE_MAX_BYTES or the volume is past its high watermark (then
+    down to the low one). Returns the bytes freed.
+    """
+    candidates = eviction_candidates(db)
+    held = sum(c[2] for c in candidates)
+    pressured = volume_usage() > STORAGE_HIGH_WATERMARK
+    freed = 0
+    for _, paths, size, job_id in candidates:
+        if held <= INTERMEDIATE_MAX_BYTES and (not pressured or volume_usage() <= STORAGE_LOW_WATERMARK):
+            break
+        freed += remove_paths(paths)
+        held -= size
+        if job_id is not None:
+            # The input is gone; the job's outputs and cached result remain
+            db.query(models.AnalysisJob).filter(models.AnalysisJob.id == job_id).update({"input_path": None}, synchronize_session=False)
+            db.commit()
+    return freed
+
+
+def remove_orphans(db: Session, now: float) -> int:
+    """Removes uploads, data/raw links, results and run files no job refers to any more."""
+    Job = models.AnalysisJob
+    runs = {row[0] for row in db.query(Job.sample_id)} | {row[0] for row in db.query(Job.batch_id).filter(Job.batch_id.isnot(None))}
+    inputs = {os.path.abspath(row[0]) for row in db.query(Job.input_path).filter(Job.input_path.isnot(None))}
+    inputs |= {os.path.abspath(partial_path(row[0])) for row in db.query(models.UploadSession.path)}
+
+    def old(path):
+        return now - os.lstat(path).st_mtime > ORPHAN_GRACE_HOURS * 3600
+
+    orphans = []
+    if os.path.isdir(UPLOAD_DIR):
+        orphans += [e.path for e in os.scandir(UPLOAD_DIR) if e.is_file() and os.path.abspath(e.path) not in inputs and old(e.path)]
+    if os.path.isdir(RAW_DATA_DIR):
+        for entry in os.scandir(RAW_DATA_DIR):
+            sample_id = next((entry.name[:-len(s)] for s in RAW_SUFFIXES if entry.name.endswith(s)), None)
+            if sample_id is not None and sample_id not in runs and old(entry.path):
+                orphans.append(entry.path)
+    if os.path.isdir(RESULTS_DIR):
+        for entry in os.scandir(RESULTS_DIR):
+            if entry.is_dir(follow_symlinks=False):
+                is_sample = any(os.path.isdir(os.path.join(entry.path, d)) for d in SAMPLE_OUTPUT_DIRS)
+                if is_sample and entry.name not in runs and old(entry.path):
+                    orphans.append(entry.path)
+            else:
+                match = FEATURE_MATRIX_RE.match(entry.name)
+                if match and match.group(1) not in runs and old(entry.path):
+                    orphans.append(entry.path)
+    if os.path.isdir(JOB_LOG_DIR):
+        for entry in os.scandir(JOB_LOG_DIR):
+            # <run>.log, <batch>_remerge.log, or <sample>.<rule>.log while a distributed job runs
+            stem = entry.name.removesuffix(".log")
+            owners = {stem, stem.removesuffix("_remerge"), stem.rsplit(".", 1)[0]}
+            if entry.is_file() and not owners & runs and old(entry.path):
+                orphans.append(entry.path)
+    return remove_paths(orphans)
+
+
+def expire_upload_sessions(db: Session, now: datetime) -> int:
+    """Drops resumable uploads idle for longer than their TTL, with any unfinished data. Returns the bytes freed."""
+    Upload = models.UploadSession
+    expired = db.query(Upload).filter(Upload.updated_at < now - timedelta(hours=UPLOAD_SESSION_TTL_HOURS)).all()
+    freed = 0
+    for session in expired:
+        if session.finalized_at is None:
+            freed += remove_paths([partial_path(session.path)])
+        db.delete(session)
+    db.commit()
+    return freed
+
+
+def sweep() -> dict:
+    """
+    One pass of the storage lifecycle: compact finished jobs' text outputs,
+    expire abandoned uploads, remove files of deleted jobs, trim the result cache and evict
+    intermediates under the disk budget. Only one sweep runs at a time.
+    """
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(SWEEP_LOCK_PATH, "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return {"skipped": "another sweep is running"}
+        try:
+            report = {"volume_usage_before": round(volume_usage(), 4)}
+            with session_scope() as db:
+                report["compacted_bytes"] = compact_finished(db, datetime.now(timezone.utc))
+                report["expired_upload_bytes"] = expire_upload_sessions(db, datetime.now(timezone.utc))
+                report["orphan_bytes"] = remove_orphans(db, time.time())
+                report["result_cache_evicted"] = result_cache.evict(db)
+                report["evicted_bytes"] = evict_intermediates(db)
+            report["volume_usage_after"] = round(volume_usage(), 4)
+            print(f"Storage sweep: {json.dumps(report)}")
+            return report
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+# --- Accounting ---
+def user_usage(db: Session, owner_id: int) -> dict:
+    """Disk space held by one user's jobs: inputs still on disk plus retained outputs."""
+    Job = models.AnalysisJob
+    jobs = db.query(Job.input_path, Job.input_size, Job.output_bytes).filter(Job.owner_id == owner_id).all()
+    # An input_path can outlive its file until the next sweep clears it
+    input_bytes = sum(size or 0 for path, size, _ in jobs if path is not None and os.path.exists(path))
+    outputs = sum(size or 0 for _, _, size in jobs)
+    return {"jobs": len(jobs), "input_bytes": input_bytes, "output_bytes": outputs, "total_bytes": input_bytes + outputs}
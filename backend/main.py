@@ -1,31 +1,39 @@
 import os
+import json
+import time
 import uuid
-import shutil
+import base64
 from contextlib import asynccontextmanager
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 from typing import List, Union
 
 from fastapi import (
     FastAPI, Depends, HTTPException, status, APIRouter,
-    UploadFile, File
+    UploadFile, File, Query, Request, Response
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel
+from sqlalchemy import and_, func, or_
 from sqlalchemy.orm import Session
 from celery.result import AsyncResult
+import redis
 
 # --- Local Imports ---
-from . import models, schemas, security
-from .database import engine, Base, get_db
-from .worker import run_trace_pipeline  # Import the Celery task
+from . import models, schemas, security, result_cache, feature_store, progress, scheduling, metrics, artifacts, lifecycle, uploads
+from .uploads import UPLOAD_DIR, save_upload_file
+from .database import engine, Base, get_db, run_with_retry
+from .pipeline_config import feature_matrix_path, sample_sheet_row
+from .worker import celery_app, enqueue_pipeline, enqueue_batch  # Queue jobs as Celery tasks
+
 
 # --- Lifespan and App Initialization ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initializes the application, creating database tables and upload directories."""
     print("Creating database tables...")
-    os.makedirs("uploads", exist_ok=True)
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
     yield
 
 app = FastAPI(lifespan=lifespan)
@@ -39,16 +47,60 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+# --- Request Metrics ---
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """Observes every request in a latency histogram labelled by route template, not raw path."""
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.HTTP_REQUEST_SECONDS.labels(
+            request.method, route.path if route is not None else "unmatched", str(status_code)
+        ).observe(time.perf_counter() - start)
+
+
 # --- Helper Function ---
 def get_user_by_email(db: Session, email: str):
     """Fetches a user by their email address."""
     return db.query(models.User).filter(models.User.email == email).first()
 
+
+def get_owned_job(db: Session, job_id: int, current_user: security.CurrentUser) -> models.AnalysisJob:
+    """Fetches a job, raising 404 if it does not exist and 403 if it belongs to someone else."""
+    db_job = db.query(models.AnalysisJob).filter(models.AnalysisJob.id == job_id).first()
+    if db_job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    if db_job.owner_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access this job")
+    return db_job
+
+
+def encode_cursor(job: models.AnalysisJob) -> str:
+    """Opaque keyset cursor for the position right after `job`."""
+    raw = json.dumps([job.created_at.isoformat(), job.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, job_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), int(job_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
 # --- Authentication Router ---
 auth_router = APIRouter(
     tags=["Authentication"]
 )
 
+
 @auth_router.post("/users/", response_model=schemas.User)
 def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     """Creates a new user in the database."""
@@ -63,6 +115,7 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     db.refresh(db_user)
     return db_user
 
+
 @auth_router.post("/token")
 def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """Authenticates a user and returns a JWT access token."""
@@ -75,76 +128,367 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
         )
     
     access_token_expires = timedelta(minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = security.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
-    )
+    access_token = security.create_user_access_token(user, expires_delta=access_token_expires)
     
     return {"access_token": access_token, "token_type": "bearer"}
 
+
+@auth_router.get("/users/me/storage", response_model=schemas.StorageUsage)
+def read_users_me_storage(
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """Disk space the current user's jobs hold: uploads still on disk and retained outputs."""
+    return lifecycle.user_usage(db, current_user.id)
+
+
 @auth_router.get("/users/me/", response_model=schemas.User)
-async def read_users_me(current_user: models.User = Depends(security.get_current_user)):
+async def read_users_me(current_user: security.CurrentUser = Depends(security.get_current_user)):
     """Returns the details of the currently authenticated user."""
     return current_user
 
 # --- Analysis Job Router ---
 analysis_router = APIRouter(
     prefix="/analyses",
-    tags=["Analyses"],
-    dependencies=[Depends(security.get_current_user)]
+    tags=["Analyses"]
 )
 
-@analysis_router.post("/", response_model=schemas.AnalysisJob, status_code=status.HTTP_201_CREATED)
-async def create_analysis_job(
-    file: UploadFile = File(...),
-    # A simple way to get data type from the user. Could be a form field.
-    data_type: str = "WGS", 
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(security.get_current_user)
-):
-    """
-    Handles file uploads, creates an analysis job record, and triggers the pipeline.
-    """
+
+def upload_destination(filename: str):
+    """A new sample ID for an uploaded file and the path its data is stored at."""
     # Sanitize filename and create a unique ID for this run
-    safe_filename = "".join(c for c in file.filename if c.isalnum() or c in ('.', '_', '-')).strip()
+    safe_filename = "".join(c for c in filename if c.isalnum() or c in ('.', '_', '-')).strip()
     unique_id = str(uuid.uuid4().hex)[:8]
     sample_id = f"{os.path.splitext(safe_filename)[0]}_{unique_id}"
-    
-    file_path = os.path.join("uploads", f"{sample_id}_{safe_filename}")
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    return sample_id, os.path.join(UPLOAD_DIR, f"{sample_id}_{safe_filename}")
+
 
+def record_job(
+    db: Session,
+    current_user: security.CurrentUser,
+    filename: str,
+    sample_id: str,
+    data_type: str,
+    file_path: str,
+    input_sha256: str,
+    input_size: int,
+    batch_id: Union[str, None] = None,
+    priority: int = 0
+) -> models.AnalysisJob:
+    """
+    Records the AnalysisJob of an input stored at `file_path`.
+    Jobs whose input is already in the result cache come back complete.
+    """
     db_job = models.AnalysisJob(
         owner_id=current_user.id,
         status="pending",
-        results=f"File '{file.filename}' uploaded. Job is queued."
+        results=f"File '{filename}' uploaded. Job is queued.",
+        sample_id=sample_id,
+        data_type=data_type,
+        input_path=file_path,
+        batch_id=batch_id,
+        input_sha256=input_sha256,
+        input_size=input_size,
+        priority=priority
     )
+
+    # Identical input under the same pipeline version/config: reuse the cached result
+    cached = result_cache.lookup(db, input_sha256, data_type)
+    if cached is not None:
+        output_file = result_cache.materialize(cached, feature_matrix_path(sample_id), sample_sheet_row(sample_id, data_type, file_path))
+        os.remove(file_path)
+        db_job.status = "complete"
+        db_job.results = f"Identical input already processed; reused cached results. Results at: {output_file}"
+        db_job.finished_at = datetime.now(timezone.utc)
+        db_job.output_bytes = lifecycle.output_bytes(sample_id)
+        try:
+            feature_store.commit_matrix_file(output_file, sample_id)
+        except Exception as e:
+            print(f"Could not publish cached features for {sample_id}: {e}")
+
     db.add(db_job)
     db.commit()
     db.refresh(db_job)
-    
-    # Trigger the bioinformatics pipeline via Celery
-    run_trace_pipeline.delay(
-        job_id=db_job.id, 
-        input_file_path=file_path,
-        sample_id=sample_id,
-        data_type=data_type
-    )
-    
     return db_job
 
-@analysis_router.get("/", response_model=List[schemas.AnalysisJob])
+
+async def register_upload(
+    file: UploadFile,
+    data_type: str,
+    db: Session,
+    current_user: security.CurrentUser,
+    batch_id: Union[str, None] = None,
+    priority: int = 0
+) -> models.AnalysisJob:
+    """Streams one upload to disk and records its AnalysisJob."""
+    sample_id, file_path = upload_destination(file.filename)
+    # Stream to disk off the event loop, checksumming and size-limiting as we go
+    input_sha256, input_size = await save_upload_file(file, file_path)
+    metrics.UPLOAD_BYTES.labels(data_type).inc(input_size)
+    return record_job(db, current_user, file.filename, sample_id, data_type, file_path, input_sha256, input_size, batch_id=batch_id, priority=priority)
+
+
+def enqueue_job(db_job: models.AnalysisJob):
+    """Triggers the bioinformatics pipeline for a job via Celery, unless it was served from the cache."""
+    if db_job.status == "complete":
+        return
+    enqueue_pipeline(db_job.id, db_job.input_path, db_job.sample_id, db_job.data_type, db_job.priority)
+
+
+@analysis_router.post("/", response_model=schemas.AnalysisJob, status_code=status.HTTP_201_CREATED)
+async def create_analysis_job(
+    file: UploadFile = File(...),
+    # A simple way to get data type from the user. Could be a form field.
+    data_type: str = "WGS", 
+    # 0 (normal) to 9; urgent jobs are served first and may preempt less urgent ones
+    priority: int = Query(0, ge=0, le=scheduling.MAX_PRIORITY),
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """
+    Handles file uploads, creates an analysis job record, and triggers the pipeline.
+    """
+    db_job = await register_upload(file, data_type, db, current_user, priority=priority)
+    enqueue_job(db_job)
+    return db_job
+
+
+@analysis_router.post("/batch", response_model=List[schemas.AnalysisJob], status_code=status.HTTP_201_CREATED)
+async def create_analysis_batch(
+    files: List[UploadFile] = File(...),
+    data_type: str = "WGS",
+    priority: int = Query(0, ge=0, le=scheduling.MAX_PRIORITY),
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """
+    Uploads many samples at once and runs them in a single Snakemake invocation.
+    Each file still gets its own AnalysisJob; cached inputs complete immediately.
+    """
+    batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+    db_jobs = [await register_upload(file, data_type, db, current_user, batch_id=batch_id, priority=priority) for file in files]
+
+    queued_ids = [job.id for job in db_jobs if job.status != "complete"]
+    if queued_ids:
+        enqueue_batch(batch_id, queued_ids, data_type, priority)
+
+    return db_jobs
+
+
+@analysis_router.get("/", response_model=schemas.AnalysisJobPage)
 def get_user_analysis_jobs(
+    limit: int = Query(default=50, ge=1, le=500),
+    cursor: Union[str, None] = None,
+    status_filter: Union[str, None] = Query(default=None, alias="status"),
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """
+    Lists the current user's jobs, newest first, one page at a time.
+
+    Paging is keyset-based on (created_at, id), served by the owner/created_at
+    index, so deep pages cost the same as the first. Items are slim summaries;
+    fetch /analyses/{job_id} and /analyses/{job_id}/log for details.
+    """
+    Job = models.AnalysisJob
+    query = db.query(Job.id, Job.status, Job.created_at, Job.sample_id, Job.data_type, Job.batch_id).filter(Job.owner_id == current_user.id)
+    if status_filter is not None:
+        query = query.filter(Job.status == status_filter)
+    if cursor is not None:
+        created_at, job_id = decode_cursor(cursor)
+        query = query.filter(or_(Job.created_at < created_at, and_(Job.created_at == created_at, Job.id < job_id)))
+
+    # Fetch one extra row to know whether another page follows
+    rows = query.order_by(Job.created_at.desc(), Job.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {"items": rows[:limit], "next_cursor": next_cursor}
+
+
+@analysis_router.get("/{job_id}", response_model=schemas.AnalysisJob)
+def get_analysis_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """Returns the full record of one job."""
+    return get_owned_job(db, job_id, current_user)
+
+
+@analysis_router.get("/{job_id}/log", response_model=schemas.JobLog)
+def get_analysis_job_log(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """Returns the last lines of a job's pipeline log and where the full log is kept."""
+    db_job = get_owned_job(db, job_id, current_user)
+    if db_job.log is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No log recorded for this job yet")
+    return db_job.log
+
+
+@analysis_router.get("/{job_id}/log/full")
+def download_analysis_job_log(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """Streams a job's complete Snakemake log as plain text."""
+    db_job = get_owned_job(db, job_id, current_user)
+    if db_job.log is None or not db_job.log.log_path or not os.path.exists(db_job.log.log_path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Log file not found")
+    return FileResponse(db_job.log.log_path, media_type="text/plain")
+
+
+@analysis_router.get("/{job_id}/artifacts", response_model=List[schemas.Artifact])
+def list_analysis_job_artifacts(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """Lists a job's outputs: feature matrix, QC report and plots, ichorCNA and per-module tables."""
+    db_job = get_owned_job(db, job_id, current_user)
+    return [{"name": name, **artifacts.describe(path)} for name, path in artifacts.list_artifacts(db_job.sample_id).items()]
+
+
+@analysis_router.api_route("/{job_id}/artifacts/{name:path}", methods=["GET", "HEAD"])
+def download_analysis_job_artifact(
+    job_id: int,
+    name: str,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """
+    Downloads one output. Supports Range (resumable downloads), ETag /
+    If-None-Match, and gzip or zstd Content-Encoding for text tables.
+    """
+    db_job = get_owned_job(db, job_id, current_user)
+    path = artifacts.resolve(db_job.sample_id, name)
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Artifact not found")
+    # Large downloads must not hold a database connection
+    db.close()
+    return artifacts.file_response(path, request.headers, os.path.basename(name))
+
+
+@analysis_router.get("/{job_id}/bundle")
+def download_analysis_job_bundle(
+    job_id: int,
+    names: Union[List[str], None] = Query(default=None, alias="name"),
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """Streams several outputs (all by default, or each `name` given) as one tar archive."""
+    db_job = get_owned_job(db, job_id, current_user)
+    available = artifacts.list_artifacts(db_job.sample_id)
+    if names:
+        missing = [name for name in names if name not in available]
+        if missing:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Artifacts not found: {', '.join(missing)}")
+        available = {name: available[name] for name in names}
+    if not available:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No artifacts recorded for this job yet")
+    sample_id = db_job.sample_id
+    db.close()
+    return artifacts.bundle_response(sample_id, available)
+
+
+@analysis_router.get("/{job_id}/metrics", response_model=schemas.JobMetrics)
+def get_analysis_job_metrics(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """Queue wait, run and end-to-end time of a job, and the resources each of its rules used."""
+    db_job = get_owned_job(db, job_id, current_user)
+
+    def seconds(start, end):
+        return (end - start).total_seconds() if start is not None and end is not None else None
+
+    return {
+        "job_id": db_job.id,
+        "queue_wait_s": seconds(db_job.created_at, db_job.started_at),
+        "run_s": seconds(db_job.started_at, db_job.finished_at),
+        "total_s": seconds(db_job.created_at, db_job.finished_at),
+        "rules": db_job.rule_metrics,
+    }
+
+
+@analysis_router.get("/{job_id}/events")
+async def stream_analysis_job_events(
+    job_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(security.get_current_user)
+    current_user: security.CurrentUser = Depends(security.get_current_user)
 ):
-    """Retrieves all analysis jobs for the current user."""
-    return db.query(models.AnalysisJob).filter(models.AnalysisJob.owner_id == current_user.id).all()
+    """
+    Streams a job's progress as Server-Sent Events: rules completed out of
+    total, the rule currently running, and status changes. The stream ends
+    once the job is complete or failed.
+    """
+    job_status = get_owned_job(db, job_id, current_user).status
+    db.close()
+
+    async def event_stream():
+        if job_status in progress.TERMINAL_STATUSES:
+            yield f"data: {json.dumps({'job_id': job_id, 'type': 'status', 'status': job_status})}\n\n"
+            return
+        async for event in progress.subscribe(job_id):
+            # None is a keep-alive tick; SSE comments are ignored by clients
+            yield ": keep-alive\n\n" if event is None else f"data: {event}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def cancel_job(db: Session, db_job: models.AnalysisJob) -> bool:
+    """
+    Cancels a queued or running job: marks it cancelled, revokes its queued
+    task and asks the worker running it to kill its Snakemake process group
+    and discard partial outputs. Returns False if the job already finished.
+    """
+    if db_job.status in progress.TERMINAL_STATUSES:
+        return False
+    db_job.status = "cancelled"
+    db_job.results = "Cancelled by user."
+    db_job.finished_at = datetime.now(timezone.utc)
+    db.commit()
+    scheduling.request_stop([db_job.id], "cancel")
+    # A batch shares one task; the rest of the batch keeps running
+    Job = models.AnalysisJob
+    shared = db_job.task_id and db.query(Job.id).filter(
+        Job.task_id == db_job.task_id, Job.id != db_job.id, Job.status.notin_(progress.TERMINAL_STATUSES)
+    ).first()
+    if db_job.task_id and not shared:
+        try:
+            celery_app.control.revoke(db_job.task_id)
+        except Exception as e:
+            # The worker still sees the stop request before running the task
+            print(f"Could not revoke task {db_job.task_id}: {e}")
+    progress.publish_status([db_job.id], "cancelled")
+    return True
+
+
+@analysis_router.post("/{job_id}/cancel", response_model=schemas.AnalysisJob)
+def cancel_analysis_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """
+    Stops a queued or running job and frees the worker cores it holds.
+    Its partial outputs are removed; the upload and log are kept.
+    """
+    db_job = get_owned_job(db, job_id, current_user)
+    if not cancel_job(db, db_job):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job already {db_job.status}")
+    return db_job
+
 
 @analysis_router.delete("/{job_id}", status_code=status.HTTP_200_OK)
 def delete_analysis_job(
     job_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(security.get_current_user)
+    current_user: security.CurrentUser = Depends(security.get_current_user)
 ):
     """
     Deletes an analysis job by its ID.
@@ -160,11 +504,271 @@ def delete_analysis_job(
     if db_job.owner_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to delete this job")
 
-    # If all checks pass, delete the job and commit the change
-    db.delete(db_job)
+    # If all checks pass, stop it if it is still queued or running, then
+    # delete it along with its files on disk
+    cancel_job(db, db_job)
+    freed = lifecycle.delete_job(db, db_job)
+
+    return {"message": f"Successfully deleted job {job_id}", "freed_bytes": freed}
+
+
+# --- Resumable Upload Router ---
+upload_router = APIRouter(
+    prefix="/uploads",
+    tags=["Uploads"]
+)
+
+
+def get_owned_session(db: Session, session_id: str, current_user: security.CurrentUser) -> models.UploadSession:
+    """Fetches an upload session, raising 404 if it does not exist (or expired) and 403 if it is someone else's."""
+    session = db.query(models.UploadSession).filter(models.UploadSession.id == session_id).first()
+    if session is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload session not found")
+    if session.owner_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access this upload")
+    return session
+
+
+def upload_session_state(session: models.UploadSession) -> dict:
+    received = [part.index for part in session.parts]
+    contiguous = 0
+    for index, part in enumerate(session.parts):
+        if part.index != index:
+            break
+        contiguous += part.size
+    return {
+        "id": session.id,
+        "filename": session.filename,
+        "data_type": session.data_type,
+        "size": session.size,
+        "part_size": session.part_size,
+        "part_count": uploads.part_count(session.size, session.part_size),
+        "received": received,
+        "received_bytes": sum(part.size for part in session.parts),
+        "contiguous_bytes": contiguous,
+        "job_id": session.job_id,
+        "expires_at": session.updated_at + timedelta(hours=uploads.UPLOAD_SESSION_TTL_HOURS),
+    }
+
+
+@upload_router.post("/", response_model=schemas.UploadSession, status_code=status.HTTP_201_CREATED)
+def create_upload_session(
+    upload: schemas.UploadSessionCreate,
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """
+    Starts a resumable upload. PUT each part (`part_size` bytes, the last
+    one shorter) to /uploads/{id}/parts/{index}, in any order and in
+    parallel, then POST /uploads/{id}/complete to create the analysis job.
+    """
+    uploads.check_upload_size(upload.size, UPLOAD_DIR)
+    sample_id, file_path = upload_destination(upload.filename)
+    uploads.allocate(uploads.partial_path(file_path), upload.size)
+    session = models.UploadSession(
+        id=uuid.uuid4().hex,
+        owner_id=current_user.id,
+        filename=upload.filename,
+        data_type=upload.data_type,
+        sample_id=sample_id,
+        path=file_path,
+        size=upload.size,
+        part_size=uploads.UPLOAD_PART_SIZE,
+        priority=upload.priority,
+    )
+    db.add(session)
     db.commit()
+    db.refresh(session)
+    return upload_session_state(session)
+
+
+@upload_router.get("/{session_id}", response_model=schemas.UploadSession)
+def get_upload_session(
+    session_id: str,
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """Which parts have arrived, so an interrupted upload sends only the rest."""
+    return upload_session_state(get_owned_session(db, session_id, current_user))
+
+
+@upload_router.put("/{session_id}/parts/{index}")
+async def upload_part(
+    session_id: str,
+    index: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """
+    Stores part `index` from the raw request body. Send its checksum as
+    `Content-Digest: sha-256=:<base64>:`; a part that does not match is
+    rejected and can simply be sent again.
+    """
+    session = get_owned_session(db, session_id, current_user)
+    if session.finalized_at is not None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload already completed")
+    if not 0 <= index < uploads.part_count(session.size, session.part_size):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No such part")
+    offset, length = uploads.part_range(session.size, session.part_size, index)
+    expected_sha256 = uploads.parse_content_digest(request.headers.get("content-digest"))
+    path, data_type = uploads.partial_path(session.path), session.data_type
+    # Parts can take minutes on slow links; do not hold a database connection meanwhile
+    db.close()
+
+    try:
+        part_sha256 = await uploads.write_part(request.stream(), path, offset, length, expected_sha256)
+    except FileNotFoundError:
+        # Completed (and renamed into place) or aborted while this part was being sent
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload was completed or aborted while this part was sent")
+    metrics.UPLOAD_BYTES.labels(data_type).inc(length)
+
+    def record(db):
+        finalized = db.query(models.UploadSession.finalized_at).filter(models.UploadSession.id == session_id).scalar()
+        if finalized is not None:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload was completed while this part was sent")
+        db.merge(models.UploadPart(session_id=session_id, index=index, size=length, sha256=part_sha256))
+        db.query(models.UploadSession).filter(models.UploadSession.id == session_id).update(
+            {"updated_at": datetime.now(timezone.utc)}, synchronize_session=False
+        )
+    run_with_retry(record)
+    return {"index": index, "size": length, "sha256": part_sha256}
+
+
+@upload_router.post("/{session_id}/complete", response_model=schemas.AnalysisJob, status_code=status.HTTP_201_CREATED)
+def complete_upload_session(
+    session_id: str,
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """
+    Finalizes an upload once every part has arrived: the file is renamed into
+    place (nothing is copied or re-read) and its analysis job is created and queued.
+    Completing again returns the same job.
+    """
+    session = get_owned_session(db, session_id, current_user)
+    if session.job_id is None:
+        parts = session.parts
+        missing = sorted(set(range(uploads.part_count(session.size, session.part_size))) - {p.index for p in parts})
+        if missing:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Missing parts: {missing[:100]}")
+        # Claim the session so a concurrent retry cannot create a second job
+        claimed = db.query(models.UploadSession).filter(
+            models.UploadSession.id == session_id, models.UploadSession.finalized_at.is_(None)
+        ).update({"finalized_at": datetime.now(timezone.utc)}, synchronize_session=False)
+        db.commit()
+        if not claimed:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload is being completed; retry shortly")
+        partial_path, moved = uploads.partial_path(session.path), False
+        try:
+            try:
+                os.replace(partial_path, session.path)
+            except FileNotFoundError:
+                raise HTTPException(status_code=status.HTTP_410_GONE, detail="Upload data is gone; start a new upload")
+            moved = True
+            # Parts were hashed as they arrived; no part can be recorded once the session is claimed
+            part_digests = db.query(models.UploadPart.sha256).filter(models.UploadPart.session_id == session_id).order_by(models.UploadPart.index)
+            input_sha256 = uploads.parts_sha256(session.part_size, [row.sha256 for row in part_digests])
+            db_job = record_job(db, current_user, session.filename, session.sample_id, session.data_type, session.path, input_sha256, session.size, priority=session.priority)
+            session.job_id = db_job.id
+            db.commit()
+        except Exception:
+            # Release the claim so the upload can be completed again or aborted
+            db.rollback()
+            if moved and os.path.exists(session.path):
+                os.replace(session.path, partial_path)
+            db.query(models.UploadSession).filter(models.UploadSession.id == session_id).update(
+                {"finalized_at": None}, synchronize_session=False
+            )
+            db.commit()
+            raise
+        enqueue_job(db_job)
+        return db_job
+    return get_owned_job(db, session.job_id, current_user)
+
+
+@upload_router.delete("/{session_id}", status_code=status.HTTP_200_OK)
+def abort_upload_session(
+    session_id: str,
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """Abandons an unfinished upload and frees its space."""
+    session = get_owned_session(db, session_id, current_user)
+    if session.finalized_at is not None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload already completed; delete its analysis instead")
+    freed = lifecycle.remove_paths([uploads.partial_path(session.path)])
+    db.delete(session)
+    db.commit()
+    return {"message": f"Aborted upload {session_id}", "freed_bytes": freed}
+
+
+# --- Feature Store Router ---
+feature_router = APIRouter(
+    prefix="/features",
+    tags=["Features"]
+)
+
+
+@feature_router.get("/", response_model=schemas.FeatureMatrix)
+def get_features(
+    samples: Union[List[str], None] = Query(default=None),
+    columns: Union[List[str], None] = Query(default=None),
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """
+    Returns features for selected samples and columns from one consistent snapshot
+    of the cohort feature store. Only the current user's samples are visible.
+    """
+    owned = {
+        row.sample_id for row in
+        db.query(models.AnalysisJob.sample_id).filter(models.AnalysisJob.owner_id == current_user.id, models.AnalysisJob.sample_id.isnot(None))
+    }
+    selected = sorted(owned) if samples is None else [s for s in samples if s in owned]
+
+    manifest = feature_store.snapshot()
+    matrix = feature_store.read(samples=selected, cols=columns, manifest=manifest)
+    matrix = matrix.astype(object).where(matrix.notna(), None)
+    return {
+        "generation": manifest["generation"],
+        "columns": matrix.columns.tolist(),
+        "rows": matrix.reset_index().to_dict(orient="records"),
+    }
+
+
+# --- Metrics Router ---
+metrics_router = APIRouter(
+    prefix="/metrics",
+    tags=["Metrics"]
+)
+
+
+@metrics_router.get("/rules", response_model=List[schemas.RuleMetricSummary])
+def get_rule_metrics(
+    data_type: Union[str, None] = None,
+    db: Session = Depends(get_db),
+    current_user: security.CurrentUser = Depends(security.get_current_user)
+):
+    """
+    Resource usage of each pipeline rule aggregated over all recorded jobs
+    (optionally of one data type), for sizing the `resources` profiles.
+    """
+    Metric = models.JobRuleMetric
+    query = db.query(
+        Metric.rule,
+        func.count(Metric.id).label("jobs"),
+        func.avg(Metric.wall_s).label("mean_wall_s"),
+        func.max(Metric.wall_s).label("max_wall_s"),
+        func.avg(Metric.cpu_s).label("mean_cpu_s"),
+        func.avg(Metric.cpu_s / func.nullif(Metric.wall_s, 0)).label("mean_cores_used"),
+        func.avg(Metric.max_rss_mb).label("mean_max_rss_mb"),
+        func.max(Metric.max_rss_mb).label("max_rss_mb"),
+    )
+    if data_type is not None:
+        query = query.join(models.AnalysisJob).filter(models.AnalysisJob.data_type == data_type)
+    return query.group_by(Metric.rule).order_by(Metric.rule).all()
 
-    return {"message": f"Successfully deleted job {job_id}"}
 
 # --- NEW: Celery Task Router ---
 task_router = APIRouter(
@@ -172,9 +776,11 @@ task_router = APIRouter(
     tags=["Celery Tasks"]
 )
 
+
 class TaskResponse(BaseModel):
     task_id: str
 
+
 @task_router.post("/test-task/", response_model=TaskResponse, status_code=status.HTTP_202_ACCEPTED)
 def run_test_task():
     """
@@ -185,11 +791,13 @@ def run_test_task():
     task = add_numbers.delay(5, 10)
     return {"task_id": task.id}
 
+
 class TaskStatus(BaseModel):
     task_id: str
     status: str
     result: Union[int, None] = None
 
+
 @task_router.get("/status/{task_id}", response_model=TaskStatus)
 def get_task_status(task_id: str):
     """
@@ -202,11 +810,35 @@ def get_task_status(task_id: str):
         "result": task_result.result,
     }
 
+
+@task_router.get("/workers")
+def get_workers(current_user: security.CurrentUser = Depends(security.get_current_user)):
+    """
+    Lists pipeline workers with the CPU/memory capacity they advertise and
+    what is currently admitted on them.
+    """
+    try:
+        return scheduling.advertised_workers()
+    except redis.RedisError:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Worker registry unavailable")
+
+
 # --- Main App Configuration ---
 # Include all the routers in the main FastAPI application
 app.include_router(auth_router)
 app.include_router(analysis_router)
+app.include_router(feature_router)
 app.include_router(task_router) # Add the new task router
+app.include_router(metrics_router)
+app.include_router(upload_router)
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Prometheus scrape endpoint: API request latencies and the pipeline's shared histograms."""
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
 
 @app.get("/", tags=["Root"])
 def read_root():
@@ -0,0 +1,152 @@
+import json
+import math
+import os
+import shutil
+
+import pandas as pd
+import redis
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from prometheus_client.core import HistogramMetricFamily
+
+from . import progress
+
+# --- Configuration ---
+# Set (to an empty, writable directory) when the API runs as several gunicorn
+# workers, so /metrics aggregates all of them rather than whichever answered
+PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+METRICS_KEY_PREFIX = "trace:metrics"
+
+# Pipeline work spans seconds to days
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400, 28800, 86400, math.inf)
+MEMORY_BUCKETS_MB = (128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072, math.inf)
+FAST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+
+# --- API Metrics (per process) ---
+HTTP_REQUEST_SECONDS = Histogram(
+    "trace_http_request_duration_seconds",
+    "API request latency until the response headers are sent.",
+    ["method", "route", "status"],
+    buckets=FAST_BUCKETS,
+)
+UPLOAD_BYTES = Counter("trace_upload_bytes", "Bytes of sample data uploaded.", ["data_type"])
+
+
+# --- Pipeline Metrics (shared through Redis) ---
+# Observed by Celery workers on any host and rendered by the API. Each series
+# is a Redis hash of per-bucket counts plus sum and count.
+PIPELINE_HISTOGRAMS = {
+    "trace_job_queue_wait_seconds": ("Submission until a worker started the job.", ("data_type",), DURATION_BUCKETS),
+    "trace_job_run_seconds": ("Worker start until the job completed or failed.", ("data_type", "status"), DURATION_BUCKETS),
+    "trace_job_duration_seconds": ("Submission until the job completed or failed.", ("data_type", "status"), DURATION_BUCKETS),
+    "trace_rule_wall_seconds": ("Wall time of one Snakemake rule job.", ("rule",), DURATION_BUCKETS),
+    "trace_rule_cpu_seconds": ("CPU time of one Snakemake rule job.", ("rule",), DURATION_BUCKETS),
+    "trace_rule_max_rss_mb": ("Peak resident memory of one Snakemake rule job.", ("rule",), MEMORY_BUCKETS_MB),
+    "trace_db_write_seconds": ("Worker database transactions, including lock waits and retries.", ("operation",), FAST_BUCKETS),
+}
+
+
+def _series_key(name: str, label_values) -> str:
+    return f"{METRICS_KEY_PREFIX}:{name}:{json.dumps(list(label_values))}"
+
+
+def observe(name: str, value: float, **labels):
+    """Adds one observation to a shared pipeline histogram; best effort like progress events."""
+    _, label_names, buckets = PIPELINE_HISTOGRAMS[name]
+    bucket = next(b for b in buckets if value <= b)
+    key = _series_key(name, [str(labels[label]) for label in label_names])
+    try:
+        pipe = progress.redis_client().pipeline(transaction=False)
+        pipe.hincrby(key, f"le:{bucket}", 1)
+        pipe.hincrby(key, "count", 1)
+        pipe.hincrbyfloat(key, "sum", value)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Could not record metric {name}: {e}")
+
+
+class PipelineCollector:
+    """Renders the shared pipeline histograms at scrape time."""
+
+    def describe(self):
+        # Lets the registry check metric names without reading Redis at import
+        return [HistogramMetricFamily(name, doc, labels=labels) for name, (doc, labels, _) in PIPELINE_HISTOGRAMS.items()]
+
+    def collect(self):
+        try:
+            client = progress.redis_client()
+            series = {key.decode(): client.hgetall(key) for key in client.scan_iter(match=f"{METRICS_KEY_PREFIX}:*")}
+        except redis.RedisError as e:
+            print(f"Could not read pipeline metrics: {e}")
+            return
+        for name, (documentation, label_names, buckets) in PIPELINE_HISTOGRAMS.items():
+            family = HistogramMetricFamily(name, documentation, labels=label_names)
+            prefix = f"{METRICS_KEY_PREFIX}:{name}:"
+            for key, fields in series.items():
+                if not key.startswith(prefix):
+                    continue
+                fields = {k.decode(): v.decode() for k, v in fields.items()}
+                cumulative, running = [], 0
+                for bound in buckets:
+                    running += int(fields.get(f"le:{bound}", 0))
+                    cumulative.append(("+Inf" if bound == math.inf else str(float(bound)), running))
+                family.add_metric(json.loads(key[len(prefix):]), cumulative, float(fields.get("sum", 0)))
+            yield family
+
+
+def registry():
+    """The registry /metrics renders: all API processes plus the shared pipeline histograms."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        combined = CollectorRegistry()
+        multiprocess.MultiProcessCollector(combined)
+        combined.register(PIPELINE_COLLECTOR)
+        return combined
+    return REGISTRY
+
+
+PIPELINE_COLLECTOR = PipelineCollector()
+if not PROMETHEUS_MULTIPROC_DIR:
+    REGISTRY.register(PIPELINE_COLLECTOR)
+
+
+def render():
+    """(body, content type) of a Prometheus scrape."""
+    return generate_latest(registry()), CONTENT_TYPE_LATEST
+
+
+# --- Snakemake Benchmarks ---
+def _benchmark_value(row, column):
+    return None if pd.isna(row.get(column)) else float(row[column])
+
+
+def read_benchmarks(directory: str):
+    """
+    Reads the `benchmark:` files Snakemake wrote under `directory` and removes
+    them. Returns [(rule, metrics)], the rule being the file's (or its parent
+    directory's, for rules with extra wildcards) name.
+    """
+    records = []
+    if not os.path.isdir(directory):
+        return records
+    for root, _, files in os.walk(directory):
+        for filename in sorted(files):
+            if not filename.endswith(".tsv"):
+                continue
+            path = os.path.join(root, filename)
+            relative = os.path.relpath(path, directory)
+            rule = relative.split(os.sep)[0].removesuffix(".tsv")
+            try:
+                row = pd.read_csv(path, sep="\t").apply(pd.to_numeric, errors="coerce").iloc[0]
+            except (pd.errors.ParserError, pd.errors.EmptyDataError, IndexError) as e:
+                print(f"Skipping unreadable benchmark {path}: {e}")
+                continue
+            records.append((rule, {
+                "wall_s": _benchmark_value(row, "s"),
+                "cpu_s": _benchmark_value(row, "cpu_time"),
+                "max_rss_mb": _benchmark_value(row, "max_rss"),
+                "io_in_mb": _benchmark_value(row, "io_in"),
+                "io_out_mb": _benchmark_value(row, "io_out"),
+                "mean_load": _benchmark_value(row, "mean_load"),
+            }))
+    shutil.rmtree(directory, ignore_errors=True)
+    return records
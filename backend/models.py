@@ -1,8 +1,11 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, Float, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
 
+
 class User(Base):
     __tablename__ = "users"
 
@@ -12,13 +15,122 @@ class User(Base):
 
     jobs = relationship("AnalysisJob", back_populates="owner")
 
+
 class AnalysisJob(Base):
     __tablename__ = "analysis_jobs"
 
     id = Column(Integer, primary_key=True, index=True)
     status = Column(String, default="pending", index=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Stamped in Python (microsecond precision, one storage format) so keyset cursors compare exactly
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), server_default=func.now())
     results = Column(String, nullable=True)
+    sample_id = Column(String, nullable=True, index=True)
+    data_type = Column(String, nullable=True)
+    input_path = Column(String, nullable=True)
+    # Jobs submitted together share a batch and run in one Snakemake invocation
+    batch_id = Column(String, nullable=True, index=True)
+    # Checksum and size of the uploaded input, computed while it streams to disk
+    input_sha256 = Column(String(64), nullable=True, index=True)
+    input_size = Column(BigInteger, nullable=True)
+    # When a worker started the job and when it completed or failed; with
+    # created_at these give queue wait and end-to-end latency
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    # Bytes the job's outputs occupy on disk, and when its text outputs were
+    # compacted; maintained by the storage lifecycle (see lifecycle.py)
+    output_bytes = Column(BigInteger, nullable=True)
+    compacted_at = Column(DateTime(timezone=True), nullable=True)
+    # 0 (normal) to 9; more urgent jobs are served first and may preempt less urgent ones
+    priority = Column(Integer, nullable=False, default=0, server_default="0")
+    # Celery task running the job (shared by a batch), so it can be revoked
+    task_id = Column(String, nullable=True, index=True)
     owner_id = Column(Integer, ForeignKey("users.id"))
 
-    owner = relationship("User", back_populates="jobs")
\ No newline at end of file
+    owner = relationship("User", back_populates="jobs")
+    log = relationship("JobLog", back_populates="job", uselist=False, cascade="all, delete-orphan")
+    rule_metrics = relationship("JobRuleMetric", back_populates="job", cascade="all, delete-orphan")
+
+    # Serves the keyset-paginated job listing: WHERE owner_id = ? ORDER BY created_at, id
+    __table_args__ = (
+        Index("ix_analysis_jobs_owner_created", "owner_id", "created_at", "id"),
+    )
+
+
+class JobLog(Base):
+    __tablename__ = "job_logs"
+
+    # Kept out of analysis_jobs so listings never load pipeline output
+    job_id = Column(Integer, ForeignKey("analysis_jobs.id", ondelete="CASCADE"), primary_key=True)
+    # Full Snakemake output stays on disk; only its tail is stored here
+    log_path = Column(String, nullable=True)
+    tail = Column(Text, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    job = relationship("AnalysisJob", back_populates="log")
+
+
+class JobRuleMetric(Base):
+    __tablename__ = "job_rule_metrics"
+
+    # One row per Snakemake rule job, from its `benchmark:` file
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("analysis_jobs.id", ondelete="CASCADE"), nullable=False, index=True)
+    rule = Column(String, nullable=False, index=True)
+    wall_s = Column(Float, nullable=True)
+    cpu_s = Column(Float, nullable=True)
+    max_rss_mb = Column(Float, nullable=True)
+    io_in_mb = Column(Float, nullable=True)
+    io_out_mb = Column(Float, nullable=True)
+    mean_load = Column(Float, nullable=True)
+    recorded_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    job = relationship("AnalysisJob", back_populates="rule_metrics")
+
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+
+    # A resumable upload: parts are written straight into `path` at their
+    # offsets, so finalizing is a rename
+    id = Column(String(32), primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    filename = Column(String, nullable=False)
+    data_type = Column(String, nullable=False)
+    sample_id = Column(String, nullable=False)
+    path = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    part_size = Column(BigInteger, nullable=False)
+    priority = Column(Integer, nullable=False, default=0)
+    # Set once finalized; finalizing again returns this job
+    job_id = Column(Integer, ForeignKey("analysis_jobs.id", ondelete="SET NULL"), nullable=True)
+    finalized_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    # Bumped by every part; sessions idle for too long are garbage-collected
+    updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), index=True)
+
+    parts = relationship("UploadPart", cascade="all, delete-orphan", order_by="UploadPart.index")
+
+
+class UploadPart(Base):
+    __tablename__ = "upload_parts"
+
+    session_id = Column(String(32), ForeignKey("upload_sessions.id", ondelete="CASCADE"), primary_key=True)
+    index = Column(Integer, primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+
+
+class ResultCacheEntry(Base):
+    __tablename__ = "result_cache_entries"
+
+    # SHA-256 over (input digest, data type, pipeline version, config digest)
+    key = Column(String(64), primary_key=True)
+    input_sha256 = Column(String(64), nullable=False, index=True)
+    data_type = Column(String, nullable=False)
+    pipeline_version = Column(String, nullable=False, index=True)
+    config_digest = Column(String(64), nullable=False)
+    result_path = Column(String, nullable=False)
+    size_bytes = Column(BigInteger, nullable=False, default=0)
+    hit_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_accessed_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+from functools import lru_cache
+
+import yaml
+
+# --- Configuration ---
+# Path to the Snakemake pipeline inside the container
+PIPELINE_DIR = os.environ.get('TRACE_PIPELINE_DIR', '/app/pipeline')
+PIPELINE_CONFIG_PATH = os.path.join(PIPELINE_DIR, "config.yaml")
+
+# Config keys that the worker overrides per job. They do not change what the
+# pipeline computes for a sample, so they are excluded from the config digest.
+RUNTIME_CONFIG_KEYS = ("samples", "run_id", "output_dir")
+# Config sections that only affect where and how fast jobs (and their downloads) run
+SCHEDULING_CONFIG_KEYS = ("scheduling", "download", "reference_assets")
+# Where the worker points Snakemake's `output_dir`
+RESULTS_DIR = os.path.join(PIPELINE_DIR, "results")
+# Full Snakemake logs, one file per run, streamed to disk as they are produced
+JOB_LOG_DIR = os.environ.get('TRACE_JOB_LOG_DIR', os.path.join(RESULTS_DIR, "logs", "runs"))
+# Snakemake `benchmark:` files (matches BENCHMARK_DIR in the Snakefile)
+BENCHMARK_DIR = os.path.join(RESULTS_DIR, "benchmarks")
+
+
+@lru_cache(maxsize=1)
+def load_pipeline_config() -> dict:
+    """Loads pipeline/config.yaml once per process."""
+    with open(PIPELINE_CONFIG_PATH) as fh:
+        return yaml.safe_load(fh)
+
+
+def pipeline_version() -> str:
+    """Returns the `pipeline_version` declared in the pipeline config."""
+    return str(load_pipeline_config()["pipeline_version"])
+
+
+@lru_cache(maxsize=1)
+def config_digest() -> str:
+    """SHA-256 of the canonicalized pipeline config, ignoring per-job and scheduling keys."""
+    ignored = RUNTIME_CONFIG_KEYS + SCHEDULING_CONFIG_KEYS
+    config = {k: v for k, v in load_pipeline_config().items() if k not in ignored}
+    canonical = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def feature_matrix_path(run_id: str) -> str:
+    """The feature matrix Snakemake builds for a run (a single job or a batch)."""
+    extension = load_pipeline_config()["feature_matrix"]["format"]
+    return os.path.join(RESULTS_DIR, f"TRACE_v{pipeline_version()}_{run_id}_feature_matrix.{extension}")
+
+
+def sample_sheet_row(sample_id: str, data_type: str, input_path: str) -> dict:
+    """A job's row of the Snakemake sample sheet; these columns are carried into its feature matrix."""
+    return {'sample_id': sample_id, 'data_type': data_type, 'accession_id': sample_id, 'source_url': input_path}
+
+
+def sample_feature_outputs(sample_id: str, data_type: str) -> list:
+    """Per-sample files `metadata_merge` consumes; all present means the sample succeeded."""
+    sample_dir = os.path.join(RESULTS_DIR, sample_id)
+    if data_type == "WGS":
+        engine = load_pipeline_config()["fragmentomics"]["tumor_fraction"]["engine"]
+        tumor_fraction = (
+            os.path.join(sample_dir, "fragmentomics", "ichorCNA", f"{sample_id}.params.txt") if engine == "ichorCNA"
+            else os.path.join(sample_dir, "fragmentomics", "tumor_fraction", f"{sample_id}.tumor_fraction.tsv")
+        )
+        return [
+            os.path.join(sample_dir, "fragmentomics", f"{sample_id}.frag_summary.tsv"),
+            tumor_fraction,
+            os.path.join(sample_dir, "dl_features", f"{sample_id}.dl_features.tsv"),
+        ]
+    if data_type == "WGBS":
+        return [
+            os.path.join(sample_dir, "methylomics", f"{sample_id}.too_proportions.tsv"),
+            os.path.join(sample_dir, "methylomics", f"{sample_id}.methylation_qc.tsv"),
+        ]
+    raise ValueError(f"Unknown data_type: {data_type}")
+
+
+def run_log_path(run_id: str) -> str:
+    """The on-disk Snakemake log of a run (a single job or a batch)."""
+    return os.path.join(JOB_LOG_DIR, f"{run_id}.log")
+
+
+def sample_benchmark_dir(sample_id: str) -> str:
+    """Benchmarks of a sample's own rules."""
+    return os.path.join(BENCHMARK_DIR, "samples", sample_id)
+
+
+def run_benchmark_dir(run_id: str) -> str:
+    """Benchmarks of rules that serve a whole run (reference preparation, the cohort merge)."""
+    return os.path.join(BENCHMARK_DIR, "runs", run_id)
@@ -0,0 +1,109 @@
+import json
+import os
+import re
+from typing import Optional
+
+import redis
+import redis.asyncio as aioredis
+
+# --- Configuration ---
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379/0')
+# How long the last known progress of a job is kept for late subscribers
+PROGRESS_TTL_SECONDS = 7 * 24 * 3600
+
+TERMINAL_STATUSES = ("complete", "failed", "cancelled")
+
+# Snakemake log lines we track
+STEPS_DONE = re.compile(r"(\d+) of (\d+) steps \((\d+(?:\.\d+)?)%\) done")
+RULE_STARTED = re.compile(r"^(?:local)?rule (\w+):")
+RULE_FAILED = re.compile(r"^Error in rule (\w+):")
+
+_client = None
+
+
+def channel(job_id: int) -> str:
+    return f"trace:jobs:{job_id}:events"
+
+
+def state_key(job_id: int) -> str:
+    return f"trace:jobs:{job_id}:progress"
+
+
+def redis_client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(REDIS_URL)
+    return _client
+
+
+def publish(job_id: int, event: dict):
+    """
+    Publishes a progress event for a job and remembers it as the job's latest state.
+    Progress is best effort: Redis being unavailable must never fail a pipeline run.
+    """
+    payload = json.dumps({"job_id": job_id, **event})
+    try:
+        client = redis_client()
+        client.set(state_key(job_id), payload, ex=PROGRESS_TTL_SECONDS)
+        client.publish(channel(job_id), payload)
+    except redis.RedisError as e:
+        print(f"Could not publish progress for job {job_id}: {e}")
+
+
+def publish_status(job_ids, status: str, message: Optional[str] = None):
+    for job_id in job_ids:
+        publish(job_id, {"type": "status", "status": status, "message": message})
+
+
+class SnakemakeProgress:
+    """Turns Snakemake log lines into progress events."""
+
+    def __init__(self):
+        self.done = 0
+        self.total = None
+        self.current_rule = None
+
+    def feed(self, line: str) -> Optional[dict]:
+        match = STEPS_DONE.search(line)
+        if match:
+            self.done, self.total = int(match.group(1)), int(match.group(2))
+            return {"type": "progress", "done": self.done, "total": self.total, "percent": float(match.group(3)), "rule": self.current_rule}
+        match = RULE_STARTED.match(line)
+        if match:
+            self.current_rule = match.group(1)
+            return {"type": "rule", "rule": self.current_rule, "done": self.done, "total": self.total}
+        match = RULE_FAILED.match(line)
+        if match:
+            return {"type": "rule_failed", "rule": match.group(1), "done": self.done, "total": self.total}
+        return None
+
+
+async def subscribe(job_id: int):
+    """
+    Yields a job's events as JSON strings: first its latest known state, then
+    live events until the job reaches a terminal status.
+    """
+    client = aioredis.Redis.from_url(REDIS_URL)
+    pubsub = client.pubsub()
+    try:
+        # Subscribe before reading the stored state so no event falls in between
+        await pubsub.subscribe(channel(job_id))
+        latest = await client.get(state_key(job_id))
+        if latest is not None:
+            yield latest.decode()
+            if json.loads(latest).get("status") in TERMINAL_STATUSES:
+                return
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=15.0)
+            if message is None:
+                # Keep-alive so proxies do not close an idle stream
+                yield None
+                continue
+            data = message["data"].decode()
+            yield data
+            if json.loads(data).get("status") in TERMINAL_STATUSES:
+                return
+    finally:
+        await pubsub.unsubscribe(channel(job_id))
+        await pubsub.aclose()
+        await client.aclose()
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import shutil
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+import pandas as pd
+
+from . import models
+from .feature_store import read_matrix_file, write_matrix_file
+from .pipeline_config import PIPELINE_DIR, pipeline_version, config_digest
+
+# --- Configuration ---
+RESULT_CACHE_DIR = os.environ.get('TRACE_RESULT_CACHE_DIR', os.path.join(PIPELINE_DIR, "results", "cache"))
+# Total size of cached feature matrices before LRU eviction kicks in
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('TRACE_RESULT_CACHE_MAX_BYTES', 20 * 1024 ** 3))
+
+
+def cache_key(input_sha256: str, data_type: str) -> str:
+    """Content-addressed key for a pipeline result under the current pipeline config."""
+    parts = [input_sha256, data_type, pipeline_version(), config_digest()]
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+
+def _link_or_copy(source: str, destination: str):
+    """Hard-links `source` to `destination`, copying when they sit on different filesystems."""
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def _delete_entry(db: Session, entry: models.ResultCacheEntry):
+    if os.path.exists(entry.result_path):
+        os.remove(entry.result_path)
+    db.delete(entry)
+
+
+def lookup(db: Session, input_sha256: Optional[str], data_type: str) -> Optional[models.ResultCacheEntry]:
+    """
+    Returns the cache entry for this input under the current pipeline config, or None.
+    A hit refreshes the entry's LRU timestamp.
+    """
+    if not input_sha256:
+        return None
+    entry = db.get(models.ResultCacheEntry, cache_key(input_sha256, data_type))
+    if entry is None:
+        return None
+    if not os.path.exists(entry.result_path):
+        # The cached file was removed behind our back; drop the stale row
+        db.delete(entry)
+        db.commit()
+        return None
+    entry.last_accessed_at = datetime.now(timezone.utc)
+    entry.hit_count = (entry.hit_count or 0) + 1
+    db.commit()
+    return entry
+
+
+def materialize(entry: models.ResultCacheEntry, destination: str, sheet_row: dict) -> str:
+    """
+    Writes a cached feature matrix to the path a job would normally produce,
+    relabeled for that job: the sample_id index and the sample sheet columns
+    come from `sheet_row`, so nothing of the sample that was cached carries over.
+    """
+    features = read_matrix_file(entry.result_path)
+    features.index = pd.Index([sheet_row["sample_id"]] * len(features), name="sample_id")
+    for col, value in sheet_row.items():
+        if col in features.columns:
+            features[col] = pd.Categorical([value] * len(features))
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    write_matrix_file(features, destination)
+    return destination
+
+
+def store(db: Session, input_sha256: Optional[str], data_type: str, result_path: str) -> Optional[models.ResultCacheEntry]:
+    """Adds a finished job's feature matrix to the cache and enforces the size budget."""
+    if not input_sha256 or not os.path.exists(result_path):
+        return None
+    key = cache_key(input_sha256, data_type)
+    cached_path = os.path.join(RESULT_CACHE_DIR, f"{key}{os.path.splitext(result_path)[1]}")
+    _link_or_copy(result_path, cached_path)
+
+    entry = db.get(models.ResultCacheEntry, key) or models.ResultCacheEntry(key=key)
+    entry.input_sha256 = input_sha256
+    entry.data_type = data_type
+    entry.pipeline_version = pipeline_version()
+    entry.config_digest = config_digest()
+    entry.result_path = cached_path
+    entry.size_bytes = os.path.getsize(cached_path)
+    entry.last_accessed_at = datetime.now(timezone.utc)
+    db.add(entry)
+    db.commit()
+
+    evict(db)
+    return entry
+
+
+def evict(db: Session, max_bytes: int = RESULT_CACHE_MAX_BYTES) -> int:
+    """Evicts least-recently-used entries until the cache fits in `max_bytes`. Returns the number evicted."""
+    entries = db.query(models.ResultCacheEntry).order_by(models.ResultCacheEntry.last_accessed_at.asc()).all()
+    total = sum(e.size_bytes or 0 for e in entries)
+    evicted = 0
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        total -= entry.size_bytes or 0
+        _delete_entry(db, entry)
+        evicted += 1
+    db.commit()
+    return evicted
+
+
+def invalidate_stale(db: Session) -> int:
+    """Drops every entry produced by a different pipeline version or config. Returns the number removed."""
+    stale = db.query(models.ResultCacheEntry).filter(
+        (models.ResultCacheEntry.pipeline_version != pipeline_version())
+        | (models.ResultCacheEntry.config_digest != config_digest())
+    ).all()
+    for entry in stale:
+        _delete_entry(db, entry)
+    db.commit()
+    return len(stale)
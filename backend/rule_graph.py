@@ -0,0 +1,42 @@
+import re
+
+# Lines of `snakemake --dag` (Graphviz dot) output, e.g.
+#   3[label = "ichorCNA\nsample: s1", color = "0.51 0.6 0.85", style="rounded"];
+#   4 -> 3
+NODE = re.compile(r'^\s*(\d+)\[label = "([^"]*)".*?style="([^"]*)"', re.M)
+EDGE = re.compile(r'^\s*(\d+) -> (\d+)', re.M)
+
+
+def parse_dag(dot: str):
+    """
+    Returns ({job: rule}, [(upstream job, downstream job)]) for the jobs that
+    still have to run. Snakemake draws jobs whose outputs are up to date dashed.
+    """
+    jobs = {}
+    for job_id, label, style in NODE.findall(dot):
+        if "dashed" not in style:
+            jobs[job_id] = label.split("\\n")[0]
+    edges = [(a, b) for a, b in EDGE.findall(dot) if a in jobs and b in jobs]
+    return jobs, edges
+
+
+def rule_levels(dot: str) -> list:
+    """
+    Groups the rules of a DAG into levels: every rule only depends on rules in
+    earlier levels, so the rules of one level can run at the same time.
+    """
+    jobs, edges = parse_dag(dot)
+    upstream = {rule: set() for rule in jobs.values()}
+    for a, b in edges:
+        if jobs[a] != jobs[b]:
+            upstream[jobs[b]].add(jobs[a])
+
+    levels = []
+    placed = set()
+    while len(placed) < len(upstream):
+        level = sorted(r for r, deps in upstream.items() if r not in placed and deps <= placed)
+        if not level:
+            raise ValueError(f"Rule graph has a cycle among: {sorted(set(upstream) - placed)}")
+        levels.append(level)
+        placed.update(level)
+    return levels
@@ -0,0 +1,294 @@
+import fcntl
+import json
+import os
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional
+
+import redis
+
+from . import progress
+from .pipeline_config import load_pipeline_config
+
+# --- Configuration ---
+# Where node-local admission state lives; every worker process on a host must share it
+ADMISSION_DIR = os.environ.get('TRACE_ADMISSION_DIR', '/tmp/trace_admission')
+# Memory left for the OS, Celery and the API when sizing the worker from the host
+WORKER_MEM_RESERVE_MB = int(os.environ.get('TRACE_WORKER_MEM_RESERVE_MB', 2048))
+# Queue used for data types the config does not list
+DEFAULT_QUEUE = "trace.default"
+# Advertised capacity disappears if a worker stops refreshing it
+ADVERTISE_TTL_SECONDS = 24 * 3600
+# Job priorities run from 0 (normal) to MAX_PRIORITY (most urgent)
+MAX_PRIORITY = 9
+STOP_KEY_PREFIX = "trace:stop"
+# A stop request nobody picked up (the job was never run) expires
+STOP_TTL_SECONDS = 7 * 24 * 3600
+
+
+def _cgroup_memory_mb() -> Optional[int]:
+    """Container memory limit (cgroup v2, then v1), if any."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as fh:
+                value = fh.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value) // (1024 * 1024)
+    return None
+
+
+def _host_memory_mb() -> int:
+    with open("/proc/meminfo") as fh:
+        for line in fh:
+            if line.startswith("MemTotal:"):
+                return int(line.split()[1]) // 1024
+    raise RuntimeError("MemTotal missing from /proc/meminfo")
+
+
+def detect_capacity():
+    """CPUs and memory (MB) this worker may hand out; TRACE_WORKER_CPUS/MEM_MB override detection."""
+    cpus = os.environ.get('TRACE_WORKER_CPUS')
+    cpus = int(cpus) if cpus else len(os.sched_getaffinity(0))
+    mem_mb = os.environ.get('TRACE_WORKER_MEM_MB')
+    if mem_mb:
+        mem_mb = int(mem_mb)
+    else:
+        limits = [m for m in (_host_memory_mb(), _cgroup_memory_mb()) if m is not None]
+        mem_mb = max(1024, min(limits) - WORKER_MEM_RESERVE_MB)
+    return cpus, mem_mb
+
+
+WORKER_CPUS, WORKER_MEM_MB = detect_capacity()
+
+
+# --- Profiles and Routing ---
+def job_profile(data_type: str) -> dict:
+    """The queue and resource budget ({queue, threads, mem_mb}) for one sample of a data type."""
+    config = load_pipeline_config()
+    entry = config.get("scheduling", {}).get("data_types", {}).get(data_type, {})
+    resources = config["resources"][entry.get("profile", "default")]
+    return {"queue": entry.get("queue", DEFAULT_QUEUE), "threads": int(resources["threads"]), "mem_mb": int(resources["mem_mb"])}
+
+
+def all_queues() -> list:
+    """Every queue a general-purpose pipeline worker should consume."""
+    data_types = load_pipeline_config().get("scheduling", {}).get("data_types", {})
+    return sorted({entry["queue"] for entry in data_types.values()} | {DEFAULT_QUEUE})
+
+
+def admission_retry_seconds() -> int:
+    return int(load_pipeline_config().get("scheduling", {}).get("admission_retry_seconds", 60))
+
+
+def execution_mode() -> str:
+    """"local" (one task per sample) or "distributed" (one task per rule)."""
+    return load_pipeline_config().get("scheduling", {}).get("execution_mode", "local")
+
+
+def preemption_settings() -> dict:
+    """{enabled, grace_seconds, poll_seconds} from `scheduling.preemption` in the pipeline config."""
+    settings = load_pipeline_config().get("scheduling", {}).get("preemption", {})
+    return {
+        "enabled": bool(settings.get("enabled", True)),
+        "grace_seconds": int(settings.get("grace_seconds", 30)),
+        "poll_seconds": int(settings.get("poll_seconds", 5)),
+    }
+
+
+def celery_priority(priority: int) -> int:
+    """The broker priority of a job priority; the Redis transport serves lower numbers first."""
+    return MAX_PRIORITY - max(0, min(MAX_PRIORITY, priority or 0))
+
+
+def route_pipeline_task(name, args, kwargs, options, task=None, **kw):
+    """Celery router: pipeline tasks go to the queue of their data type."""
+    if name.startswith("backend.worker.") and kwargs.get("data_type"):
+        return {"queue": job_profile(kwargs["data_type"])["queue"]}
+    return None
+
+
+# --- Admission Control ---
+@dataclass(frozen=True)
+class Slot:
+    """Resources granted to one running task."""
+    key: str
+    threads: int
+    mem_mb: int
+
+
+@contextmanager
+def _ledger():
+    """Locks and yields the node's ledger of granted slots; changes are written back on exit."""
+    os.makedirs(ADMISSION_DIR, exist_ok=True)
+    path = os.path.join(ADMISSION_DIR, "ledger.json")
+    with open(os.path.join(ADMISSION_DIR, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            try:
+                with open(path) as fh:
+                    slots = json.load(fh)
+            except (FileNotFoundError, json.JSONDecodeError):
+                slots = {}
+            # Forget slots of processes that died without releasing them
+            slots = {k: v for k, v in slots.items() if _pid_alive(v["pid"])}
+            yield slots
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as fh:
+                json.dump(slots, fh)
+            os.replace(tmp_path, path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _usage(slots: dict):
+    return sum(s["threads"] for s in slots.values()), sum(s["mem_mb"] for s in slots.values())
+
+
+def admit(task_id: Optional[str], threads: int, mem_mb: int, priority: Optional[int] = None, job_ids=()) -> Optional[Slot]:
+    """
+    Grants `threads` and `mem_mb` on this node if they fit next to the tasks
+    already running, otherwise returns None. Requests larger than the whole
+    worker are clamped to it, so they run alone rather than never.
+    Slots given a `priority` can be preempted for more urgent `job_ids`.
+    """
+    threads, mem_mb = min(threads, WORKER_CPUS), min(mem_mb, WORKER_MEM_MB)
+    key = task_id or uuid.uuid4().hex
+    with _ledger() as slots:
+        used_threads, used_mem = _usage(slots)
+        if used_threads + threads > WORKER_CPUS or used_mem + mem_mb > WORKER_MEM_MB:
+            return None
+        slots[key] = {
+            "threads": threads, "mem_mb": mem_mb, "pid": os.getpid(), "since": time.time(),
+            "priority": priority, "job_ids": list(job_ids),
+        }
+        used = _usage(slots)
+    advertise_capacity(used)
+    return Slot(key, threads, mem_mb)
+
+
+def release(slot: Slot):
+    with _ledger() as slots:
+        slots.pop(slot.key, None)
+        used = _usage(slots)
+    advertise_capacity(used)
+
+
+# --- Cancellation and Preemption ---
+# A job is stopped by flagging it in Redis; the worker running it polls the
+# flag and kills its Snakemake process group (see worker.run_snakemake).
+# The reason is "cancel" (the job is dropped) or "preempt" (it is requeued).
+def _stop_key(job_id: int) -> str:
+    return f"{STOP_KEY_PREFIX}:{job_id}"
+
+
+def request_stop(job_ids, reason: str):
+    """Asks whichever worker runs these jobs to stop them; best effort like progress events."""
+    try:
+        pipe = progress.redis_client().pipeline(transaction=False)
+        for job_id in job_ids:
+            pipe.set(_stop_key(job_id), reason, ex=STOP_TTL_SECONDS)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Could not request stop of jobs {list(job_ids)}: {e}")
+
+
+def stop_requests(job_ids) -> dict:
+    """{job_id: reason} for the jobs asked to stop."""
+    job_ids = list(job_ids)
+    if not job_ids:
+        return {}
+    try:
+        reasons = progress.redis_client().mget([_stop_key(job_id) for job_id in job_ids])
+    except redis.RedisError as e:
+        print(f"Could not read stop requests: {e}")
+        return {}
+    return {job_id: reason.decode() for job_id, reason in zip(job_ids, reasons) if reason is not None}
+
+
+def clear_stop(job_ids):
+    job_ids = list(job_ids)
+    if not job_ids:
+        return
+    try:
+        progress.redis_client().delete(*[_stop_key(job_id) for job_id in job_ids])
+    except redis.RedisError as e:
+        print(f"Could not clear stop requests: {e}")
+
+
+def preempt_for(priority: int, threads: int, mem_mb: int) -> list:
+    """
+    Frees room on this node for a job of `priority` by asking less urgent
+    running jobs to yield: lowest priority first, and among equals the most
+    recently started, which loses the least work. Returns the preempted job
+    IDs; none if even all of them together would not make enough room.
+    """
+    if not preemption_settings()["enabled"]:
+        return []
+    threads, mem_mb = min(threads, WORKER_CPUS), min(mem_mb, WORKER_MEM_MB)
+    with _ledger() as slots:
+        used_threads, used_mem = _usage(slots)
+        pending = stop_requests(job_id for slot in slots.values() for job_id in slot.get("job_ids", []))
+        # Slots already yielding count as free
+        for slot in slots.values():
+            if slot.get("job_ids") and all(job_id in pending for job_id in slot["job_ids"]):
+                used_threads, used_mem = used_threads - slot["threads"], used_mem - slot["mem_mb"]
+        candidates = sorted(
+            (slot for slot in slots.values()
+             if slot.get("priority") is not None and slot["priority"] < priority and slot.get("job_ids")
+             and not all(job_id in pending for job_id in slot["job_ids"])),
+            key=lambda slot: (slot["priority"], -slot["since"]),
+        )
+    victims = []
+    for slot in candidates:
+        if used_threads + threads <= WORKER_CPUS and used_mem + mem_mb <= WORKER_MEM_MB:
+            break
+        victims.append(slot)
+        used_threads, used_mem = used_threads - slot["threads"], used_mem - slot["mem_mb"]
+    if used_threads + threads > WORKER_CPUS or used_mem + mem_mb > WORKER_MEM_MB:
+        return []
+    job_ids = [job_id for slot in victims for job_id in slot["job_ids"]]
+    request_stop(job_ids, "preempt")
+    return job_ids
+
+
+# --- Capacity Advertisement ---
+def worker_key(hostname: Optional[str] = None) -> str:
+    return f"trace:workers:{hostname or socket.gethostname()}"
+
+
+def advertise_capacity(used=(0, 0), queues=None):
+    """Publishes this node's capacity and current usage to Redis; best effort like progress events."""
+    fields = {"cpus": WORKER_CPUS, "mem_mb": WORKER_MEM_MB, "used_threads": used[0], "used_mem_mb": used[1], "updated_at": time.time()}
+    if queues is not None:
+        fields["queues"] = ",".join(queues)
+    try:
+        client = progress.redis_client()
+        client.hset(worker_key(), mapping=fields)
+        client.expire(worker_key(), ADVERTISE_TTL_SECONDS)
+    except redis.RedisError as e:
+        print(f"Could not advertise worker capacity: {e}")
+
+
+def advertised_workers() -> list:
+    """Capacity and usage of every worker that advertised itself recently."""
+    client = progress.redis_client()
+    workers = []
+    for key in client.scan_iter(match=worker_key("*")):
+        fields = {k.decode(): v.decode() for k, v in client.hgetall(key).items()}
+        workers.append({"hostname": key.decode().split(":", 2)[2], **fields})
+    return workers
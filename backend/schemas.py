@@ -1,31 +1,155 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 
+
 # Schema for creating a new analysis job (request)
 class AnalysisJobCreate(BaseModel):
     pass # Initially no fields needed from user to create a job
 
+
 # Base schema for an analysis job (common attributes)
 class AnalysisJobBase(BaseModel):
     id: int
     status: str
     created_at: datetime
     results: Optional[str] = None
+    sample_id: Optional[str] = None
+    data_type: Optional[str] = None
+    batch_id: Optional[str] = None
+    input_sha256: Optional[str] = None
+    input_size: Optional[int] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    priority: int = 0
     owner_id: int
 
     class Config:
         from_attributes = True
 
+
 # Complete schema for an analysis job (response)
 class AnalysisJob(AnalysisJobBase):
     pass
 
+
+# Slim schema for job listings (response)
+class AnalysisJobSummary(BaseModel):
+    id: int
+    status: str
+    created_at: datetime
+    sample_id: Optional[str] = None
+    data_type: Optional[str] = None
+    batch_id: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
+# One page of a user's jobs; pass next_cursor back to get the following page
+class AnalysisJobPage(BaseModel):
+    items: List[AnalysisJobSummary]
+    next_cursor: Optional[str] = None
+
+
+# Schema for a job's pipeline log (response)
+class JobLog(BaseModel):
+    job_id: int
+    log_path: Optional[str] = None
+    tail: Optional[str] = None
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+# One downloadable output of a job (response); fetch it from /analyses/{job_id}/artifacts/{name}
+class Artifact(BaseModel):
+    name: str
+    size: int
+    media_type: str
+    modified_at: datetime
+    # "gzip" when stored compacted; downloads are still decoded for clients that need it
+    encoding: Optional[str] = None
+
+
+# Resource usage of one Snakemake rule job (response)
+class RuleMetric(BaseModel):
+    rule: str
+    wall_s: Optional[float] = None
+    cpu_s: Optional[float] = None
+    max_rss_mb: Optional[float] = None
+    io_in_mb: Optional[float] = None
+    io_out_mb: Optional[float] = None
+    mean_load: Optional[float] = None
+
+    class Config:
+        from_attributes = True
+
+
+# Timings and per-rule resource usage of one job (response)
+class JobMetrics(BaseModel):
+    job_id: int
+    queue_wait_s: Optional[float] = None
+    run_s: Optional[float] = None
+    total_s: Optional[float] = None
+    rules: List[RuleMetric]
+
+
+# One rule aggregated over many jobs, for sizing `resources` (response)
+class RuleMetricSummary(BaseModel):
+    rule: str
+    jobs: int
+    mean_wall_s: Optional[float] = None
+    max_wall_s: Optional[float] = None
+    mean_cpu_s: Optional[float] = None
+    # CPU time over wall time: the cores the rule actually kept busy
+    mean_cores_used: Optional[float] = None
+    mean_max_rss_mb: Optional[float] = None
+    max_rss_mb: Optional[float] = None
+
+
+# Starts a resumable upload (request)
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int
+    data_type: str = "WGS"
+    priority: int = Field(0, ge=0, le=9)
+
+
+# State of a resumable upload (response); PUT the parts not yet in `received`
+class UploadSession(BaseModel):
+    id: str
+    filename: str
+    data_type: str
+    size: int
+    part_size: int
+    part_count: int
+    # Indexes of the parts stored so far
+    received: List[int]
+    received_bytes: int
+    # Bytes stored without gaps from the start of the file
+    contiguous_bytes: int
+    job_id: Optional[int] = None
+    expires_at: datetime
+
+
+# Disk space held by a user's jobs (response)
+class StorageUsage(BaseModel):
+    jobs: int
+    # Uploaded inputs still on disk
+    input_bytes: int
+    # Retained outputs (feature matrices, QC, per-module tables), after compaction
+    output_bytes: int
+    total_bytes: int
+
+
 # Schema for creating a new user (request)
 class UserCreate(BaseModel):
     email: str
     password: str
 
+
 # Base schema for a user (common attributes)
 class UserBase(BaseModel):
     id: int
@@ -34,6 +158,14 @@ class UserBase(BaseModel):
     class Config:
         from_attributes = True
 
-# Complete schema for a user, including their analysis jobs (response)
+
+# Complete schema for a user (response); jobs are listed page by page via /analyses/
 class User(UserBase):
-    jobs: list[AnalysisJob] = []
\ No newline at end of file
+    pass
+
+
+# Schema for a slice of the cohort feature store (response)
+class FeatureMatrix(BaseModel):
+    generation: int
+    columns: List[str]
+    rows: List[Dict[str, Any]]
\ No newline at end of file
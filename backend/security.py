@@ -1,10 +1,15 @@
 import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 
 from fastapi import Depends, HTTPException, status
@@ -18,20 +23,36 @@ from . import models
 SECRET_KEY = os.environ.get('SECRET_KEY', '09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Authenticated tokens are remembered per process; user changes in another
+# process become visible after at most this long
+USER_CACHE_TTL_SECONDS = int(os.environ.get('TRACE_USER_CACHE_TTL_SECONDS', 60))
+USER_CACHE_MAX_ENTRIES = int(os.environ.get('TRACE_USER_CACHE_MAX_ENTRIES', 10000))
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+
 class TokenData(BaseModel):
+    user_id: Optional[int] = None
     email: Optional[str] = None
 
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """The identity of an authenticated user, safe to share across requests and sessions."""
+    id: int
+    email: str
+
+
 # --- Password Functions ---
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+
 # --- JWT Functions ---
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -43,10 +64,70 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+
+def create_user_access_token(user: models.User, expires_delta: Optional[timedelta] = None):
+    """Issues a token whose subject is the user id, so lookups hit the primary key."""
+    return create_access_token(data={"sub": str(user.id), "email": user.email}, expires_delta=expires_delta)
+
+
+# --- Authenticated User Cache ---
+class UserCache:
+    """Bounded, thread-safe LRU of token -> CurrentUser with per-entry expiry."""
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[CurrentUser]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return user
+
+    def put(self, token: str, user: CurrentUser, token_expires_at: Optional[float] = None):
+        # Never outlive the token itself
+        ttl = self.ttl_seconds if token_expires_at is None else min(self.ttl_seconds, token_expires_at - time.time())
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[token] = (user, time.monotonic() + ttl)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in [t for t, (user, _) in self._entries.items() if user.id == user_id]:
+                del self._entries[token]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache(USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL_SECONDS)
+
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    """Changed or deleted users must re-authenticate against the database."""
+    user_cache.invalidate_user(target.id)
+
+
 # --- Dependency to Get Current User (REVISED) ---
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> CurrentUser:
     """
-    Decodes JWT token, validates it, and returns the full user object from the database.
+    Decodes JWT token, validates it, and returns the authenticated user's identity.
+    Recently seen tokens are answered from the cache without touching the database.
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -55,16 +136,27 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     )
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        token_data = TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    
-    user = db.query(models.User).filter(models.User.email == token_data.email).first()
-    
+
+    cached = user_cache.get(token)
+    if cached is not None:
+        return cached
+
+    subject = payload.get("sub")
+    if subject is None:
+        raise credentials_exception
+    # Tokens issued before the subject became the user id carry the email instead
+    if subject.isdigit():
+        token_data = TokenData(user_id=int(subject))
+        user = db.get(models.User, token_data.user_id)
+    else:
+        token_data = TokenData(email=subject)
+        user = db.query(models.User).filter(models.User.email == token_data.email).first()
+
     if user is None:
         raise credentials_exception
-        
-    return user
\ No newline at end of file
+
+    current_user = CurrentUser(id=user.id, email=user.email)
+    user_cache.put(token, current_user, payload.get("exp"))
+    return current_user
\ No newline at end of file
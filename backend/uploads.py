@@ -0,0 +1,177 @@
+import base64
+import binascii
+import hashlib
+import math
+import os
+import shutil
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile, status
+from starlette.concurrency import run_in_threadpool
+
+# --- Configuration ---
+# Where the API streams uploads; relative to the working directory it shares with Snakemake
+UPLOAD_DIR = os.environ.get('TRACE_UPLOAD_DIR', 'uploads')
+# Uploads are copied in large chunks so multi-GB BAM files need few syscalls.
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+# Hard cap on a single upload; 0 disables the limit.
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 200 * 1024 ** 3))
+# Part size of resumable uploads, fixed by the server
+UPLOAD_PART_SIZE = int(os.environ.get('TRACE_UPLOAD_PART_SIZE', 64 * 1024 * 1024))
+# Resumable uploads idle for longer are garbage-collected by the storage sweeper
+UPLOAD_SESSION_TTL_HOURS = float(os.environ.get('TRACE_UPLOAD_SESSION_TTL_HOURS', 24))
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES."""
+
+
+def _copy_and_hash(source, destination: str, max_bytes: int, chunk_size: int):
+    """
+    Streams `source` into `destination`, hashing as it goes.
+    Runs entirely in a worker thread; hashlib releases the GIL on large chunks.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(destination, "wb") as buffer:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise UploadTooLarge(f"Upload exceeds the {max_bytes} byte limit")
+            digest.update(chunk)
+            buffer.write(chunk)
+    return digest.hexdigest(), size
+
+
+async def save_upload_file(file: UploadFile, destination: str, max_bytes: int = MAX_UPLOAD_BYTES):
+    """
+    Saves an uploaded file without blocking the event loop.
+
+    Returns a (sha256_hexdigest, size_in_bytes) tuple. A partially written
+    file is removed if the upload is rejected or the copy fails.
+    """
+    if max_bytes and file.size is not None and file.size > max_bytes:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File exceeds the maximum upload size of {max_bytes} bytes",
+        )
+    try:
+        return await run_in_threadpool(_copy_and_hash, file.file, destination, max_bytes, UPLOAD_CHUNK_SIZE)
+    except UploadTooLarge as e:
+        os.remove(destination)
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except Exception:
+        if os.path.exists(destination):
+            os.remove(destination)
+        raise
+    finally:
+        await file.close()
+
+
+# --- Resumable Uploads ---
+# A session preallocates `<destination>.part` at the full size; each part is
+# written at its own offset as it arrives (in any order, in parallel), so
+# finalizing is a rename: the data is never copied or read again.
+def partial_path(destination: str) -> str:
+    return f"{destination}.part"
+
+
+def part_count(size: int, part_size: int) -> int:
+    return max(1, math.ceil(size / part_size))
+
+
+def part_range(size: int, part_size: int, index: int):
+    """(offset, length) of part `index`; only the last part may be short."""
+    offset = index * part_size
+    return offset, min(part_size, size - offset)
+
+
+def check_upload_size(size: int, directory: str):
+    """Rejects uploads over the size cap, or larger than the free space left for them."""
+    if size <= 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Upload size must be positive")
+    if MAX_UPLOAD_BYTES and size > MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File exceeds the maximum upload size of {MAX_UPLOAD_BYTES} bytes",
+        )
+    if shutil.disk_usage(directory).free < size:
+        raise HTTPException(status_code=status.HTTP_507_INSUFFICIENT_STORAGE, detail="Not enough free space for this upload")
+
+
+def allocate(path: str, size: int):
+    """Creates the sparse file parts are written into."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    try:
+        os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+
+def parse_content_digest(header: Optional[str]) -> Optional[str]:
+    """The SHA-256 (hex) from an RFC 9530 `Content-Digest: sha-256=:<base64>:` header, if any."""
+    if not header:
+        return None
+    for item in header.split(","):
+        algorithm, _, value = item.strip().partition("=")
+        if algorithm.strip().lower() == "sha-256":
+            try:
+                return base64.b64decode(value.strip().strip(":"), validate=True).hex()
+            except (binascii.Error, ValueError):
+                break
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Content-Digest must carry a base64 sha-256 value")
+
+
+def _pwrite_and_hash(fd: int, data: bytes, offset: int, digest):
+    digest.update(data)
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view, offset = view[written:], offset + written
+
+
+async def write_part(chunks, path: str, offset: int, length: int, expected_sha256: Optional[str] = None) -> str:
+    """
+    Streams one part's body into `path` at `offset`, buffering up to
+    UPLOAD_CHUNK_SIZE and writing/hashing off the event loop. The part must
+    be exactly `length` bytes and match `expected_sha256` when given.
+    Returns its SHA-256. A rejected part is simply overwritten by the retry.
+    """
+    digest = hashlib.sha256()
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        received, buffer = 0, bytearray()
+        async for chunk in chunks:
+            received += len(chunk)
+            if received > length:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Part is larger than {length} bytes")
+            buffer += chunk
+            if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                await run_in_threadpool(_pwrite_and_hash, fd, bytes(buffer), offset + received - len(buffer), digest)
+                buffer.clear()
+        if buffer:
+            await run_in_threadpool(_pwrite_and_hash, fd, bytes(buffer), offset + received - len(buffer), digest)
+    finally:
+        os.close(fd)
+    if received != length:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Part has {received} bytes, expected {length}")
+    if expected_sha256 is not None and digest.hexdigest() != expected_sha256:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Part does not match its Content-Digest")
+    return digest.hexdigest()
+
+
+def parts_sha256(part_size: int, part_digests) -> str:
+    """
+    Input checksum of a resumable upload: SHA-256 over its part size and the
+    parts' SHA-256 digests in order, like a multipart ETag. Parts were hashed
+    as they were written, so finalizing never reads the file again. The same
+    bytes uploaded in the same part size get the same checksum; it differs
+    from the whole-file SHA-256 of a single-request upload.
+    """
+    digest = hashlib.sha256(f"parts:{part_size}".encode())
+    for part_digest in part_digests:
+        digest.update(bytes.fromhex(part_digest))
+    return digest.hexdigest()
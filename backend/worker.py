@@ -1,15 +1,26 @@
+import glob
 import os
+import signal
 import subprocess
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
 import pandas as pd
-from celery import Celery
-from .database import SessionLocal
-from . import models
+from celery import Celery, chain, group
+from celery.signals import worker_ready
+from .database import SessionLocal, session_scope, run_with_retry
+from . import models, result_cache, feature_store, progress, scheduling, rule_graph, metrics, artifacts, lifecycle
+from .pipeline_config import (
+    PIPELINE_DIR, PIPELINE_CONFIG_PATH, RESULTS_DIR, load_pipeline_config, feature_matrix_path,
+    sample_sheet_row, sample_feature_outputs, run_log_path, sample_benchmark_dir, run_benchmark_dir,
+)
 
 # Celery application setup remains the same
 celery_app = Celery(
     'worker',
-    broker='redis://redis:6379/0',
-    backend='redis://redis:6379/0'
+    broker=progress.REDIS_URL,
+    backend=progress.REDIS_URL
 )
 
 celery_app.conf.update(
@@ -18,10 +29,510 @@ celery_app.conf.update(
     result_serializer='json',
     timezone='UTC',
     enable_utc=True,
+    # One queue per data type (see `scheduling` in pipeline/config.yaml)
+    task_routes=(scheduling.route_pipeline_task,),
+    task_default_queue=scheduling.DEFAULT_QUEUE,
+    # Take one job at a time and only ack it once done, so jobs waiting for
+    # resources stay in the queue where any worker with room can pick them up
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    # Serve urgent jobs first; one broker priority per job priority (see scheduling.celery_priority)
+    broker_transport_options={"queue_order_strategy": "priority", "priority_steps": list(range(scheduling.MAX_PRIORITY + 1))},
+    # Run by `celery beat`: reclaims disk space (see lifecycle.py)
+    beat_schedule={
+        "sweep-storage": {"task": "backend.worker.sweep_storage", "schedule": lifecycle.SWEEP_INTERVAL_SECONDS},
+    },
 )
 
+# Lines of Snakemake output kept in memory for the failure message; the rest is only on disk
+LOG_TAIL_LINES = 50
+
+
+@worker_ready.connect
+def advertise_worker(sender=None, **kwargs):
+    """Publishes this worker's CPU/memory capacity and queues so operators can see the cluster."""
+    queues = sorted(sender.app.amqp.queues.consume_from) if sender is not None else None
+    scheduling.advertise_capacity(queues=queues)
+
+
+@worker_ready.connect
+def invalidate_stale_results(**kwargs):
+    """Drops cached results from older pipeline versions/configs when a worker starts."""
+    db = SessionLocal()
+    try:
+        removed = result_cache.invalidate_stale(db)
+        print(f"Result cache: removed {removed} stale entries.")
+    finally:
+        db.close()
+
+
+@worker_ready.connect
+def warm_reference_assets(**kwargs):
+    """Builds and preloads the shared reference assets in the background (see reference_assets.py)."""
+    if not load_pipeline_config().get("reference_assets", {}).get("warm_on_worker_start"):
+        return
+    try:
+        subprocess.Popen(
+            ["python", os.path.join(PIPELINE_DIR, "scripts", "reference_assets.py"), "warm", "--preload",
+             "--configfile", PIPELINE_CONFIG_PATH],
+            cwd=os.path.dirname(PIPELINE_DIR), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+    except OSError as e:
+        print(f"Could not warm reference assets: {e}")
+
+
+# --- Snakemake Helpers ---
+def write_sample_sheet(path: str, jobs):
+    """Writes a Snakemake sample sheet with one row per (sample_id, data_type, input_path)."""
+    rows = [sample_sheet_row(sample_id, data_type, input_path) for sample_id, data_type, input_path in jobs]
+    pd.DataFrame(rows, columns=['sample_id', 'data_type', 'accession_id', 'source_url']).to_csv(path, sep='\t', index=False)
+
+
+def snakemake_command(sample_sheet_path: str, run_id: str, targets, slot: scheduling.Slot = None, extra=()):
+    """
+    Builds the Snakemake invocation for a job or batch sample sheet, held to
+    the admitted slot. `extra` options go before the targets.
+    """
+    limits = ["--cores", str(slot.threads), "--resources", f"mem_mb={slot.mem_mb}"] if slot else ["--cores", "1"]
+    return [
+        "snakemake",
+        *limits,
+        "--snakefile", os.path.join(PIPELINE_DIR, "Snakefile"),
+        "--configfile", os.path.join(PIPELINE_DIR, "config.yaml"),
+        # Override the sample sheet and output location with our run-specific ones
+        "--config", f"samples={sample_sheet_path}", f"run_id={run_id}", f"output_dir={RESULTS_DIR}",
+        "--reason",
+        "--keep-going",
+        # Redo whatever a cancelled or preempted run left half-written
+        "--rerun-incomplete",
+        # Keep temp() intermediates when cleanup_intermediates is off
+        *([] if lifecycle.cleanup_intermediates() else ["--notemp"]),
+        *extra,
+        *targets
+    ]
+
+
+class JobStopped(Exception):
+    """A run's Snakemake was killed because all of its jobs were cancelled or preempted."""
+
+    def __init__(self, reasons: dict, output: str = ""):
+        super().__init__(f"Stopped on request: {reasons}")
+        self.reasons = reasons
+        self.output = output
+
+
+def stop_process_group(process, grace_seconds: int):
+    """
+    SIGTERM to Snakemake and every rule job it started (they share its
+    process group), then SIGKILL to whatever is left after the grace period.
+    """
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=grace_seconds)
+        except subprocess.TimeoutExpired:
+            pass
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def watch_for_stop(process, job_ids, stopped: dict, done: threading.Event):
+    """Polls for stop requests while Snakemake runs; once every job of the run has one, kills it."""
+    settings = scheduling.preemption_settings()
+    while not done.wait(settings["poll_seconds"]):
+        reasons = scheduling.stop_requests(job_ids)
+        if len(reasons) == len(job_ids):
+            print(f"Stopping Snakemake (pid {process.pid}) for jobs {reasons}")
+            stopped.update(reasons)
+            stop_process_group(process, settings["grace_seconds"])
+            return
+
+
+def release_snakemake_locks(target: str):
+    """
+    Removes the directory locks of the killed Snakemake run that produces
+    `target`. `snakemake --unlock` would also drop the locks of every other
+    run sharing the working directory.
+    """
+    app_dir = os.path.dirname(PIPELINE_DIR)
+    lock_dir = os.path.join(app_dir, ".snakemake", "locks")
+    for output_lock in glob.glob(os.path.join(lock_dir, "*.output.lock")):
+        try:
+            with open(output_lock) as fh:
+                locked = {os.path.abspath(os.path.join(app_dir, line.strip())) for line in fh}
+        except OSError:
+            continue
+        if os.path.abspath(target) in locked:
+            for path in (output_lock, output_lock.replace(".output.lock", ".input.lock")):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+def run_snakemake(command, job_ids, log_path: str, check: bool = True, watch_ids=None):
+    """
+    Runs Snakemake from the directory the Snakefile's relative paths expect.
+
+    Output is streamed line by line to `log_path` and parsed into progress
+    events for every job in `job_ids`; only the last LOG_TAIL_LINES lines are
+    kept in memory and returned as the CompletedProcess' stdout.
+
+    Snakemake gets its own process group. Once every job in `watch_ids`
+    (default `job_ids`) is asked to stop, the group is killed and JobStopped
+    raised.
+    """
+    print(f"Executing command: {' '.join(command)}")
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    tracker = progress.SnakemakeProgress()
+    tail = deque(maxlen=LOG_TAIL_LINES)
+    watch_ids = list(job_ids if watch_ids is None else watch_ids)
+    stopped, done = {}, threading.Event()
+    with open(log_path, "w") as log, subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1, cwd=os.path.dirname(PIPELINE_DIR),
+        start_new_session=True
+    ) as process:
+        watcher = threading.Thread(target=watch_for_stop, args=(process, watch_ids, stopped, done), daemon=True)
+        if watch_ids:
+            watcher.start()
+        try:
+            for line in process.stdout:
+                log.write(line)
+                tail.append(line)
+                event = tracker.feed(line)
+                if event is not None:
+                    log.flush()
+                    for job_id in job_ids:
+                        progress.publish(job_id, event)
+        finally:
+            done.set()
+    if watch_ids:
+        watcher.join()
+    output = "".join(tail)
+    if stopped:
+        raise JobStopped(stopped, output)
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, output=output)
+    return subprocess.CompletedProcess(command, process.returncode, stdout=output)
+
+
+def read_feature_matrix(path: str):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, sep='\t', index_col='sample_id')
+
+
+def write_feature_matrix(df, path: str):
+    if path.endswith('.parquet'):
+        df.to_parquet(path, index=True)
+    else:
+        df.to_csv(path, sep='\t', index=True)
+
+
+def split_feature_matrix(matrix_path: str, sample_ids):
+    """Writes each sample's row of a batch feature matrix to its own per-sample matrix."""
+    matrix = read_feature_matrix(matrix_path)
+    outputs = {}
+    for sample_id in sample_ids:
+        if sample_id in matrix.index:
+            outputs[sample_id] = feature_matrix_path(sample_id)
+            write_feature_matrix(matrix.loc[[sample_id]], outputs[sample_id])
+    return outputs
+
+
+def record_log(db, job_ids, log_path: str, tail: str):
+    """
+    Points each job at its run's full log on disk and stores the last lines.
+    Logs live in job_logs so job listings never carry pipeline output.
+    """
+    for job_id in job_ids:
+        db.merge(models.JobLog(job_id=job_id, log_path=log_path, tail=tail))
+
+
+def load_jobs(job_ids):
+    """Reads what a run needs about its jobs in one short session; rows stay usable after it closes."""
+    Job = models.AnalysisJob
+    with session_scope() as db:
+        return db.query(
+            Job.id, Job.sample_id, Job.data_type, Job.input_path, Job.input_sha256, Job.status, Job.priority
+        ).filter(Job.id.in_(job_ids)).all()
+
+
+def seconds_between(earlier, later):
+    if earlier is None or later is None:
+        return None
+    # SQLite hands datetimes back without their (UTC) timezone
+    earlier, later = (t if t.tzinfo else t.replace(tzinfo=timezone.utc) for t in (earlier, later))
+    return (later - earlier).total_seconds()
+
+
+def update_jobs(updates, log=None):
+    """
+    Applies {job_id: (status, results)} in one short transaction, retried if
+    the database is busy, then publishes the new statuses. `log` is an optional
+    (log_path, tail) recorded for every updated job.
+    Sessions are never held across a Snakemake run, which can take hours.
+
+    Jobs entering "running" are stamped started_at and finished ones
+    finished_at; their queue wait and latencies go to the metrics.
+    Cancelled jobs keep their status.
+    """
+    Job = models.AnalysisJob
+    now = datetime.now(timezone.utc)
+
+    def work(db):
+        updated = []
+        for job_id, (status, results) in updates.items():
+            values = {"status": status, "results": results}
+            if status == "running":
+                values["started_at"] = now
+            elif status in progress.TERMINAL_STATUSES:
+                values["finished_at"] = now
+            if db.query(Job).filter(Job.id == job_id, Job.status != "cancelled").update(values):
+                updated.append(job_id)
+        if log is not None:
+            record_log(db, updated, *log)
+        return db.query(Job.id, Job.data_type, Job.created_at, Job.started_at).filter(Job.id.in_(updated)).all()
+
+    start = time.perf_counter()
+    timings = run_with_retry(work)
+    metrics.observe("trace_db_write_seconds", time.perf_counter() - start, operation="update_jobs")
+    for job in timings:
+        progress.publish_status([job.id], updates[job.id][0])
+
+    for job in timings:
+        status = updates[job.id][0]
+        if status == "running":
+            metrics.observe("trace_job_queue_wait_seconds", seconds_between(job.created_at, now), data_type=job.data_type)
+        elif status in progress.TERMINAL_STATUSES:
+            metrics.observe("trace_job_duration_seconds", seconds_between(job.created_at, now), data_type=job.data_type, status=status)
+            if job.started_at is not None:
+                metrics.observe("trace_job_run_seconds", seconds_between(job.started_at, now), data_type=job.data_type, status=status)
+
+
+def record_rule_metrics(run_id: str, jobs):
+    """
+    Stores the Snakemake benchmarks of a run against its jobs and feeds the
+    per-rule histograms. Rules that serve the whole run (reference
+    preparation, the cohort merge) are charged to its first job.
+    Like caching, this must not fail the job itself.
+    """
+    try:
+        rows = [(job.id, rule, stats) for job in jobs for rule, stats in metrics.read_benchmarks(sample_benchmark_dir(job.sample_id))]
+        rows += [(jobs[0].id, rule, stats) for rule, stats in metrics.read_benchmarks(run_benchmark_dir(run_id))]
+        if rows:
+            run_with_retry(lambda db: db.add_all(models.JobRuleMetric(job_id=job_id, rule=rule, **stats) for job_id, rule, stats in rows))
+        for _, rule, stats in rows:
+            for name, field in (("trace_rule_wall_seconds", "wall_s"), ("trace_rule_cpu_seconds", "cpu_s"), ("trace_rule_max_rss_mb", "max_rss_mb")):
+                if stats[field] is not None:
+                    metrics.observe(name, stats[field], rule=rule)
+    except Exception as e:
+        print(f"Could not record rule metrics for {run_id}: {e}")
+
+
+def cache_result(job, output_file: str):
+    """
+    Lets future submissions of the same input skip the pipeline.
+    A cache failure must not turn a successful run into a failed job.
+    """
+    try:
+        with session_scope() as db:
+            result_cache.store(db, job.input_sha256, job.data_type, output_file)
+    except Exception as e:
+        print(f"Could not cache results for job {job.id}: {e}")
+
+
+def publish_features(matrix_path: str, partition_id: str, sample_ids=None):
+    """
+    Appends completed samples from a feature matrix to the cohort feature store.
+    Like caching, a store failure must not fail the job itself.
+    """
+    try:
+        features = read_feature_matrix(matrix_path)
+        if sample_ids is not None:
+            features = features.loc[list(sample_ids)]
+        feature_store.commit(features, partition_id)
+    except Exception as e:
+        print(f"Could not publish features for {partition_id}: {e}")
+
+
+def precompress_artifacts(jobs):
+    """
+    Queues gzip/zstd copies of completed jobs' larger text outputs, so
+    downloads need not compress them per request. They are written by a
+    separate task at the lowest priority, off the pipeline task's critical
+    path. Best effort, like caching.
+    """
+    if not artifacts.PRECOMPRESS or not jobs:
+        return
+    try:
+        precompress_outputs.apply_async(kwargs={"job_ids": [job.id for job in jobs]}, priority=scheduling.celery_priority(0))
+    except Exception as e:
+        print(f"Could not queue precompression for jobs {[job.id for job in jobs]}: {e}")
+
+
+# --- Distributed Execution ---
+def sample_sheet_path_for(run_id: str) -> str:
+    return os.path.join(PIPELINE_DIR, f"samples_{run_id}.tsv")
+
+
+def preemption_retry_seconds() -> int:
+    """How long a job that preempted others waits before trying for their room."""
+    settings = scheduling.preemption_settings()
+    return settings["poll_seconds"] + settings["grace_seconds"]
+
+
+def handle_stop(jobs, reasons: dict, target: str = None) -> list:
+    """
+    Cleans up after jobs stopped on request. The killed run's Snakemake locks
+    on `target` are released. Cancelled jobs' partial outputs are discarded;
+    preempted jobs keep theirs, which the next run resumes from, and go back
+    to pending. Returns the preempted jobs, for the caller to requeue.
+    """
+    if target is not None:
+        release_snakemake_locks(target)
+    scheduling.clear_stop(reasons)
+    existing = {j.id for j in load_jobs([j.id for j in jobs])}
+    cancelled = [j for j in jobs if reasons.get(j.id) != "preempt"]
+    lifecycle.discard_outputs([j for j in cancelled if j.id in existing])
+    lifecycle.discard_outputs([j for j in cancelled if j.id not in existing], keep_logs=False)
+    preempted = [j for j in jobs if reasons.get(j.id) == "preempt" and j.id in existing]
+    if preempted:
+        update_jobs({j.id: ("pending", "Preempted by a more urgent job; requeued.") for j in preempted})
+    return preempted
+
+
+def plan_rule_levels(sample_sheet_path: str, sample_id: str) -> list:
+    """Asks Snakemake for the sample's DAG and groups the rules that still have to run into levels."""
+    command = snakemake_command(sample_sheet_path, sample_id, [feature_matrix_path(sample_id)]) + ["--dag"]
+    result = subprocess.run(command, capture_output=True, text=True, check=True, cwd=os.path.dirname(PIPELINE_DIR))
+    return rule_graph.rule_levels(result.stdout)
+
+
+def dispatch_rule_graph(job_id: int, input_file_path: str, sample_id: str, data_type: str, priority: int = 0):
+    """
+    Distributed mode: runs each rule of the sample's DAG as its own Celery task.
+
+    Levels run one after another as chords (a group of rule tasks, then a
+    barrier that reports progress); rules within a level run in parallel on
+    whichever workers have room. The last step marks the job complete, and
+    any failing task marks it failed.
+    """
+    sample_sheet_path = sample_sheet_path_for(sample_id)
+    write_sample_sheet(sample_sheet_path, [(sample_id, data_type, input_file_path)])
+    try:
+        levels = plan_rule_levels(sample_sheet_path, sample_id)
+    except subprocess.CalledProcessError as e:
+        os.remove(sample_sheet_path)
+        update_jobs({job_id: ("failed", f"Could not build the Snakemake DAG (exit code {e.returncode}).")}, log=(None, e.stderr[-10000:]))
+        raise
+
+    update_jobs({job_id: ("running", f"Snakemake pipeline has started as {sum(map(len, levels))} distributed rule tasks.")})
+    total = sum(len(level) for level in levels)
+    on_error = fail_rule_graph.s(job_id=job_id, sample_id=sample_id)
+    steps, done = [], 0
+    for level in levels:
+        # Chain-level error callbacks do not reach tasks inside a chord header
+        steps.append(group(
+            run_trace_rule.si(job_id=job_id, sample_id=sample_id, data_type=data_type, rule=rule)
+            .set(priority=scheduling.celery_priority(priority)).on_error(on_error)
+            for rule in level
+        ))
+        done += len(level)
+        steps.append(finish_rule_level.si(job_id=job_id, done=done, total=total, data_type=data_type))
+    steps.append(finish_rule_graph.si(job_id=job_id, sample_id=sample_id, data_type=data_type, rules=[r for level in levels for r in level]))
+    chain(*steps).on_error(on_error).apply_async()
+    return {"status": "Dispatched", "levels": levels}
+
+
+@celery_app.task(bind=True)
+def run_trace_rule(self, job_id: int, sample_id: str, data_type: str, rule: str):
+    """
+    Runs the jobs of one rule of a sample's DAG (distributed mode).
+
+    Everything upstream already ran in earlier levels, and other rules of the
+    same level may be running on other workers in the same directory, hence
+    --nolock and --ignore-incomplete. Rule tasks stop when their job is
+    cancelled but are never preempted.
+    """
+    reasons = scheduling.stop_requests([job_id])
+    if reasons:
+        raise JobStopped(reasons)
+    profile = scheduling.job_profile(data_type)
+    slot = scheduling.admit(self.request.id, profile["threads"], profile["mem_mb"])
+    if slot is None:
+        raise self.retry(countdown=scheduling.admission_retry_seconds(), max_retries=None)
+    try:
+        progress.publish(job_id, {"type": "rule", "rule": rule})
+        command = snakemake_command(
+            sample_sheet_path_for(sample_id), sample_id, [feature_matrix_path(sample_id)], slot,
+            extra=["--until", rule, "--nolock", "--ignore-incomplete"]
+        )
+        run_snakemake(command, [], run_log_path(f"{sample_id}.{rule}"), watch_ids=[job_id])
+        return rule
+    finally:
+        scheduling.release(slot)
+
+
+@celery_app.task
+def finish_rule_level(job_id: int, done: int, total: int, data_type: str = None):
+    """Barrier between levels; reports how many rules are done."""
+    progress.publish(job_id, {"type": "progress", "done": done, "total": total, "percent": round(100 * done / total, 1), "rule": None})
+
+
+@celery_app.task
+def finish_rule_graph(job_id: int, sample_id: str, data_type: str, rules: list):
+    """Marks a distributed job complete once its feature matrix exists."""
+    final_output_file = feature_matrix_path(sample_id)
+    # One log for the job: the rule logs in execution order
+    log_path = run_log_path(sample_id)
+    with open(log_path, "w") as log:
+        for rule in rules:
+            rule_log = run_log_path(f"{sample_id}.{rule}")
+            if os.path.exists(rule_log):
+                log.write(f"=== {rule} ===\n")
+                with open(rule_log) as fh:
+                    log.writelines(fh)
+                os.remove(rule_log)
+    os.remove(sample_sheet_path_for(sample_id))
+
+    update_jobs({job_id: ("complete", f"Pipeline finished successfully. Results at: {final_output_file}")}, log=(log_path, None))
+    job = load_jobs([job_id])[0]
+    record_rule_metrics(sample_id, [job])
+    lifecycle.settle_jobs([job])
+    cache_result(job, final_output_file)
+    publish_features(final_output_file, sample_id)
+    precompress_artifacts([job])
+    return {"status": "Success", "output": final_output_file}
+
+
+@celery_app.task
+def fail_rule_graph(request, exc, traceback, job_id: int, sample_id: str):
+    """Error callback of a distributed job: the first failing rule fails the job."""
+    if scheduling.stop_requests([job_id]).get(job_id) == "cancel":
+        # Other rule tasks of the level may still be stopping, so the request stays until it expires
+        jobs = load_jobs([job_id])
+        lifecycle.discard_outputs(jobs or [models.AnalysisJob(id=job_id, sample_id=sample_id)], keep_logs=bool(jobs))
+        if os.path.exists(sample_sheet_path_for(sample_id)):
+            os.remove(sample_sheet_path_for(sample_id))
+        return
+    rule = (request.kwargs or {}).get("rule")
+    if rule is None:
+        # Chords report a failed rule a second time; keep the rule's own record
+        with session_scope() as db:
+            if db.query(models.AnalysisJob.status).filter(models.AnalysisJob.id == job_id).scalar() == "failed":
+                return
+    tail = getattr(exc, "output", None) or str(exc)
+    log_path = run_log_path(f"{sample_id}.{rule}") if rule else None
+    update_jobs({job_id: ("failed", f"Snakemake rule {rule or 'task'} failed. See the job log for details.")}, log=(log_path, tail))
+    jobs = load_jobs([job_id])
+    record_rule_metrics(sample_id, jobs)
+    lifecycle.settle_jobs(jobs)
+    if os.path.exists(sample_sheet_path_for(sample_id)):
+        os.remove(sample_sheet_path_for(sample_id))
+
+
 @celery_app.task(bind=True)
-def run_trace_pipeline(self, job_id: int, input_file_path: str, sample_id: str, data_type: str):
+def run_trace_pipeline(self, job_id: int, input_file_path: str, sample_id: str, data_type: str, priority: int = 0):
     """
     A Celery task to execute the TRACE Snakemake pipeline.
     
@@ -30,65 +541,199 @@ def run_trace_pipeline(self, job_id: int, input_file_path: str, sample_id: str,
         input_file_path: The absolute path to the uploaded file inside the container.
         sample_id: The unique identifier for the sample.
         data_type: The type of data ('WGS' or 'WGBS').
+        priority: 0 (normal) to 9; may preempt less urgent jobs on this node.
     """
-    db = SessionLocal()
+    # Deleted or cancelled while queued: nothing to do
+    jobs = load_jobs([job_id])
+    if not jobs or jobs[0].status == "cancelled" or scheduling.stop_requests([job_id]).get(job_id) == "cancel":
+        scheduling.clear_stop([job_id])
+        return {"status": "Cancelled"}
+
+    if scheduling.execution_mode() == "distributed":
+        return dispatch_rule_graph(job_id, input_file_path, sample_id, data_type, priority)
+
+    # Wait in the queue until this node has room for the data type's profile,
+    # asking less urgent jobs to make room if it has none
+    profile = scheduling.job_profile(data_type)
+    slot = scheduling.admit(self.request.id, profile["threads"], profile["mem_mb"], priority=priority, job_ids=[job_id])
+    if slot is None:
+        preempted = scheduling.preempt_for(priority, profile["threads"], profile["mem_mb"])
+        raise self.retry(countdown=preemption_retry_seconds() if preempted else scheduling.admission_retry_seconds(), max_retries=None)
+
+    job = jobs[0]
+    sample_sheet_path = sample_sheet_path_for(sample_id)
+    final_output_file = feature_matrix_path(sample_id)
     try:
         # 1. Update job status to 'running'
-        job = db.query(models.AnalysisJob).filter(models.AnalysisJob.id == job_id).first()
-        if not job:
-            raise ValueError("Job not found")
-        job.status = "running"
-        job.results = "Snakemake pipeline has started."
-        db.commit()
-
-        # 2. Define pipeline paths and create a sample sheet for this specific job
-        pipeline_dir = "/app/pipeline" # Path inside the Docker container
-        sample_sheet_path = os.path.join(pipeline_dir, f"samples_{sample_id}.tsv")
-        final_output_file = f"/app/pipeline/results/TRACE_v1.0.0_{sample_id}_feature_matrix.tsv"
-        
-        # Create a simple TSV for the one sample
-        sample_data = {'sample_id': [sample_id], 'data_type': [data_type], 'accession_id': [sample_id], 'source_url': [input_file_path]}
-        pd.DataFrame(sample_data).to_csv(sample_sheet_path, sep='\t', index=False)
-        
+        update_jobs({job_id: ("running", "Snakemake pipeline has started.")})
+
+        # 2. Create a sample sheet for this specific job
+        write_sample_sheet(sample_sheet_path, [(sample_id, data_type, input_file_path)])
+
         # 3. Construct and run the Snakemake command
-        # This command is executed inside the 'worker' container
-        command = [
-            "snakemake",
-            "--cores", "4",  # Use a reasonable number of cores
-            "--snakefile", os.path.join(pipeline_dir, "Snakefile"),
-            "--configfile", os.path.join(pipeline_dir, "config.yaml"),
-            # Override the sample sheet in the config with our job-specific one
-            "--config", f"samples={sample_sheet_path}",
-            "--reason",
-            "--keep-going",
-            final_output_file # Specify the final target file
-        ]
-        
-        print(f"Executing command: {' '.join(command)}")
-        
+        # This command is executed inside the 'worker' container.
         # We use check=True to raise an exception if Snakemake fails
-        subprocess.run(command, check=True, capture_output=True, text=True)
+        log_path = run_log_path(sample_id)
+        process = run_snakemake(snakemake_command(sample_sheet_path, sample_id, [final_output_file], slot), [job_id], log_path)
 
         # 4. Update job status to 'complete' on success
-        job.status = "complete"
-        job.results = f"Pipeline finished successfully. Results at: {final_output_file}"
-        db.commit()
+        update_jobs({job_id: ("complete", f"Pipeline finished successfully. Results at: {final_output_file}")}, log=(log_path, process.stdout))
+
+        cache_result(job, final_output_file)
+        publish_features(final_output_file, sample_id)
+        precompress_artifacts([job])
         return {"status": "Success", "output": final_output_file}
 
+    except JobStopped as e:
+        if handle_stop([job], e.reasons, final_output_file):
+            enqueue_pipeline(job_id, input_file_path, sample_id, data_type, priority)
+        return {"status": "Stopped", "reasons": e.reasons}
     except subprocess.CalledProcessError as e:
         # If Snakemake fails, update status to 'failed' and log the error
-        job.status = "failed"
-        error_message = f"Snakemake pipeline failed.\nSTDOUT: {e.stdout}\nSTDERR: {e.stderr}"
-        job.results = error_message
-        db.commit()
-        raise Exception(error_message)
+        update_jobs({job_id: ("failed", f"Snakemake pipeline failed (exit code {e.returncode}). See the job log for details.")}, log=(log_path, e.stdout))
+        raise Exception(f"Snakemake pipeline failed. Full log: {log_path}\nLast {LOG_TAIL_LINES} lines:\n{e.stdout}")
     except Exception as e:
-        job.status = "failed"
-        job.results = f"An unexpected error occurred: {str(e)}"
-        db.commit()
+        update_jobs({job_id: ("failed", f"An unexpected error occurred: {str(e)}")})
         raise
     finally:
+        record_rule_metrics(sample_id, [job])
+        lifecycle.settle_jobs([job])
         # Clean up the temporary sample sheet
         if os.path.exists(sample_sheet_path):
             os.remove(sample_sheet_path)
-        db.close()
\ No newline at end of file
+        scheduling.release(slot)
+
+
+@celery_app.task(bind=True)
+def run_trace_batch(self, batch_id: str, job_ids: list, data_type: str = None, priority: int = 0):
+    """
+    Runs many queued jobs through a single Snakemake invocation.
+
+    All samples share one sample sheet, one DAG build and one resource slot
+    sized to the sum of their profiles (clamped to the worker). Afterwards
+    each AnalysisJob is marked complete or failed from its own per-sample
+    outputs, and gets its own feature matrix split out of the batch matrix.
+
+    Args:
+        batch_id: The batch identifier shared by the jobs.
+        job_ids: IDs of the analysis jobs in the batch.
+        data_type: The batch's data type; only used to route it to a queue.
+        priority: The most urgent priority among the jobs.
+    """
+    # Jobs deleted or cancelled while queued drop out of the batch
+    reasons = scheduling.stop_requests(job_ids)
+    jobs = [j for j in load_jobs(job_ids) if j.status != "cancelled" and reasons.get(j.id) != "cancel"]
+    if not jobs:
+        scheduling.clear_stop(job_ids)
+        return {"status": "Cancelled", "batch_id": batch_id}
+    job_ids = [j.id for j in jobs]
+    profiles = [scheduling.job_profile(j.data_type) for j in jobs]
+    threads, mem_mb = sum(p["threads"] for p in profiles), sum(p["mem_mb"] for p in profiles)
+    slot = scheduling.admit(self.request.id, threads, mem_mb, priority=priority, job_ids=job_ids)
+    if slot is None:
+        preempted = scheduling.preempt_for(priority, threads, mem_mb)
+        raise self.retry(countdown=preemption_retry_seconds() if preempted else scheduling.admission_retry_seconds(), max_retries=None)
+
+    sample_sheet_path = sample_sheet_path_for(batch_id)
+    batch_matrix = feature_matrix_path(batch_id)
+    try:
+        started = f"Snakemake pipeline has started for batch {batch_id} ({len(jobs)} samples)."
+        update_jobs({j.id: ("running", started) for j in jobs})
+
+        write_sample_sheet(sample_sheet_path, [(j.sample_id, j.data_type, j.input_path) for j in jobs])
+        # --keep-going lets healthy samples finish even if others fail
+        log_path = run_log_path(batch_id)
+        process = run_snakemake(snakemake_command(sample_sheet_path, batch_id, [batch_matrix], slot), job_ids, log_path, check=False)
+
+        # Samples cancelled while the rest of the batch ran are left out
+        cancelled = {job_id for job_id, reason in scheduling.stop_requests(job_ids).items() if reason == "cancel"}
+        if cancelled:
+            handle_stop([j for j in jobs if j.id in cancelled], {job_id: "cancel" for job_id in cancelled})
+            jobs = [j for j in jobs if j.id not in cancelled]
+        succeeded = [j for j in jobs if all(os.path.exists(f) for f in sample_feature_outputs(j.sample_id, j.data_type))]
+        if succeeded and len(succeeded) < len(jobs):
+            # A failed sample blocks the cohort merge; re-merge just the healthy ones.
+            # Their per-sample outputs already exist, so only metadata_merge runs.
+            write_sample_sheet(sample_sheet_path, [(j.sample_id, j.data_type, j.input_path) for j in succeeded])
+            run_snakemake(snakemake_command(sample_sheet_path, batch_id, [batch_matrix], slot), [j.id for j in succeeded], run_log_path(f"{batch_id}_remerge"), check=False)
+
+        # Fan the batch results back out to each job
+        outputs = split_feature_matrix(batch_matrix, [j.sample_id for j in succeeded]) if os.path.exists(batch_matrix) else {}
+        updates = {}
+        for job in jobs:
+            if job.sample_id in outputs:
+                updates[job.id] = ("complete", f"Pipeline finished successfully. Results at: {outputs[job.sample_id]}")
+            else:
+                updates[job.id] = ("failed", f"Snakemake pipeline failed for sample {job.sample_id} in batch {batch_id}. See the job log for details.")
+        update_jobs(updates, log=(log_path, process.stdout))
+
+        for job in jobs:
+            if job.sample_id in outputs:
+                cache_result(job, outputs[job.sample_id])
+        if outputs:
+            publish_features(batch_matrix, batch_id, sample_ids=outputs)
+            precompress_artifacts([job for job in jobs if job.sample_id in outputs])
+        return {"status": "Success", "batch_id": batch_id, "completed": len(outputs), "failed": len(jobs) - len(outputs)}
+
+    except JobStopped as e:
+        requeued = handle_stop(jobs, e.reasons, batch_matrix)
+        if requeued:
+            enqueue_batch(batch_id, [j.id for j in requeued], data_type, max(j.priority for j in requeued))
+        return {"status": "Stopped", "batch_id": batch_id, "reasons": e.reasons}
+    except Exception as e:
+        update_jobs({job_id: ("failed", f"An unexpected error occurred: {str(e)}") for job_id in job_ids})
+        raise
+    finally:
+        record_rule_metrics(batch_id, jobs)
+        lifecycle.settle_jobs(jobs, batch_id=batch_id)
+        if os.path.exists(sample_sheet_path):
+            os.remove(sample_sheet_path)
+        scheduling.release(slot)
+
+
+# --- Submission ---
+def record_task(job_ids, task_id: str):
+    def work(db):
+        db.query(models.AnalysisJob).filter(models.AnalysisJob.id.in_(job_ids)).update({"task_id": task_id}, synchronize_session=False)
+    run_with_retry(work)
+
+
+def enqueue_pipeline(job_id: int, input_file_path: str, sample_id: str, data_type: str, priority: int = 0):
+    """Queues a job at its priority and records the task, so it can be revoked."""
+    # Job IDs can be reused (SQLite); a new submission starts without stale stop requests
+    scheduling.clear_stop([job_id])
+    result = run_trace_pipeline.apply_async(
+        kwargs={"job_id": job_id, "input_file_path": input_file_path, "sample_id": sample_id, "data_type": data_type, "priority": priority},
+        priority=scheduling.celery_priority(priority),
+    )
+    record_task([job_id], result.id)
+    return result
+
+
+def enqueue_batch(batch_id: str, job_ids: list, data_type: str = None, priority: int = 0):
+    """Queues a batch at its most urgent job's priority; every job records the shared task."""
+    scheduling.clear_stop(job_ids)
+    result = run_trace_batch.apply_async(
+        kwargs={"batch_id": batch_id, "job_ids": job_ids, "data_type": data_type, "priority": priority},
+        priority=scheduling.celery_priority(priority),
+    )
+    record_task(job_ids, result.id)
+    return result
+
+
+@celery_app.task
+def precompress_outputs(job_ids: list):
+    """Writes the compressed copies of finished jobs' outputs, then records the space they take."""
+    jobs = load_jobs(job_ids)
+    for job in jobs:
+        try:
+            artifacts.precompress_sample(job.sample_id)
+        except Exception as e:
+            print(f"Could not precompress outputs of {job.sample_id}: {e}")
+    lifecycle.record_output_bytes(jobs)
+
+
+@celery_app.task
+def sweep_storage():
+    """Periodic storage lifecycle pass: compaction, orphan removal and eviction under the disk budget."""
+    return lifecycle.sweep()
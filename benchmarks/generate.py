@@ -0,0 +1,329 @@
+# Synthetic inputs for the TRACE benchmarks.
+#
+# Every generator is deterministic for a given seed and size, so two runs of
+# the same benchmark see byte-identical data. Sizes are presets (small, medium,
+# large) that can be regenerated on their own:
+#
+#   python -m benchmarks.generate --size medium --outdir /tmp/trace-benchmarks/medium
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Matches the tissues of pipeline/config.yaml
+TISSUES = ["Lung", "Breast", "Colon", "Liver", "Stomach", "Pancreas", "Bladder", "Esophagus", "Adipose", "Blood"]
+READ_LENGTH = 50
+# hg38 autosome lengths in Mb, for genome-wide binned read depth
+AUTOSOME_MB = [248, 242, 198, 190, 181, 171, 159, 145, 138, 134, 135, 133, 114, 107, 102, 90, 83, 80, 59, 64, 47, 51]
+
+SIZES = {
+    "small": {
+        "bam_fragments": 50_000, "bam_chromosomes": 4, "chrom_length": 5_000_000,
+        "cpgs": 200_000, "beta_samples": 4, "panel_cpgs": 20_000,
+        "cohort_samples": 200, "fasta_chromosomes": 2, "fasta_length": 5_000_000,
+        "download_mb": 16, "depth_samples": 4, "depth_normals": 8, "depth_bin_size": 1_000_000,
+        "dag_samples": 1_000,
+    },
+    "medium": {
+        "bam_fragments": 1_000_000, "bam_chromosomes": 8, "chrom_length": 20_000_000,
+        "cpgs": 2_000_000, "beta_samples": 8, "panel_cpgs": 100_000,
+        "cohort_samples": 2_000, "fasta_chromosomes": 4, "fasta_length": 25_000_000,
+        "download_mb": 256, "depth_samples": 16, "depth_normals": 16, "depth_bin_size": 500_000,
+        "dag_samples": 10_000,
+    },
+    "large": {
+        "bam_fragments": 10_000_000, "bam_chromosomes": 22, "chrom_length": 50_000_000,
+        "cpgs": 10_000_000, "beta_samples": 16, "panel_cpgs": 500_000,
+        "cohort_samples": 10_000, "fasta_chromosomes": 8, "fasta_length": 50_000_000,
+        "download_mb": 2048, "depth_samples": 64, "depth_normals": 32, "depth_bin_size": 100_000,
+        "dag_samples": 25_000,
+    },
+}
+
+
+# --- Fragmentomics Inputs ---
+def fragment_sizes(rng, n):
+    """cfDNA-like fragment sizes: a mononucleosomal peak at ~167 bp plus a short tumour-like shoulder."""
+    short = rng.random(n) < 0.15
+    sizes = np.where(short, rng.normal(145, 12, n), rng.normal(167, 10, n))
+    return np.clip(sizes, READ_LENGTH + 1, 600).astype(np.int64)
+
+
+def write_bam(path, n_fragments, n_chromosomes, chrom_length, seed=0):
+    """
+    Coordinate-sorted, indexed paired-end BAM with `n_fragments` proper pairs
+    spread over chr1..chrN, plus a few duplicates and low-MAPQ pairs.
+    """
+    import pysam
+
+    rng = np.random.default_rng(seed)
+    chroms = [f"chr{i + 1}" for i in range(n_chromosomes)]
+    header = {"HD": {"VN": "1.6", "SO": "coordinate"}, "SQ": [{"SN": c, "LN": chrom_length} for c in chroms]}
+
+    tids = np.sort(rng.integers(0, n_chromosomes, n_fragments))
+    sizes = fragment_sizes(rng, n_fragments)
+    starts = rng.integers(0, chrom_length - sizes.max(), n_fragments)
+    mapq = np.where(rng.random(n_fragments) < 0.05, 0, 60)
+    duplicate = rng.random(n_fragments) < 0.02
+    bases = np.frombuffer(b"ACGT", dtype=np.uint8)
+    sequences = bases[rng.integers(0, 4, (2 * n_fragments, READ_LENGTH))].view(f"S{READ_LENGTH}").ravel()
+
+    tmp_path = f"{path}.unsorted.bam"
+    with pysam.AlignmentFile(tmp_path, "wb", header=header) as bam:
+        for i in range(n_fragments):
+            tid, start, size = int(tids[i]), int(starts[i]), int(sizes[i])
+            mate_start = start + size - READ_LENGTH
+            dup = 0x400 if duplicate[i] else 0
+            for mate, (flag, pos, mpos, tlen) in enumerate((
+                (0x1 | 0x2 | 0x20 | 0x40 | dup, start, mate_start, size),
+                (0x1 | 0x2 | 0x10 | 0x80 | dup, mate_start, start, -size),
+            )):
+                read = pysam.AlignedSegment(bam.header)
+                read.query_name = f"f{i}"
+                read.flag = flag
+                read.reference_id = read.next_reference_id = tid
+                read.reference_start, read.next_reference_start = pos, mpos
+                read.mapping_quality = int(mapq[i])
+                read.cigartuples = [(0, READ_LENGTH)]
+                read.template_length = tlen
+                read.query_sequence = sequences[2 * i + mate].decode()
+                bam.write(read)
+    pysam.sort("-o", path, tmp_path)
+    os.remove(tmp_path)
+    pysam.index(path)
+
+
+def write_fasta(path, n_chromosomes, length, seed=0):
+    """Random reference with ~41% GC and short N gaps, plus its .fai."""
+    import pysam
+
+    rng = np.random.default_rng(seed)
+    weights = [0.295, 0.205, 0.205, 0.295]
+    with open(path, "wb") as fh:
+        for i in range(n_chromosomes):
+            seq = np.frombuffer(b"ACGT", dtype=np.uint8)[rng.choice(4, length, p=weights)]
+            for gap in rng.integers(0, length - 10_000, 5):
+                seq[gap:gap + 10_000] = ord("N")
+            fh.write(f">chr{i + 1}\n".encode())
+            for start in range(0, length, 60):
+                fh.write(seq[start:start + 60].tobytes() + b"\n")
+    pysam.faidx(path)
+
+
+def _write_wig(path, tracks, bin_size, fmt):
+    with open(path, "w") as fh:
+        for chrom, values in tracks:
+            fh.write(f"fixedStep chrom={chrom} start=1 step={bin_size} span={bin_size}\n")
+            fh.write("\n".join(fmt.format(v) for v in values) + "\n")
+
+
+def write_depth_wigs(outdir, n_samples, n_normals, bin_size, seed=0):
+    """
+    Genome-wide read-count WIGs for tumor-fraction estimation, with GC and
+    mappability WIGs and a centromere BED. Depth follows a GC bias and a
+    per-bin bias shared by all samples (what a panel of normals removes);
+    tumor samples carry arm-level copy-number changes at known tumor fractions.
+    Returns the file paths and the true tumor fractions.
+    """
+    rng = np.random.default_rng(seed)
+    chroms = [f"chr{i + 1}" for i in range(len(AUTOSOME_MB))]
+    n_bins = [mb * 1_000_000 // bin_size for mb in AUTOSOME_MB]
+    total = sum(n_bins)
+    gc = np.clip(rng.normal(0.41, 0.05, total), 0.25, 0.65)
+    mappability = np.where(rng.random(total) < 0.05, rng.uniform(0.2, 0.9, total), rng.uniform(0.95, 1.0, total))
+    expected = 1e9 / bin_size * np.exp(-((gc - 0.45) / 0.12) ** 2) * mappability * rng.lognormal(0, 0.1, total)
+    offsets = np.cumsum([0] + n_bins)
+
+    def split(values):
+        return [(c, values[offsets[i]:offsets[i + 1]]) for i, c in enumerate(chroms)]
+
+    files = {name: os.path.join(outdir, name) for name in ("gc.wig", "map.wig", "centromere.bed")}
+    _write_wig(files["gc.wig"], split(gc), bin_size, "{:.6f}")
+    _write_wig(files["map.wig"], split(mappability), bin_size, "{:.6f}")
+    with open(files["centromere.bed"], "w") as fh:
+        for chrom, mb in zip(chroms, AUTOSOME_MB):
+            fh.write(f"{chrom}\t{mb * 400_000}\t{mb * 400_000 + 3_000_000}\n")
+
+    normals, tumors, fractions = [], [], []
+    for i in range(n_normals):
+        path = os.path.join(outdir, f"normal{i:03d}.wig")
+        _write_wig(path, split(rng.poisson(expected)), bin_size, "{}")
+        normals.append(path)
+    for i in range(n_samples):
+        tf = [0.0, 0.05, 0.1, 0.2, 0.3, 0.5][i % 6]
+        copy_number = np.full(total, 2.0)
+        # Whole-arm gains and losses on a few chromosomes
+        for c in rng.choice(len(chroms), 6, replace=False):
+            arm = slice(offsets[c], offsets[c] + n_bins[c] // 2) if rng.random() < 0.5 else slice(offsets[c] + n_bins[c] // 2, offsets[c + 1])
+            copy_number[arm] = rng.choice([1, 3, 4])
+        ratio = (2 * (1 - tf) + copy_number * tf) / 2
+        path = os.path.join(outdir, f"tumor{i:03d}.wig")
+        _write_wig(path, split(rng.poisson(expected * ratio)), bin_size, "{}")
+        tumors.append(path)
+        fractions.append(tf)
+    return {**files, "normal_wigs": normals, "wigs": tumors, "true_tumor_fractions": fractions}
+
+
+def write_ichor_params(outdir, sample_ids, seed=0):
+    """ichorCNA params.txt files, one per sample, as merge_features expects them."""
+    rng = np.random.default_rng(seed)
+    paths = []
+    for sample_id in sample_ids:
+        tf, ploidy = rng.uniform(0, 0.4), rng.uniform(1.8, 3.2)
+        path = os.path.join(outdir, f"{sample_id}.params.txt")
+        with open(path, "w") as fh:
+            fh.write("Sample\tTumor Fraction\tPloidy\tSubclone Fraction\tFraction Genome Subclonal\n")
+            fh.write(f"{sample_id}\t{tf:.4f}\t{ploidy:.3f}\t0\t0\n")
+            fh.write(f"Gender:\tfemale\nTumor Fraction:\t{tf:.4f}\nPloidy:\t{ploidy:.3f}\n")
+        paths.append(path)
+    return paths
+
+
+def write_fragment_summaries(outdir, sample_ids, seed=0):
+    rng = np.random.default_rng(seed)
+    paths = []
+    for sample_id in sample_ids:
+        path = os.path.join(outdir, f"{sample_id}_summary.tsv")
+        pd.DataFrame({
+            "sample_id": [sample_id],
+            "n_fragments": [int(rng.integers(1e6, 5e7))],
+            "mean_size": [rng.normal(165, 5)],
+            "median_size": [int(rng.normal(166, 4))],
+            "short_fraction": [rng.uniform(0.05, 0.3)],
+            "short_long_ratio": [rng.uniform(0.05, 0.5)],
+        }).to_csv(path, sep="\t", index=False)
+        paths.append(path)
+    return paths
+
+
+# --- Methylomics Inputs ---
+def write_reference_panel(path, n_cpgs, seed=0):
+    """CpG x tissue reference betas; CpG IDs are the first `n_cpgs` of the beta matrix."""
+    rng = np.random.default_rng(seed)
+    panel = pd.DataFrame(rng.beta(0.5, 0.5, (n_cpgs, len(TISSUES))), columns=TISSUES)
+    panel.index = pd.Index([f"cg{i:08d}" for i in range(n_cpgs)], name="cpg_id")
+    panel.to_csv(path, sep="\t", float_format="%.4f")
+    return panel
+
+
+def write_beta_matrix(path, n_cpgs, n_samples, panel, seed=0):
+    """
+    CpG x sample beta matrix with per-sample `.cov` coverage columns. Panel
+    CpGs are mixtures of the reference tissues plus noise; the rest are random.
+    5% of values are missing.
+    """
+    rng = np.random.default_rng(seed)
+    proportions = rng.dirichlet(np.ones(len(TISSUES)), n_samples)
+    betas = rng.beta(0.5, 0.5, (n_cpgs, n_samples))
+    n_panel = min(len(panel), n_cpgs)
+    betas[:n_panel] = np.clip(panel.to_numpy()[:n_panel] @ proportions.T + rng.normal(0, 0.05, (n_panel, n_samples)), 0, 1)
+    betas[rng.random(betas.shape) < 0.05] = np.nan
+
+    samples = [f"S{i:03d}" for i in range(n_samples)]
+    columns = {}
+    for j, sample_id in enumerate(samples):
+        columns[sample_id] = betas[:, j]
+        columns[f"{sample_id}.cov"] = rng.poisson(20, n_cpgs).astype(np.float32)
+    matrix = pd.DataFrame(columns, index=pd.Index([f"cg{i:08d}" for i in range(n_cpgs)], name="cpg_id"))
+    # Rows in genomic rather than panel order, as a real caller would write them
+    matrix = matrix.iloc[rng.permutation(n_cpgs)]
+    matrix.to_csv(path, sep="\t", float_format="%.4f", chunksize=500_000)
+    return dict(zip(samples, proportions.tolist()))
+
+
+def write_cohort_tables(outdir, sample_ids, seed=0):
+    """Per-sample methylation proportion and QC tables for merge_features."""
+    rng = np.random.default_rng(seed)
+    props, qcs = [], []
+    for sample_id in sample_ids:
+        prop_path = os.path.join(outdir, f"{sample_id}_tissue_props.tsv")
+        df = pd.DataFrame([rng.dirichlet(np.ones(len(TISSUES)))], columns=TISSUES)
+        df.insert(0, "sample_id", sample_id)
+        df.to_csv(prop_path, sep="\t", index=False)
+        qc_path = os.path.join(outdir, f"{sample_id}_meth_qc.tsv")
+        pd.DataFrame({
+            "sample_id": [sample_id], "global_methylation": [rng.uniform(0.6, 0.8)],
+            "avg_cpg_coverage": [rng.uniform(5, 40)], "deconvolution_rmse": [rng.uniform(0.05, 0.2)],
+        }).to_csv(qc_path, sep="\t", index=False)
+        props.append(prop_path)
+        qcs.append(qc_path)
+    return props, qcs
+
+
+def write_sample_sheet(path, sample_ids, data_type="WGS"):
+    pd.DataFrame({
+        "sample_id": sample_ids,
+        "data_type": data_type,
+        "accession_id": sample_ids,
+        "source_url": [f"uploads/{s}.bam" for s in sample_ids],
+    }).to_csv(path, sep="\t", index=False)
+
+
+def write_blob(path, size_mb, seed=0):
+    """Incompressible payload for transfer benchmarks."""
+    rng = np.random.default_rng(seed)
+    with open(path, "wb") as fh:
+        for _ in range(size_mb):
+            fh.write(rng.bytes(1024 * 1024))
+
+
+# --- Datasets ---
+def generate(outdir, size="small", seed=0):
+    """
+    Writes the full dataset for a size preset into `outdir` and returns its
+    manifest. An existing dataset with the same size and seed is reused.
+    """
+    params = SIZES[size]
+    manifest_path = os.path.join(outdir, "manifest.json")
+    try:
+        with open(manifest_path) as fh:
+            manifest = json.load(fh)
+        if manifest["size"] == size and manifest["seed"] == seed and manifest["params"] == params:
+            return manifest
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+
+    os.makedirs(outdir, exist_ok=True)
+    cohort_dir = os.path.join(outdir, "cohort")
+    os.makedirs(cohort_dir, exist_ok=True)
+    files = {name: os.path.join(outdir, name) for name in ("sample.bam", "reference.fa", "panel.tsv", "betas.tsv", "blob.bin", "samples.tsv", "dag_samples.tsv")}
+
+    print(f"Generating {size} benchmark dataset in {outdir}...")
+    write_bam(files["sample.bam"], params["bam_fragments"], params["bam_chromosomes"], params["chrom_length"], seed)
+    write_fasta(files["reference.fa"], params["fasta_chromosomes"], params["fasta_length"], seed)
+    panel = write_reference_panel(files["panel.tsv"], params["panel_cpgs"], seed)
+    truth = write_beta_matrix(files["betas.tsv"], params["cpgs"], params["beta_samples"], panel, seed)
+    write_blob(files["blob.bin"], params["download_mb"], seed)
+
+    sample_ids = [f"S{i:05d}" for i in range(params["cohort_samples"])]
+    write_sample_sheet(files["samples.tsv"], sample_ids)
+    # Every third sample of the DAG sheet is WGBS, so both branches of the Snakefile are planned
+    dag_ids = [f"D{i:06d}" for i in range(params["dag_samples"])]
+    write_sample_sheet(files["dag_samples.tsv"], dag_ids, ["WGBS" if i % 3 == 0 else "WGS" for i in range(len(dag_ids))])
+    frag = write_fragment_summaries(cohort_dir, sample_ids, seed)
+    ichor = write_ichor_params(cohort_dir, sample_ids, seed)
+    meth_props, meth_qc = write_cohort_tables(cohort_dir, sample_ids, seed)
+    depth_dir = os.path.join(outdir, "depth")
+    os.makedirs(depth_dir, exist_ok=True)
+    depth = write_depth_wigs(depth_dir, params["depth_samples"], params["depth_normals"], params["depth_bin_size"], seed)
+
+    manifest = {
+        "size": size, "seed": seed, "params": params, "files": files,
+        "cohort": {"frag_summaries": frag, "ichor_summaries": ichor, "meth_props": meth_props, "meth_qc": meth_qc},
+        "depth": depth,
+        "true_proportions": truth,
+    }
+    with open(manifest_path, "w") as fh:
+        json.dump(manifest, fh)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetic benchmark data for TRACE.")
+    parser.add_argument("--size", choices=sorted(SIZES), default="small")
+    parser.add_argument("--outdir", required=True)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate(args.outdir, args.size, args.seed)
@@ -0,0 +1,231 @@
+# Load test for the API: concurrent clients log in, upload samples and page
+# through their job lists against a real uvicorn server.
+#
+# Everything runs locally: the database is a fresh SQLite file (or
+# --database-url), and Redis (progress events and the Celery broker) is a
+# fakeredis TCP server unless --redis-url points at a real one. No Celery
+# worker consumes the queue, so the test measures the API alone.
+#
+#   python -m benchmarks.load --clients 16 --duration 30
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlencode
+
+from . import results
+
+PASSWORD = "benchmark-password"
+
+
+# --- Local Services ---
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_redis():
+    """Starts an in-process Redis stand-in; returns (server, url)."""
+    try:
+        from fakeredis import TcpFakeServer
+    except ImportError:
+        raise SystemExit("The load test needs a Redis: install fakeredis (>=2.21) or pass --redis-url.")
+    port = free_port()
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"redis://127.0.0.1:{port}/0"
+
+
+def start_api(workdir, port, redis_url, database_url, workers):
+    """Creates the schema and starts uvicorn; returns the process once it answers."""
+    env = {
+        **os.environ,
+        "PYTHONPATH": results.REPO_DIR,
+        "DATABASE_URL": database_url,
+        "REDIS_URL": redis_url,
+        "TRACE_PIPELINE_DIR": os.path.join(results.REPO_DIR, "pipeline"),
+        "TRACE_RESULT_CACHE_DIR": os.path.join(workdir, "cache"),
+        "TRACE_FEATURE_STORE_DIR": os.path.join(workdir, "feature_store"),
+    }
+    subprocess.run([sys.executable, "-m", "backend.init_db"], cwd=workdir, env=env, check=True, capture_output=True)
+    log = open(os.path.join(workdir, "api.log"), "wb")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"API exited during start-up:\n{open(log.name).read()}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            conn.getresponse().read()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit(f"API did not start within 60s; see {log.name}")
+
+
+# --- Clients ---
+class Client:
+    """One simulated user with a keep-alive connection, recording per-endpoint latencies."""
+
+    def __init__(self, port, email):
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        self.email = email
+        self.token = None
+        self.latencies = {}
+        self.errors = {}
+
+    def call(self, name, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        start = time.perf_counter()
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self.conn.close()
+            self.errors[name] = self.errors.get(name, 0) + 1
+            print(f"{name} failed: {e}")
+            return None
+        self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+        if response.status >= 400:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            return None
+        return json.loads(payload) if payload else None
+
+    def register(self):
+        body = json.dumps({"email": self.email, "password": PASSWORD})
+        return self.call("POST /users/", "POST", "/users/", body, {"Content-Type": "application/json"})
+
+    def login(self):
+        body = urlencode({"username": self.email, "password": PASSWORD})
+        token = self.call("POST /token", "POST", "/token", body, {"Content-Type": "application/x-www-form-urlencoded"})
+        self.token = token and token["access_token"]
+
+    def upload(self, size):
+        boundary = uuid.uuid4().hex
+        head = (
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"bench.bam\"\r\n"
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        # Random content so no upload is served from the result cache
+        body = head + os.urandom(size) + f"\r\n--{boundary}--\r\n".encode()
+        self.call("POST /analyses/", "POST", "/analyses/?data_type=WGS", body, {"Content-Type": f"multipart/form-data; boundary={boundary}"})
+
+    def list_jobs(self, pages):
+        cursor = None
+        for _ in range(pages):
+            query = urlencode({"limit": 50, **({"cursor": cursor} if cursor else {})})
+            page = self.call("GET /analyses/", "GET", f"/analyses/?{query}")
+            cursor = page and page["next_cursor"]
+            if not cursor:
+                break
+
+
+def client_loop(client, opts, barrier):
+    barrier.wait()
+    deadline = time.time() + opts.duration
+    rng = random.Random(client.email)
+    while time.time() < deadline:
+        if rng.random() < opts.upload_fraction:
+            client.upload(opts.upload_kb * 1024)
+        else:
+            client.list_jobs(opts.pages)
+
+
+def summarize(latencies, errors, elapsed):
+    """Per-endpoint request counts, throughput and latency percentiles (ms)."""
+    cases = {}
+    for name in sorted(set(latencies) | set(errors)):
+        samples = sorted(latencies.get(name, []))
+        entry = {"requests": len(samples), "errors": errors.get(name, 0), "throughput_rps": len(samples) / elapsed}
+        if samples:
+            pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+            entry.update({"mean_ms": statistics.mean(samples) * 1000, "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": samples[-1] * 1000})
+        cases[name] = entry
+    return cases
+
+
+def main(args):
+    workdir = tempfile.mkdtemp(prefix="trace-load-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'trace.db')}"
+    redis_server = None
+    redis_url = args.redis_url
+    if redis_url is None:
+        redis_server, redis_url = start_fake_redis()
+    port = free_port()
+    api = start_api(workdir, port, redis_url, database_url, args.workers)
+    try:
+        clients = [Client(port, f"bench-{i}-{uuid.uuid4().hex[:6]}@example.com") for i in range(args.clients)]
+        for client in clients:
+            client.register()
+        # Seed every user's job list so listing pages through real rows
+        for client in clients:
+            client.login()
+            for _ in range(args.seed_jobs):
+                client.upload(1024)
+            client.latencies.pop("POST /analyses/", None)
+
+        print(f"Running {args.clients} clients for {args.duration}s against {args.workers} API worker(s)...")
+        barrier = threading.Barrier(args.clients + 1)
+        threads = [threading.Thread(target=client_loop, args=(c, args, barrier)) for c in clients]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.time()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+    finally:
+        api.terminate()
+        api.wait()
+        if redis_server is not None:
+            redis_server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies, errors = {}, {}
+    for client in clients:
+        for name, samples in client.latencies.items():
+            latencies.setdefault(name, []).extend(samples)
+        for name, count in client.errors.items():
+            errors[name] = errors.get(name, 0) + count
+    cases = summarize(latencies, errors, elapsed)
+    for name, entry in cases.items():
+        print(f"{name:<20} {entry['requests']:>7} req {entry['throughput_rps']:>8.1f}/s  p50 {entry.get('p50_ms', 0):>7.1f} ms  p99 {entry.get('p99_ms', 0):>7.1f} ms  errors {entry['errors']}")
+
+    config = {key: getattr(args, key) for key in ("clients", "duration", "workers", "upload_kb", "upload_fraction", "pages", "seed_jobs")}
+    config["database"] = "sqlite" if args.database_url is None else args.database_url.split(":", 1)[0]
+    results.save("load", config, cases, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for the TRACE API.")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of sustained load.")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes.")
+    parser.add_argument("--upload_kb", type=int, default=256, help="Size of each uploaded file.")
+    parser.add_argument("--upload_fraction", type=float, default=0.3, help="Share of iterations that upload; the rest list jobs.")
+    parser.add_argument("--pages", type=int, default=2, help="Job list pages fetched per listing.")
+    parser.add_argument("--seed_jobs", type=int, default=60, help="Jobs uploaded per user before the timed run.")
+    parser.add_argument("--redis-url", dest="redis_url", help="Use this Redis instead of an in-process fakeredis.")
+    parser.add_argument("--database-url", dest="database_url", help="Use this database instead of a fresh SQLite file.")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/load-<timestamp>.json).")
+    args = parser.parse_args()
+    main(args)
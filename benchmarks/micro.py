@@ -0,0 +1,296 @@
+# Microbenchmarks for the pipeline scripts.
+#
+# Each case runs one script of pipeline/scripts exactly as the Snakefile does,
+# as a subprocess on generated data, and records wall time, CPU time and peak
+# RSS (of the script and the worker processes it waits for). Times include
+# interpreter start-up, which is part of every Snakemake job as well.
+#
+#   python -m benchmarks.micro --size small --repeat 3
+#   python -m benchmarks.micro --cases deconvolution merge_features
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import yaml
+
+from . import generate, results
+
+PIPELINE_DIR = os.path.join(results.REPO_DIR, "pipeline")
+SCRIPTS_DIR = os.path.join(PIPELINE_DIR, "scripts")
+
+
+def script(name):
+    return [sys.executable, os.path.join(SCRIPTS_DIR, name)]
+
+
+# --- Local HTTP Stand-in ---
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static file server with single-range GETs, like the object stores data is fetched from."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def end_headers(self):
+        self.send_header("Accept-Ranges", "bytes")
+        super().end_headers()
+
+    def do_GET(self):
+        range_header = self.headers.get("Range", "")
+        path = self.translate_path(self.path)
+        if not range_header.startswith("bytes=") or not os.path.isfile(path):
+            return super().do_GET()
+        size = os.path.getsize(path)
+        start, _, end = range_header[len("bytes="):].partition("-")
+        start, end = int(start), min(int(end) if end else size - 1, size - 1)
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        with open(path, "rb") as fh:
+            fh.seek(start)
+            remaining = end - start + 1
+            while remaining:
+                data = fh.read(min(remaining, 1 << 20))
+                self.wfile.write(data)
+                remaining -= len(data)
+
+
+def serve_directory(directory):
+    """Starts a local range-capable HTTP server in a thread; returns (server, base_url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(RangeRequestHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# --- Cases ---
+# Each case takes (dataset manifest, run directory, options) and returns the
+# command to time plus an optional `reset` callable run before every repetition.
+def case_bin_coverage(data, run_dir, opts):
+    return script("bin_coverage.py") + [
+        "--bam", data["files"]["sample.bam"], "--output", os.path.join(run_dir, "sample.wig"),
+        "--window_size", "1000000", "--threads", str(opts.threads),
+    ], None
+
+
+def case_fragment_metrics(data, run_dir, opts):
+    out = partial(os.path.join, run_dir)
+    return script("fragment_metrics.py") + [
+        "--bam", data["files"]["sample.bam"], "--sample_id", "sample",
+        "--fragments", out("fragments.tsv.gz"), "--summary", out("summary.tsv"), "--windows", out("windows.tsv"),
+        "--motifs", out("motifs.tsv"), "--size_plot", out("sizes.png"), "--threads", str(opts.threads),
+    ], None
+
+
+def case_deconvolution(data, run_dir, opts):
+    return script("deconvolution.py") + [
+        "--beta_matrix", data["files"]["betas.tsv"], "--ref_panel", data["files"]["panel.tsv"],
+        "--out_props", os.path.join(run_dir, "props.tsv"), "--out_qc", os.path.join(run_dir, "qc.tsv"),
+    ], None
+
+
+def case_deconvolution_cached(data, run_dir, opts):
+    # The first run converts the panel into the asset store; the timed runs map it
+    asset_dir = os.path.join(run_dir, "assets")
+    command = case_deconvolution(data, run_dir, opts)[0] + ["--asset_dir", asset_dir]
+    if not os.path.exists(asset_dir):
+        subprocess.run(command, check=True, capture_output=True)
+    return command, None
+
+
+def case_merge_features(data, run_dir, opts):
+    # Paths relative to the dataset directory keep the argument list under ARG_MAX for large cohorts
+    root = os.path.dirname(data["files"]["samples.tsv"])
+    rel = lambda paths: [os.path.relpath(p, root) for p in paths]
+    cohort = data["cohort"]
+    command = script("merge_features.py") + [
+        "--sample_sheet", "samples.tsv", "--version", "bench",
+        "--output", os.path.join(run_dir, "matrix.parquet"), "--threads", str(opts.threads),
+        "--frag_summaries", *rel(cohort["frag_summaries"]),
+        "--ichor_summaries", *rel(cohort["ichor_summaries"]),
+        "--meth_props", *rel(cohort["meth_props"]),
+        "--meth_qc", *rel(cohort["meth_qc"]),
+    ]
+    return (command, root), None
+
+
+def case_reference_index_build(data, run_dir, opts):
+    index_dir = os.path.join(run_dir, "index")
+    reset = partial(shutil.rmtree, index_dir, ignore_errors=True)
+    return script("reference_index.py") + ["build", "--fasta", data["files"]["reference.fa"], "--outdir", index_dir], reset
+
+
+def case_reference_index_derive(data, run_dir, opts):
+    index_dir = os.path.join(run_dir, "index_derive")
+    if not os.path.exists(index_dir):
+        subprocess.run(script("reference_index.py") + ["build", "--fasta", data["files"]["reference.fa"], "--outdir", index_dir], check=True, capture_output=True)
+    return script("reference_index.py") + [
+        "derive", "--index", index_dir, "--window_size", "1000000", "--gc_out", os.path.join(run_dir, "gc.wig"),
+    ], None
+
+
+def case_tumor_fraction(data, run_dir, opts):
+    # All tumor WIGs in one process against a panel built once from the normals
+    depth = data["depth"]
+    references = ["--gc_wig", depth["gc.wig"], "--map_wig", depth["map.wig"], "--centromere", depth["centromere.bed"]]
+    panel = os.path.join(run_dir, "panel_of_normals.tsv")
+    if not os.path.exists(panel):
+        subprocess.run(script("tumor_fraction.py") + ["panel", "--wigs", *depth["normal_wigs"], *references, "--output", panel], check=True, capture_output=True)
+    sample_ids = [os.path.basename(w)[:-len(".wig")] for w in depth["wigs"]]
+    return script("tumor_fraction.py") + [
+        "estimate", "--wigs", *depth["wigs"], "--sample_ids", *sample_ids, *references, "--normal_panel", panel,
+        "--summaries", *[os.path.join(run_dir, f"{s}.tumor_fraction.tsv") for s in sample_ids],
+    ], None
+
+
+def _download_sheet(run_dir, source):
+    path = os.path.join(run_dir, "download.tsv")
+    with open(path, "w") as fh:
+        fh.write("sample_id\tdata_type\taccession_id\tsource_url\n")
+        fh.write(f"bench\tWGS\tBENCH0001\t{source}\n")
+    return path
+
+
+def case_download_remote(data, run_dir, opts):
+    blob = data["files"]["blob.bin"]
+    _, base_url = serve_directory(os.path.dirname(blob))
+    cache_dir = os.path.join(run_dir, "cache")
+    sheet = _download_sheet(run_dir, f"{base_url}/{os.path.basename(blob)}")
+    # Cold cache every time: measure the transfer, not the cache hit
+    reset = partial(shutil.rmtree, cache_dir, ignore_errors=True)
+    return script("download_data.py") + [
+        "--sample_sheet", sheet, "--sample_id", "bench", "--output_dir", os.path.join(run_dir, "raw"),
+        "--cache_dir", cache_dir, "--chunk_size_mb", "8",
+    ], reset
+
+
+def case_download_local(data, run_dir, opts):
+    sheet = _download_sheet(run_dir, data["files"]["blob.bin"])
+    return script("download_data.py") + [
+        "--sample_sheet", sheet, "--sample_id", "bench", "--output_dir", os.path.join(run_dir, "raw"),
+        "--cache_dir", os.path.join(run_dir, "cache"),
+    ], None
+
+
+def _config_paths(value):
+    """All string values of a config section, recursively."""
+    if isinstance(value, dict):
+        for item in value.values():
+            yield from _config_paths(item)
+    elif isinstance(value, str):
+        yield value
+
+
+def _pipeline_workdir(run_dir):
+    """A working directory laid out like the worker's: the pipeline plus empty reference files."""
+    workdir = os.path.join(run_dir, "app")
+    pipeline_dir = os.path.join(workdir, "pipeline")
+    os.makedirs(pipeline_dir, exist_ok=True)
+    for name in ("Snakefile", "config.yaml", "scripts"):
+        if not os.path.lexists(os.path.join(pipeline_dir, name)):
+            os.symlink(os.path.join(PIPELINE_DIR, name), os.path.join(pipeline_dir, name))
+    with open(os.path.join(PIPELINE_DIR, "config.yaml")) as fh:
+        config = yaml.safe_load(fh)
+    # Reference files only (the index and asset directories are built by the pipeline)
+    for path in _config_paths(config):
+        if path.startswith("pipeline/references/") and os.path.splitext(path)[1]:
+            os.makedirs(os.path.dirname(os.path.join(workdir, path)), exist_ok=True)
+            open(os.path.join(workdir, path), "a").close()
+    return workdir
+
+
+def case_dag_build(data, run_dir, opts):
+    # Plans every job of a large sample sheet, as the worker's --dag call does, without running any
+    workdir = _pipeline_workdir(run_dir)
+    command = [
+        sys.executable, "-m", "snakemake", "--snakefile", "pipeline/Snakefile", "--configfile", "pipeline/config.yaml",
+        "--config", f"samples={data['files']['dag_samples.tsv']}", f"output_dir={os.path.join(run_dir, 'results')}",
+        "--dag",
+    ]
+    return (command, workdir), None
+
+
+CASES = {
+    "bin_coverage": case_bin_coverage,
+    "fragment_metrics": case_fragment_metrics,
+    "deconvolution": case_deconvolution,
+    "deconvolution_cached": case_deconvolution_cached,
+    "merge_features": case_merge_features,
+    "reference_index_build": case_reference_index_build,
+    "reference_index_derive": case_reference_index_derive,
+    "tumor_fraction": case_tumor_fraction,
+    "download_remote": case_download_remote,
+    "download_local": case_download_local,
+    "dag_build": case_dag_build,
+}
+
+
+# --- Measurement ---
+def measure(command, cwd, log_path):
+    """Runs one command; returns (wall seconds, CPU seconds, peak RSS in MB)."""
+    usage_path = f"{log_path}.usage.json"
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [results.REPO_DIR, os.environ.get("PYTHONPATH")]))}
+    with open(log_path, "ab") as log:
+        subprocess.run([sys.executable, "-m", "benchmarks.spawn", usage_path] + command, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT, check=True)
+    with open(usage_path) as fh:
+        usage = json.load(fh)
+    if usage["returncode"] != 0:
+        raise RuntimeError(f"{command[1]} exited with {usage['returncode']}; see {log_path}")
+    return usage["wall_s"], usage["cpu_s"], usage["max_rss_mb"]
+
+
+def run_case(name, data, run_dir, opts):
+    os.makedirs(run_dir, exist_ok=True)
+    command, reset = CASES[name](data, run_dir, opts)
+    command, cwd = command if isinstance(command, tuple) else (command, run_dir)
+    log_path = os.path.join(run_dir, "output.log")
+    walls, cpus, rss = [], [], []
+    for _ in range(opts.repeat):
+        if reset is not None:
+            reset()
+        wall, cpu, peak = measure(command, cwd, log_path)
+        walls.append(wall)
+        cpus.append(cpu)
+        rss.append(peak)
+    return {
+        "wall_s": statistics.median(walls),
+        "wall_min_s": min(walls),
+        "cpu_s": statistics.median(cpus),
+        "max_rss_mb": max(rss),
+        "runs": walls,
+    }
+
+
+def main(args):
+    workdir = args.workdir or os.path.join(tempfile.gettempdir(), "trace-benchmarks")
+    data = generate.generate(os.path.join(workdir, "data", args.size), args.size, args.seed)
+    run_root = os.path.join(workdir, "runs", args.size)
+
+    cases = {}
+    for name in args.cases:
+        print(f"{name}...", end=" ", flush=True)
+        cases[name] = run_case(name, data, os.path.join(run_root, name), args)
+        print(f"{cases[name]['wall_s']:.2f}s, {cases[name]['max_rss_mb']:.0f} MB")
+    config = {"size": args.size, "seed": args.seed, "threads": args.threads, "repeat": args.repeat}
+    results.save("micro", config, cases, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the TRACE pipeline scripts.")
+    parser.add_argument("--size", choices=sorted(generate.SIZES), default="small")
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=list(CASES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Generated data and run outputs (default: $TMPDIR/trace-benchmarks).")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/micro-<timestamp>.json).")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,98 @@
+# Benchmark result files and regression comparison.
+#
+# A result file is JSON: run metadata (commit, host, Python) plus one entry
+# per case holding its metrics. Metrics are "lower is better" unless listed in
+# HIGHER_IS_BETTER. Compare a run against a baseline with
+#
+#   python -m benchmarks.results baseline.json candidate.json --threshold 0.1
+#
+# which exits non-zero if any metric regressed by more than the threshold.
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+HIGHER_IS_BETTER = {"throughput_rps"}
+# Counts that scale with the run's duration rather than with performance
+NOT_COMPARED = {"requests"}
+# Metrics too noisy or too small to gate on
+IGNORED_BELOW = {"wall_s": 0.05, "max_rss_mb": 5}
+
+
+def run_metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip())
+    except OSError:
+        commit, dirty = None, None
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "python": sys.version.split()[0],
+        "cpus": len(os.sched_getaffinity(0)),
+    }
+
+
+def save(kind: str, config: dict, cases: dict, path=None) -> str:
+    """Writes one run's results and returns the file path."""
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w") as fh:
+        json.dump({"kind": kind, "meta": run_metadata(), "config": config, "cases": cases}, fh, indent=2)
+    print(f"Wrote {path}")
+    return path
+
+
+def load(path: str) -> dict:
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def compare(baseline: dict, candidate: dict, threshold: float):
+    """Returns rows of (case, metric, baseline, candidate, relative change, regressed)."""
+    rows = []
+    for case, metrics in candidate["cases"].items():
+        base_metrics = baseline["cases"].get(case, {})
+        for metric, value in metrics.items():
+            base = base_metrics.get(metric)
+            if metric in NOT_COMPARED or not isinstance(value, (int, float)) or not isinstance(base, (int, float)) or base == 0:
+                continue
+            change = (value - base) / abs(base)
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            regressed = worse > threshold and max(abs(base), abs(value)) >= IGNORED_BELOW.get(metric, 0)
+            rows.append((case, metric, base, value, change, regressed))
+    return rows
+
+
+def main(args):
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    if baseline["config"] != candidate["config"]:
+        print(f"Warning: runs used different configurations:\n  {baseline['config']}\n  {candidate['config']}")
+    rows = compare(baseline, candidate, args.threshold)
+    print(f"{'case':<32} {'metric':<16} {'baseline':>12} {'candidate':>12} {'change':>8}")
+    for case, metric, base, value, change, regressed in rows:
+        flag = "  REGRESSED" if regressed else ""
+        print(f"{case:<32} {metric:<16} {base:>12.4g} {value:>12.4g} {change:>+8.1%}{flag}")
+    regressions = [r for r in rows if r[5]]
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+    print("No regressions.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two TRACE benchmark result files.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression.")
+    args = parser.parse_args()
+    main(args)
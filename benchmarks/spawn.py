@@ -0,0 +1,32 @@
+# Runs one command and reports its wall time and resource usage as JSON.
+#
+# Linux carries a process's peak RSS across fork+exec, so a child started
+# straight from the benchmark runner (NumPy and pandas loaded) would report
+# the runner's memory. This module imports nothing heavy and is run as its
+# own interpreter, so the peak it reports is the command's own.
+#
+#   python -m benchmarks.spawn <usage.json> <command...>
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+def main(usage_path, command):
+    start = time.perf_counter()
+    proc = subprocess.Popen(command)
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    with open(usage_path, "w") as fh:
+        json.dump({
+            "returncode": os.waitstatus_to_exitcode(status),
+            "wall_s": wall,
+            "cpu_s": usage.ru_utime + usage.ru_stime,
+            # KiB on Linux
+            "max_rss_mb": usage.ru_maxrss / 1024,
+        }, fh)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2:])
@@ -16,7 +16,7 @@ import ModelPage from './components/ModelPage';
 import './App.css';
 
 // The Dashboard now uses a Grid layout
-const Dashboard = ({ token, jobs, fetchJobs, deleteJob, isLoading }) => (
+const Dashboard = ({ token, jobs, fetchJobs, deleteJob, cancelJob, isLoading }) => (
   <Container maxWidth="lg" sx={{ mt: 4, mb: 4 }}>
     <Grid container spacing={3}>
       {/* File Upload Component */}
@@ -25,7 +25,7 @@ const Dashboard = ({ token, jobs, fetchJobs, deleteJob, isLoading }) => (
       </Grid>
       {/* Job List Component */}
       <Grid item xs={12} md={7} lg={8}>
-        <JobList jobs={jobs} deleteJob={deleteJob} isLoading={isLoading} />
+        <JobList jobs={jobs} deleteJob={deleteJob} cancelJob={cancelJob} isLoading={isLoading} token={token} />
       </Grid>
     </Grid>
   </Container>
@@ -41,6 +41,21 @@ function App() {
   const fetchJobs = async () => { /* ... */ };
   const deleteJob = async (jobId) => { /* ... */ };
 
+  const cancelJob = async (jobId) => {
+    try {
+      const response = await fetch(`http://localhost:8000/analyses/${jobId}/cancel`, {
+        method: 'POST',
+        headers: { 'Authorization': `Bearer ${token}` },
+      });
+      if (!response.ok) throw new Error('Cancel failed.');
+      toast.success('Analysis cancelled.');
+      fetchJobs();
+    } catch (error) {
+      console.error('Error cancelling job:', error);
+      toast.error('Could not cancel the analysis.');
+    }
+  };
+
   useEffect(() => {
     if (token) {
       fetchJobs();
@@ -74,6 +89,7 @@ function App() {
                   jobs={jobs} 
                   fetchJobs={fetchJobs} 
                   deleteJob={deleteJob} 
+                  cancelJob={cancelJob}
                   isLoading={isLoading}
                 />
               )
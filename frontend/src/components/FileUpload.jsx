@@ -1,9 +1,25 @@
 import React, { useState } from 'react';
-import { Button, Box, Typography } from '@mui/material';
+import { Button, Box, Typography, LinearProgress } from '@mui/material';
 import toast from 'react-hot-toast'; // Import toast
 
+const API_URL = 'http://localhost:8000';
+// Parts in flight at once, and attempts per part before giving up
+const PARALLEL_PARTS = 4;
+const PART_ATTEMPTS = 5;
+
+// Resumable uploads in progress, keyed by file, so a reload picks up where it stopped
+const sessionKey = (file) => `trace-upload:${file.name}:${file.size}:${file.lastModified}`;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+async function contentDigest(blob) {
+  const hash = new Uint8Array(await crypto.subtle.digest('SHA-256', await blob.arrayBuffer()));
+  return `sha-256=:${btoa(String.fromCharCode(...hash))}:`;
+}
+
 function FileUpload({ token, onUploadSuccess }) {
   const [selectedFile, setSelectedFile] = useState(null);
+  const [progress, setProgress] = useState(null);
 
   const handleFileChange = (event) => {
     if (event.target.files && event.target.files.length > 0) {
@@ -11,41 +27,99 @@ function FileUpload({ token, onUploadSuccess }) {
     }
   };
 
+  const api = async (path, options = {}) => {
+    const response = await fetch(`${API_URL}${path}`, {
+      ...options,
+      headers: { 'Authorization': `Bearer ${token}`, ...options.headers },
+    });
+    if (!response.ok) {
+      const error = new Error(`${options.method || 'GET'} ${path} failed with ${response.status}`);
+      error.status = response.status;
+      throw error;
+    }
+    return response.json();
+  };
+
+  // Resumes this file's upload session if the server still has it, else starts one
+  const openSession = async (file) => {
+    const saved = localStorage.getItem(sessionKey(file));
+    if (saved) {
+      try {
+        return await api(`/uploads/${saved}`);
+      } catch (error) {
+        localStorage.removeItem(sessionKey(file));
+      }
+    }
+    const session = await api('/uploads/', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ filename: file.name, size: file.size, data_type: 'WGS' }),
+    });
+    localStorage.setItem(sessionKey(file), session.id);
+    return session;
+  };
+
+  const uploadPart = async (file, session, index) => {
+    const blob = file.slice(index * session.part_size, Math.min((index + 1) * session.part_size, file.size));
+    const digest = await contentDigest(blob);
+    for (let attempt = 1; ; attempt++) {
+      try {
+        await api(`/uploads/${session.id}/parts/${index}`, {
+          method: 'PUT',
+          headers: { 'Content-Digest': digest },
+          body: blob,
+        });
+        return blob.size;
+      } catch (error) {
+        if (attempt === PART_ATTEMPTS || (error.status && error.status !== 400 && error.status < 500)) throw error;
+        await sleep(1000 * 2 ** attempt);
+      }
+    }
+  };
+
   const handleSubmit = async (event) => {
     event.preventDefault();
     if (!selectedFile) {
       toast.error('Please select a file first!');
       return;
     }
-
-    const formData = new FormData();
-    formData.append('file', selectedFile);
+    const form = event.target;
 
     try {
-      const response = await fetch('http://localhost:8000/analyses/', {
-        method: 'POST',
-        headers: {
-          'Authorization': `Bearer ${token}`,
-        },
-        body: formData,
-      });
-
-      if (!response.ok) throw new Error('File upload failed.');
-      
+      const session = await openSession(selectedFile);
+      const received = new Set(session.received);
+      const pending = [...Array(session.part_count).keys()].filter((index) => !received.has(index));
+      let sent = session.received_bytes;
+      setProgress((100 * sent) / selectedFile.size);
+
+      // A few workers drain the queue of missing parts
+      const worker = async () => {
+        while (pending.length > 0) {
+          sent += await uploadPart(selectedFile, session, pending.shift());
+          setProgress((100 * sent) / selectedFile.size);
+        }
+      };
+      await Promise.all(Array.from({ length: PARALLEL_PARTS }, worker));
+
+      await api(`/uploads/${session.id}/complete`, { method: 'POST' });
+      localStorage.removeItem(sessionKey(selectedFile));
+
       toast.success('File uploaded! Analysis has started.'); // Success notification
-      
+
       setSelectedFile(null);
-      event.target.reset();
+      form.reset();
       onUploadSuccess();
     } catch (error) {
       console.error('Error uploading file:', error);
-      toast.error('An error occurred during file upload.'); // Error notification
+      toast.error('An error occurred during file upload. Upload it again to resume.'); // Error notification
+    } finally {
+      setProgress(null);
     }
   };
 
   return (
-    <Box 
-      component="form" 
+    <Box
+      component="form"
       onSubmit={handleSubmit}
       sx={{ p: 2, border: '1px solid #ddd', borderRadius: '8px', mt: 4 }}
     >
@@ -54,6 +128,7 @@ function FileUpload({ token, onUploadSuccess }) {
         <Button
           variant="contained"
           component="label"
+          disabled={progress !== null}
         >
           Choose File
           <input
@@ -63,12 +138,18 @@ function FileUpload({ token, onUploadSuccess }) {
           />
         </Button>
         {selectedFile && <Typography variant="body1">{selectedFile.name}</Typography>}
-        <Button type="submit" variant="contained" disabled={!selectedFile}>
+        <Button type="submit" variant="contained" disabled={!selectedFile || progress !== null}>
           Analyze
         </Button>
       </Box>
+      {progress !== null && (
+        <Box sx={{ mt: 2 }}>
+          <LinearProgress variant="determinate" value={progress} />
+          <Typography variant="body2" sx={{ mt: 1 }}>{progress.toFixed(1)}% uploaded</Typography>
+        </Box>
+      )}
     </Box>
   );
 }
 
-export default FileUpload;
\ No newline at end of file
+export default FileUpload;
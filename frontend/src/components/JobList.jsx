@@ -1,4 +1,4 @@
-import React from 'react';
+import React, { useEffect, useState } from 'react';
 import { 
   Box, 
   Button, 
@@ -10,12 +10,14 @@ import {
   TableHead, 
   TableRow, 
   Typography,
+  LinearProgress,
   Skeleton // Import Skeleton
 } from '@mui/material';
 // Import required icons
 import CheckCircleIcon from '@mui/icons-material/CheckCircle';
 import HourglassEmptyIcon from '@mui/icons-material/HourglassEmpty';
 import ErrorIcon from '@mui/icons-material/Error';
+import BlockIcon from '@mui/icons-material/Block';
 
 // A helper function to render the correct icon based on status
 const renderStatusIcon = (status) => {
@@ -23,15 +25,62 @@ const renderStatusIcon = (status) => {
     case 'complete':
       return <CheckCircleIcon color="success" />;
     case 'pending':
+    case 'running':
       return <HourglassEmptyIcon color="action" />;
     case 'failed':
       return <ErrorIcon color="error" />;
+    case 'cancelled':
+      return <BlockIcon color="disabled" />;
     default:
       return null;
   }
 };
 
-function JobList({ jobs, deleteJob, isLoading }) {
+const ACTIVE_STATUSES = ['pending', 'running'];
+
+// Subscribes to the Server-Sent Events stream of every active job.
+// EventSource cannot send the Authorization header, so the stream is read with fetch.
+const useJobProgress = (jobs, token) => {
+  const [progress, setProgress] = useState({});
+  const activeIds = (jobs || []).filter((job) => ACTIVE_STATUSES.includes(job.status)).map((job) => job.id);
+  const activeKey = activeIds.join(',');
+
+  useEffect(() => {
+    if (!token || activeIds.length === 0) return undefined;
+    const controller = new AbortController();
+
+    const follow = async (jobId) => {
+      const response = await fetch(`http://localhost:8000/analyses/${jobId}/events`, {
+        headers: { 'Authorization': `Bearer ${token}` },
+        signal: controller.signal,
+      });
+      if (!response.ok || !response.body) return;
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const messages = buffer.split('\n\n');
+        buffer = messages.pop();
+        for (const message of messages) {
+          if (!message.startsWith('data: ')) continue; // keep-alive comments
+          const event = JSON.parse(message.slice(6));
+          setProgress((prev) => ({ ...prev, [jobId]: { ...prev[jobId], ...event } }));
+        }
+      }
+    };
+
+    activeIds.forEach((jobId) => follow(jobId).catch(() => {}));
+    return () => controller.abort();
+  }, [activeKey, token]);
+
+  return progress;
+};
+
+function JobList({ jobs, deleteJob, cancelJob, isLoading, token }) {
+  const progress = useJobProgress(jobs, token);
 
   // Render Skeleton loading state
   if (isLoading) {
@@ -84,6 +133,12 @@ function JobList({ jobs, deleteJob, isLoading }) {
     }
   };
 
+  const handleCancelClick = (jobId) => {
+    if (window.confirm('Stop this analysis? Its partial results will be discarded.')) {
+      cancelJob(jobId);
+    }
+  };
+
   return (
     <Box sx={{ mt: 4 }}>
       <Typography variant="h6" gutterBottom>My Analyses</Typography>
@@ -99,16 +154,39 @@ function JobList({ jobs, deleteJob, isLoading }) {
             </TableRow>
           </TableHead>
           <TableBody>
-            {jobs.map((job) => (
+            {jobs.map((job) => {
+              const live = progress[job.id] || {};
+              const status = live.status || job.status;
+              return (
               <TableRow
                 key={job.id}
                 sx={{ '&:last-child td, &:last-child th': { border: 0 } }}
               >
-                <TableCell>{renderStatusIcon(job.status)}</TableCell>
+                <TableCell>{renderStatusIcon(status)}</TableCell>
                 <TableCell component="th" scope="row">{job.id}</TableCell>
-                <TableCell>{job.status}</TableCell>
+                <TableCell>
+                  {status}
+                  {ACTIVE_STATUSES.includes(status) && live.percent !== undefined && (
+                    <Box sx={{ mt: 1 }}>
+                      <LinearProgress variant="determinate" value={live.percent} />
+                      <Typography variant="caption" color="text.secondary">
+                        {live.done}/{live.total} steps{live.rule ? ` · ${live.rule}` : ''}
+                      </Typography>
+                    </Box>
+                  )}
+                </TableCell>
                 <TableCell>{new Date(job.created_at).toLocaleString()}</TableCell>
                 <TableCell>
+                  {ACTIVE_STATUSES.includes(status) && (
+                    <Button
+                      variant="outlined"
+                      size="small"
+                      sx={{ mr: 1 }}
+                      onClick={() => handleCancelClick(job.id)}
+                    >
+                      Cancel
+                    </Button>
+                  )}
                   <Button
                     variant="outlined"
                     color="error"
@@ -119,7 +197,8 @@ function JobList({ jobs, deleteJob, isLoading }) {
                   </Button>
                 </TableCell>
               </TableRow>
-            ))}
+              );
+            })}
           </TableBody>
         </Table>
       </TableContainer>
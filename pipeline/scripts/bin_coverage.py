@@ -0,0 +1,97 @@
+# Bins read/fragment starts from a BAM into fixed windows and writes an
+# ichorCNA-compatible fixedStep WIG (the same layout HMMcopy's readCounter emits).
+#
+# Each chromosome is counted in its own process through the BAM index, so the
+# file is read once overall and the work scales with the available threads.
+# The index (<bam>.bai) is built beforehand by the Snakefile's index_bam rule.
+import argparse
+import os
+import re
+from array import array
+from multiprocessing import Pool
+
+import numpy as np
+import pysam
+
+# SAM flags
+FLAG_PAIRED = 0x1
+FLAG_UNMAPPED = 0x4
+FLAG_READ2 = 0x80
+FLAG_SECONDARY = 0x100
+FLAG_QCFAIL = 0x200
+FLAG_DUPLICATE = 0x400
+FLAG_SUPPLEMENTARY = 0x800
+
+# Start positions buffered before being folded into the window counts
+FLUSH_EVERY = 1 << 20
+CANONICAL_CHROM = re.compile(r"^(chr)?([0-9]+|X|Y)$")
+
+
+def count_chromosome(task):
+    """Counts read (or, for paired data, fragment) starts per window on one chromosome."""
+    bam_path, chrom, length, window_size, min_mapq, keep_duplicates = task
+    n_windows = (length + window_size - 1) // window_size
+    counts = np.zeros(n_windows, dtype=np.int64)
+
+    exclude = FLAG_UNMAPPED | FLAG_SECONDARY | FLAG_QCFAIL | FLAG_SUPPLEMENTARY
+    if not keep_duplicates:
+        exclude |= FLAG_DUPLICATE
+
+    starts = array('q')
+    with pysam.AlignmentFile(bam_path, "rb") as bam:
+        for read in bam.fetch(chrom):
+            flag = read.flag
+            if flag & exclude or read.mapping_quality < min_mapq:
+                continue
+            # Count each fragment once: only read 1 of a pair contributes
+            if flag & FLAG_PAIRED and flag & FLAG_READ2:
+                continue
+            starts.append(read.reference_start)
+            if len(starts) >= FLUSH_EVERY:
+                counts += np.bincount(np.frombuffer(starts, dtype=np.int64) // window_size, minlength=n_windows)
+                starts = array('q')
+    if starts:
+        counts += np.bincount(np.frombuffer(starts, dtype=np.int64) // window_size, minlength=n_windows)
+    return chrom, counts
+
+
+def select_chromosomes(bam_path, requested):
+    """Returns (name, length) pairs to bin, in BAM header order."""
+    with pysam.AlignmentFile(bam_path, "rb") as bam:
+        contigs = list(zip(bam.references, bam.lengths))
+    if requested:
+        wanted = set(requested)
+        return [(c, n) for c, n in contigs if c in wanted]
+    return [(c, n) for c, n in contigs if CANONICAL_CHROM.match(c)]
+
+
+def main(args):
+    """Bins the BAM and writes the WIG."""
+    chromosomes = select_chromosomes(args.bam, args.chromosomes)
+    tasks = [(args.bam, c, n, args.window_size, args.min_mapq, args.keep_duplicates) for c, n in chromosomes]
+    print(f"Binning {len(tasks)} chromosomes of {args.bam} into {args.window_size} bp windows with {args.threads} processes...")
+
+    total = 0
+    tmp_output = f"{args.output}.tmp"
+    with Pool(processes=max(1, args.threads)) as pool, open(tmp_output, "w") as out:
+        # imap keeps header order while chromosomes are counted in parallel
+        for chrom, counts in pool.imap(count_chromosome, tasks):
+            out.write(f"fixedStep chrom={chrom} start=1 step={args.window_size} span={args.window_size}\n")
+            out.write("\n".join(map(str, counts.tolist())))
+            out.write("\n")
+            total += int(counts.sum())
+    os.replace(tmp_output, args.output)
+    print(f"Counted {total} starts; wrote {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel BAM window-coverage binning to WIG.")
+    parser.add_argument("--bam", required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--window_size", type=int, default=1000000)
+    parser.add_argument("--min_mapq", type=int, default=20)
+    parser.add_argument("--keep_duplicates", action="store_true", help="Count reads flagged as PCR/optical duplicates.")
+    parser.add_argument("--chromosomes", nargs="*", help="Chromosomes to bin (default: autosomes, X and Y).")
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+    main(args)
@@ -1,38 +1,186 @@
-# A placeholder script to simulate methylation deconvolution
+# Reference-based methylation deconvolution into tissue-of-origin proportions.
+#
+# The beta matrix is streamed in row chunks and aligned to the reference panel
+# through its CpG index. Each chunk only contributes to per-sample normal
+# equations (A'A, A'b), so peak memory depends on the chunk size and not on
+# the number of CpGs. Non-negative least squares is then solved for all
+# samples at once from those small tissue x tissue systems.
+#
+# With --asset_dir the panel comes from the shared reference-asset store
+# (see reference_assets.py): converted once, then memory-mapped, so
+# concurrent jobs share its pages instead of each parsing the TSV.
 import argparse
-import pandas as pd
-import numpy as np
 import os
 
+import numpy as np
+import pandas as pd
+
+import reference_assets
+
+
+def split_columns(columns, coverage_suffix):
+    """Separates beta columns from their optional per-sample coverage columns."""
+    coverage = {c[:-len(coverage_suffix)]: c for c in columns if c.endswith(coverage_suffix)}
+    betas = [c for c in columns if not c.endswith(coverage_suffix)]
+    return betas, coverage
+
+
+def accumulate(beta_path, panel, chunk_rows, coverage_suffix, control_prefix):
+    """
+    Single pass over the beta matrix collecting everything the solver and QC need.
+
+    Returns per-sample arrays: the Gram matrices A'A (S x T x T), A'b (S x T),
+    b'b, matched CpG counts, QC sums over all CpGs, and methylation sums over
+    the unmethylated spike-in control rows (IDs starting with `control_prefix`).
+    """
+    header = pd.read_csv(beta_path, sep='\t', index_col=0, nrows=0).columns.tolist()
+    beta_cols, coverage_cols = split_columns(header, coverage_suffix)
+    n_samples, n_tissues = len(beta_cols), len(panel.tissues)
+
+    stats = {
+        'beta_cols': beta_cols,
+        'coverage_cols': coverage_cols,
+        'gram': np.zeros((n_samples, n_tissues, n_tissues)),
+        'atb': np.zeros((n_samples, n_tissues)),
+        'btb': np.zeros(n_samples),
+        'n_matched': np.zeros(n_samples),
+        'beta_sum': np.zeros(n_samples),
+        'n_cpgs': np.zeros(n_samples),
+        'coverage_sum': np.zeros(n_samples),
+        'n_covered': np.zeros(n_samples),
+        'control_sum': np.zeros(n_samples),
+        'n_control': np.zeros(n_samples),
+    }
+
+    reader = pd.read_csv(beta_path, sep='\t', index_col=0, chunksize=chunk_rows, dtype={c: np.float32 for c in header})
+    for chunk in reader:
+        # Spike-in control rows (e.g. unmethylated lambda DNA) only measure bisulfite conversion
+        if control_prefix:
+            control = chunk.index.astype(str).str.startswith(control_prefix)
+            if control.any():
+                control_betas = chunk.loc[control, beta_cols].to_numpy(dtype=np.float64)
+                stats['control_sum'] += np.nansum(control_betas, axis=0)
+                stats['n_control'] += (~np.isnan(control_betas)).sum(axis=0)
+                chunk = chunk[~control]
+
+        betas = chunk[beta_cols].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(betas)
+
+        # QC over every CpG in the sample, matched to the panel or not
+        stats['beta_sum'] += np.where(valid, betas, 0.0).sum(axis=0)
+        stats['n_cpgs'] += valid.sum(axis=0)
+        for i, col in enumerate(beta_cols):
+            if col in coverage_cols:
+                cov = chunk[coverage_cols[col]].to_numpy(dtype=np.float64)
+                cov_valid = ~np.isnan(cov)
+                stats['coverage_sum'][i] += cov[cov_valid].sum()
+                stats['n_covered'][i] += cov_valid.sum()
+
+        # Align to the panel via its hash index instead of a join;
+        # only the matched rows are read from the (memory-mapped) panel
+        positions = panel.positions(chunk.index.astype(str))
+        matched = positions >= 0
+        if not matched.any():
+            continue
+        a = np.asarray(panel.values[positions[matched]], dtype=np.float64)
+        # A CpG missing from either the sample or any panel tissue is left out of that sample's fit
+        panel_valid = ~np.isnan(a).any(axis=1)
+        a = np.where(panel_valid[:, None], a, 0.0)
+        usable = valid[matched] & panel_valid[:, None]
+        mask = usable.astype(np.float64)
+        b = np.where(usable, betas[matched], 0.0)
+
+        # Per-sample normal equations; missing CpGs drop out through the mask
+        stats['gram'] += np.einsum('rs,rj,rk->sjk', mask, a, a, optimize=True)
+        stats['atb'] += b.T @ a
+        stats['btb'] += (b * b).sum(axis=0)
+        stats['n_matched'] += mask.sum(axis=0)
+
+    return stats
+
+
+def batched_nnls(gram, atb, max_iter=5000, tol=1e-9):
+    """
+    Solves min ||A x - b||^2 subject to x >= 0 for many samples at once.
+
+    Works from each sample's normal equations (gram = A'A, atb = A'b) with
+    accelerated projected gradient descent, vectorized across samples.
+    """
+    n_samples, n_tissues = atb.shape
+    # Step size 1/L, where L (largest eigenvalue of A'A) bounds the gradient's Lipschitz constant
+    lipschitz = np.linalg.eigvalsh(gram)[:, -1]
+    step = np.divide(1.0, lipschitz, out=np.zeros_like(lipschitz), where=lipschitz > 0)[:, None]
+
+    x = np.zeros((n_samples, n_tissues))
+    y = x.copy()
+    t = 1.0
+    for _ in range(max_iter):
+        grad = np.einsum('sjk,sk->sj', gram, y) - atb
+        x_next = np.maximum(y - step * grad, 0.0)
+        t_next = (1.0 + np.sqrt(1.0 + 4.0 * t * t)) / 2.0
+        y = x_next + ((t - 1.0) / t_next) * (x_next - x)
+        converged = np.max(np.abs(x_next - x)) < tol
+        x, t = x_next, t_next
+        if converged:
+            break
+    return x
+
+
 def main(args):
-    """Simulates tissue-of-origin deconvolution and QC."""
+    """Deconvolves every sample in the beta matrix against the reference panel."""
     print(f"Running deconvolution on {args.beta_matrix}...")
-    
-    # 1. Simulate Tissue Proportions
-    tissues = ["Lung", "Breast", "Colon", "Liver", "Blood"] # Example tissues
-    props = np.random.dirichlet(np.ones(len(tissues)), size=1).flatten()
-    df_props = pd.DataFrame([props], columns=tissues)
-    df_props['sample_id'] = os.path.basename(args.beta_matrix).split('.')[0]
-    df_props = df_props[['sample_id'] + tissues]
+    panel = reference_assets.methylation_panel(args.ref_panel, args.asset_dir)
+    tissues = panel.tissues
+    print(f"Loaded reference panel: {len(panel)} CpGs x {len(tissues)} tissues")
+
+    stats = accumulate(args.beta_matrix, panel, args.chunk_rows, args.coverage_suffix, args.control_prefix)
+    beta_cols = stats['beta_cols']
+    if len(beta_cols) == 1 and args.sample_id:
+        sample_ids = [args.sample_id]
+    elif len(beta_cols) == 1:
+        sample_ids = [os.path.basename(args.beta_matrix).split('.')[0]]
+    else:
+        sample_ids = beta_cols
+
+    # 1. Tissue proportions
+    coef = batched_nnls(stats['gram'], stats['atb'])
+    totals = coef.sum(axis=1, keepdims=True)
+    props = np.divide(coef, totals, out=np.zeros_like(coef), where=totals > 0)
+    df_props = pd.DataFrame(props, columns=tissues)
+    df_props.insert(0, 'sample_id', sample_ids)
     df_props.to_csv(args.out_props, sep='\t', index=False)
-    print(f"Wrote dummy tissue proportions to {args.out_props}")
-
-    # 2. Simulate QC Metrics
-    qc_data = {
-        'sample_id': [os.path.basename(args.beta_matrix).split('.')[0]],
-        'global_methylation': [np.random.uniform(0.4, 0.7)],
-        'bisulfite_conversion_rate': [np.random.uniform(0.985, 0.999)],
-        'avg_cpg_coverage': [np.random.uniform(15, 50)]
-    }
-    df_qc = pd.DataFrame(qc_data)
+    print(f"Wrote tissue proportions for {len(sample_ids)} samples to {args.out_props}")
+
+    # 2. QC metrics, from the same pass over the data
+    # Residual sum of squares from the normal equations: b'b - 2x'A'b + x'A'Ax
+    rss = stats['btb'] - 2 * (coef * stats['atb']).sum(axis=1) + np.einsum('sj,sjk,sk->s', coef, stats['gram'], coef)
+    n_matched = stats['n_matched']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        df_qc = pd.DataFrame({
+            'sample_id': sample_ids,
+            'global_methylation': stats['beta_sum'] / stats['n_cpgs'],
+            # Conversion rate: 1 − mean beta of the unmethylated spike-in controls; NaN without control rows
+            'bisulfite_conversion_rate': np.where(stats['n_control'] > 0, 1.0 - stats['control_sum'] / stats['n_control'], np.nan),
+            'avg_cpg_coverage': np.where(stats['n_covered'] > 0, stats['coverage_sum'] / stats['n_covered'], np.nan),
+            'n_cpgs': stats['n_cpgs'].astype(np.int64),
+            'panel_cpgs_matched': n_matched.astype(np.int64),
+            'panel_coverage_fraction': n_matched / len(panel),
+            'deconvolution_rmse': np.sqrt(np.maximum(rss, 0) / n_matched),
+        })
     df_qc.to_csv(args.out_qc, sep='\t', index=False)
-    print(f"Wrote dummy QC metrics to {args.out_qc}")
+    print(f"Wrote QC metrics to {args.out_qc}")
+
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Methylation Deconvolution Simulator.")
-    parser.add_argument("--beta_matrix", required=True)
-    parser.add_argument("--ref_panel", required=True)
+    parser = argparse.ArgumentParser(description="Reference-based methylation deconvolution (NNLS).")
+    parser.add_argument("--beta_matrix", required=True, help="TSV of CpG IDs x sample beta values.")
+    parser.add_argument("--ref_panel", required=True, help="TSV of CpG IDs x tissue reference beta values.")
     parser.add_argument("--out_props", required=True)
     parser.add_argument("--out_qc", required=True)
+    parser.add_argument("--sample_id", help="Sample ID to report when the beta matrix holds a single sample.")
+    parser.add_argument("--chunk_rows", type=int, default=500000, help="CpG rows read per chunk.")
+    parser.add_argument("--coverage_suffix", default=".cov", help="Suffix marking per-sample coverage columns.")
+    parser.add_argument("--control_prefix", default="lambda", help="ID prefix of unmethylated spike-in control rows, used for the bisulfite conversion rate.")
+    parser.add_argument("--asset_dir", help="Shared reference-asset store; the panel is parsed in memory without it.")
     args = parser.parse_args()
-    main(args)
\ No newline at end of file
+    main(args)
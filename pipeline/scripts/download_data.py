@@ -1,21 +1,311 @@
-# A simplified script to simulate data acquisition
+# Raw-data acquisition for one sample of the sample sheet.
+#
+# Local sources (uploads, file:// URLs) are hard-linked into place. Remote
+# sources are fetched once per accession into a content cache: large files
+# are split into ranged chunks downloaded in parallel over pooled keep-alive
+# connections (capped per host), progress is recorded in a sidecar so an
+# interrupted download resumes where it stopped, and the file is checksummed
+# before it is published to the cache and linked to the sample's output.
 import argparse
-import pandas as pd
+import hashlib
+import http.client
+import json
 import os
+import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+
+from sample_sheet import load as load_sample_sheet
+
+USER_AGENT = "TRACE-downloader/1.0"
+MAX_REDIRECTS = 5
+CHUNK_ATTEMPTS = 4
+READ_SIZE = 1 << 20
+CHECKSUM = re.compile(r"^(md5|sha1|sha256):([0-9a-fA-F]+)$")
+
+
+class DownloadError(Exception):
+    pass
+
+
+# --- Connection Pooling ---
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections per host, with at most `per_host` in use at once."""
+
+    def __init__(self, per_host: int, timeout: float = 60):
+        self.per_host = per_host
+        self.timeout = timeout
+        self._idle = {}
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def _host_state(self, key):
+        with self._lock:
+            if key not in self._limits:
+                self._limits[key] = threading.BoundedSemaphore(self.per_host)
+                self._idle[key] = []
+            return self._limits[key], self._idle[key]
+
+    def request(self, method: str, url: str, headers=None):
+        """
+        Sends one request and returns (connection, response). The response must
+        be read fully and handed back with `release`, or discarded with `discard`.
+        """
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        limit, idle = self._host_state(key)
+        limit.acquire()
+        try:
+            with self._lock:
+                conn = idle.pop() if idle else None
+            if conn is None:
+                conn_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+                conn = conn_class(parts.netloc, timeout=self.timeout)
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+            try:
+                conn.request(method, path, headers={"User-Agent": USER_AGENT, **(headers or {})})
+                response = conn.getresponse()
+            except (http.client.HTTPException, OSError):
+                # A pooled connection the server already closed; retry once on a fresh one
+                conn.close()
+                conn.connect()
+                conn.request(method, path, headers={"User-Agent": USER_AGENT, **(headers or {})})
+                response = conn.getresponse()
+            return (key, conn), response
+        except BaseException:
+            limit.release()
+            raise
+
+    def release(self, handle):
+        key, conn = handle
+        limit, idle = self._host_state(key)
+        with self._lock:
+            idle.append(conn)
+        limit.release()
+
+    def discard(self, handle):
+        key, conn = handle
+        conn.close()
+        self._host_state(key)[0].release()
+
+    def close(self):
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle.clear()
+
+
+# --- Remote Downloads ---
+def probe(pool: ConnectionPool, url: str):
+    """Follows redirects and returns (final_url, size or None, accepts_ranges, validator)."""
+    for _ in range(MAX_REDIRECTS + 1):
+        handle, response = pool.request("HEAD", url)
+        response.read()
+        pool.release(handle)
+        if response.status in (301, 302, 303, 307, 308):
+            url = urljoin(url, response.getheader("Location"))
+            continue
+        if response.status >= 400:
+            raise DownloadError(f"HEAD {url} returned HTTP {response.status}")
+        length = response.getheader("Content-Length")
+        accepts_ranges = response.getheader("Accept-Ranges", "").lower() == "bytes"
+        validator = response.getheader("ETag") or response.getheader("Last-Modified")
+        return url, int(length) if length is not None else None, accepts_ranges, validator
+    raise DownloadError(f"Too many redirects for {url}")
+
+
+class ResumeState:
+    """Sidecar recording which chunks of a partial download are complete."""
+
+    def __init__(self, path: str, url: str, size: int, validator, chunk_size: int):
+        self.path = path
+        self.identity = {"url": url, "size": size, "validator": validator, "chunk_size": chunk_size}
+        self.done = set()
+        self._lock = threading.Lock()
+        try:
+            with open(path) as fh:
+                saved = json.load(fh)
+            # Only resume a partial file of the very same remote object and chunking
+            if saved.get("identity") == self.identity:
+                self.done = set(saved["done"])
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            pass
+
+    def mark(self, index: int):
+        with self._lock:
+            self.done.add(index)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as fh:
+                json.dump({"identity": self.identity, "done": sorted(self.done)}, fh)
+            os.replace(tmp_path, self.path)
+
+
+def fetch_range(pool: ConnectionPool, url: str, part_path: str, start: int, end: int):
+    """Downloads bytes [start, end] into the partial file at the same offset."""
+    for attempt in range(1, CHUNK_ATTEMPTS + 1):
+        handle = None
+        try:
+            handle, response = pool.request("GET", url, headers={"Range": f"bytes={start}-{end}"})
+            if response.status != 206:
+                raise DownloadError(f"Range request for {url} returned HTTP {response.status}")
+            fd = os.open(part_path, os.O_WRONLY)
+            try:
+                offset = start
+                while True:
+                    data = response.read(READ_SIZE)
+                    if not data:
+                        break
+                    os.pwrite(fd, data, offset)
+                    offset += len(data)
+            finally:
+                os.close(fd)
+            if offset != end + 1:
+                raise DownloadError(f"Short read for bytes {start}-{end} of {url}")
+            pool.release(handle)
+            return
+        except (DownloadError, http.client.HTTPException, OSError) as e:
+            if handle is not None:
+                pool.discard(handle)
+            if attempt == CHUNK_ATTEMPTS:
+                raise
+            delay = 2 ** attempt
+            print(f"Chunk {start}-{end} failed ({e}); retrying in {delay}s")
+            time.sleep(delay)
+
+
+def fetch_stream(pool: ConnectionPool, url: str, part_path: str):
+    """Single streaming GET for servers without range support."""
+    handle, response = pool.request("GET", url)
+    if response.status != 200:
+        pool.discard(handle)
+        raise DownloadError(f"GET {url} returned HTTP {response.status}")
+    with open(part_path, "wb") as out:
+        while True:
+            data = response.read(READ_SIZE)
+            if not data:
+                break
+            out.write(data)
+    pool.release(handle)
+
+
+def download(url: str, destination: str, connections: int, per_host: int, chunk_size: int):
+    """Downloads `url` to `destination`, resuming a previous partial download if possible."""
+    part_path = f"{destination}.part"
+    pool = ConnectionPool(per_host)
+    try:
+        url, size, accepts_ranges, validator = probe(pool, url)
+        if size is None or not accepts_ranges:
+            print(f"{url} does not support ranged downloads; fetching in one stream")
+            fetch_stream(pool, url, part_path)
+        else:
+            state = ResumeState(f"{part_path}.json", url, size, validator, chunk_size)
+            if not state.done or not os.path.exists(part_path):
+                state.done = set()
+                with open(part_path, "wb") as fh:
+                    fh.truncate(size)
+            chunks = [(i, start, min(start + chunk_size, size) - 1) for i, start in enumerate(range(0, size, chunk_size))]
+            pending = [c for c in chunks if c[0] not in state.done]
+            print(f"Fetching {size} bytes from {url} in {len(chunks)} chunks ({len(chunks) - len(pending)} already done)")
+
+            def run(chunk):
+                index, start, end = chunk
+                fetch_range(pool, url, part_path, start, end)
+                state.mark(index)
+
+            with ThreadPoolExecutor(max_workers=connections) as executor:
+                list(executor.map(run, pending))
+            os.remove(state.path)
+        os.replace(part_path, destination)
+    finally:
+        pool.close()
+
+
+# --- Cache and Verification ---
+def file_digest(path: str, algorithm: str = "sha256") -> str:
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def verify(path: str, expected):
+    """Checks an "algorithm:hex" checksum (md5, sha1 or sha256) if one was given."""
+    if not expected:
+        return
+    match = CHECKSUM.match(expected.strip())
+    if not match:
+        raise DownloadError(f"Unsupported checksum format: {expected!r}")
+    algorithm, value = match.group(1), match.group(2).lower()
+    actual = file_digest(path, algorithm)
+    if actual != value:
+        raise DownloadError(f"{algorithm} mismatch for {path}: expected {value}, got {actual}")
+
+
+def link(source: str, destination: str):
+    """Hard-links `source` to `destination` (symlinks across filesystems); never copies."""
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        os.symlink(os.path.abspath(source), destination)
+
+
+def cache_key(accession, url: str) -> str:
+    if isinstance(accession, str) and accession.strip():
+        return re.sub(r"[^A-Za-z0-9._-]", "_", accession.strip())
+    return hashlib.sha256(url.encode()).hexdigest()[:32]
+
+
+def fetch_cached(url: str, accession, cache_dir: str, checksum, opts) -> str:
+    """Returns the cached copy of an accession, downloading and verifying it first if needed."""
+    key = cache_key(accession, url)
+    entry_dir = os.path.join(cache_dir, key)
+    os.makedirs(entry_dir, exist_ok=True)
+    cached_path = os.path.join(entry_dir, os.path.basename(urlsplit(url).path) or "data")
+    meta_path = os.path.join(entry_dir, "entry.json")
+
+    try:
+        with open(meta_path) as fh:
+            meta = json.load(fh)
+        if meta["url"] == url and os.path.getsize(cached_path) == meta["size"] and (not checksum or checksum in meta["checksums"]):
+            print(f"Cache hit for {key}: {cached_path}")
+            # The entry's mtime is its last use; the storage sweeper evicts least recently used entries
+            os.utime(meta_path)
+            return cached_path
+    except (FileNotFoundError, json.JSONDecodeError, KeyError, OSError):
+        pass
+
+    download(url, cached_path, opts.connections, opts.per_host, opts.chunk_size_mb * 1024 * 1024)
+    try:
+        verify(cached_path, checksum)
+    except DownloadError:
+        os.remove(cached_path)
+        raise
+    checksums = [f"sha256:{file_digest(cached_path)}"] + ([checksum.strip()] if checksum else [])
+    meta = {"url": url, "accession": key, "size": os.path.getsize(cached_path), "checksums": checksums, "fetched_at": time.time()}
+    with open(f"{meta_path}.tmp", "w") as fh:
+        json.dump(meta, fh)
+    os.replace(f"{meta_path}.tmp", meta_path)
+    return cached_path
+
 
 def main(args):
-    """Downloads data for a specific sample."""
-    sample_sheet = pd.read_csv(args.sample_sheet, sep='\t')
-    sample_info = sample_sheet[sample_sheet.sample_id == args.sample_id].iloc[0]
-    
+    """Fetches the raw data for one sample."""
+    sample_info = load_sample_sheet(args.sample_sheet).row(args.sample_id)
+
     source = sample_info['source_url']
     data_type = sample_info['data_type']
-    accession = sample_info['accession_id']
-    
-    print(f"Fetching {data_type} data for {args.sample_id} ({accession}) from {source}...")
-    
-    # Simulate download and create a dummy file
+    accession = sample_info.get('accession_id', '')
+    # Optional "md5:..." / "sha256:..." column
+    checksum = sample_info.get('checksum', '')
+
     os.makedirs(args.output_dir, exist_ok=True)
     if data_type == 'WGS':
         outfile = os.path.join(args.output_dir, f"{args.sample_id}.bam")
@@ -23,17 +313,30 @@ def main(args):
         outfile = os.path.join(args.output_dir, f"{args.sample_id}.betas.tsv")
     else:
         raise ValueError(f"Unknown data_type: {data_type}")
-        
-    with open(outfile, 'w') as f:
-        f.write(f"Dummy data for {args.sample_id}\n")
-        
-    time.sleep(2) # Simulate download time
-    print(f"Successfully created dummy file: {outfile}")
+    if not source:
+        raise DownloadError(f"No source_url for sample {args.sample_id} ({accession})")
+
+    print(f"Fetching {data_type} data for {args.sample_id} ({accession}) from {source}...")
+    scheme = urlsplit(source).scheme
+    if scheme in ("http", "https"):
+        link(fetch_cached(source, accession, args.cache_dir, checksum, args), outfile)
+    elif scheme in ("", "file"):
+        local_path = urlsplit(source).path if scheme == "file" else source
+        verify(local_path, checksum)
+        link(local_path, outfile)
+    else:
+        raise DownloadError(f"Unsupported source URL scheme: {source}")
+    print(f"Successfully fetched {outfile}")
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Data Downloader for TRACE.")
     parser.add_argument("--sample_sheet", required=True)
     parser.add_argument("--sample_id", required=True)
     parser.add_argument("--output_dir", required=True)
+    parser.add_argument("--cache_dir", default="data/cache", help="Content cache shared by all samples, keyed by accession.")
+    parser.add_argument("--connections", type=int, default=8, help="Chunks downloaded in parallel.")
+    parser.add_argument("--per_host", type=int, default=4, help="Maximum concurrent connections to one host.")
+    parser.add_argument("--chunk_size_mb", type=int, default=64)
     args = parser.parse_args()
-    main(args)
\ No newline at end of file
+    main(args)
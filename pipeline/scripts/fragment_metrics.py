@@ -0,0 +1,238 @@
+# Fragmentomics feature extraction from a paired-end cfDNA BAM.
+#
+# Each chromosome is streamed in its own process. Fragments are never held in
+# memory as a whole: positions, sizes and end motifs are buffered in small
+# typed arrays and folded into NumPy histograms (bincount) as they fill up,
+# while the fragments themselves go straight to a gzipped per-chromosome part
+# file that is concatenated at the end. The BAM index is built beforehand by
+# the Snakefile's index_bam rule.
+import argparse
+import gzip
+import os
+import re
+import shutil
+from array import array
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+import pysam
+
+# SAM flags
+FLAG_PROPER_PAIR = 0x2
+FLAG_UNMAPPED = 0x4
+FLAG_REVERSE = 0x10
+FLAG_SECONDARY = 0x100
+FLAG_QCFAIL = 0x200
+FLAG_DUPLICATE = 0x400
+FLAG_SUPPLEMENTARY = 0x800
+EXCLUDE = FLAG_UNMAPPED | FLAG_SECONDARY | FLAG_QCFAIL | FLAG_SUPPLEMENTARY
+
+FLUSH_EVERY = 1 << 20
+MOTIF_LENGTH = 4
+N_MOTIFS = 4 ** MOTIF_LENGTH
+CANONICAL_CHROM = re.compile(r"^(chr)?([0-9]+|X|Y)$")
+
+# 2-bit base codes for motif encoding; anything else (N) marks the motif invalid
+_BASE_CODE = np.full(256, 255, dtype=np.uint8)
+for _i, _b in enumerate(b"ACGT"):
+    _BASE_CODE[_b] = _i
+_COMPLEMENT = bytes.maketrans(b"ACGTN", b"TGCAN")
+
+
+def encode_motifs(motifs: bytearray):
+    """Encodes concatenated 4-mers as integers in [0, 256); invalid motifs are dropped."""
+    codes = _BASE_CODE[np.frombuffer(bytes(motifs), dtype=np.uint8)].reshape(-1, MOTIF_LENGTH)
+    valid = (codes != 255).all(axis=1)
+    weights = 4 ** np.arange(MOTIF_LENGTH - 1, -1, -1)
+    return codes[valid].astype(np.int64) @ weights
+
+
+def decode_motif(code: int) -> str:
+    return "".join("ACGT"[(code >> (2 * (MOTIF_LENGTH - 1 - i))) & 3] for i in range(MOTIF_LENGTH))
+
+
+class ChromosomeAccumulator:
+    """Buffers per-fragment values and folds them into histograms."""
+
+    def __init__(self, length, max_size, short_threshold, window_size):
+        self.short_threshold = short_threshold
+        self.window_size = window_size
+        self.n_windows = (length + window_size - 1) // window_size
+        self.size_hist = np.zeros(max_size + 1, dtype=np.int64)
+        self.short_windows = np.zeros(self.n_windows, dtype=np.int64)
+        self.long_windows = np.zeros(self.n_windows, dtype=np.int64)
+        self.motifs = np.zeros(N_MOTIFS, dtype=np.int64)
+        self._reset()
+
+    def _reset(self):
+        self.midpoints = array('q')
+        self.sizes = array('q')
+        self.motif_bytes = bytearray()
+
+    def flush(self):
+        if self.sizes:
+            sizes = np.frombuffer(self.sizes, dtype=np.int64)
+            windows = np.minimum(np.frombuffer(self.midpoints, dtype=np.int64) // self.window_size, self.n_windows - 1)
+            short = sizes <= self.short_threshold
+            self.size_hist += np.bincount(sizes, minlength=len(self.size_hist))
+            self.short_windows += np.bincount(windows[short], minlength=self.n_windows)
+            self.long_windows += np.bincount(windows[~short], minlength=self.n_windows)
+        if self.motif_bytes:
+            self.motifs += np.bincount(encode_motifs(self.motif_bytes), minlength=N_MOTIFS)
+        self._reset()
+
+
+def process_chromosome(task):
+    """Streams one chromosome, writing its fragments to a gzip part file."""
+    bam_path, chrom, length, part_path, opts = task
+    acc = ChromosomeAccumulator(length, opts['max_size'], opts['short_threshold'], opts['window_size'])
+    exclude = EXCLUDE if opts['keep_duplicates'] else EXCLUDE | FLAG_DUPLICATE
+
+    with pysam.AlignmentFile(bam_path, "rb") as bam, gzip.open(part_path, "wt", compresslevel=1) as out:
+        lines = []
+        for read in bam.fetch(chrom):
+            flag = read.flag
+            if flag & exclude or not flag & FLAG_PROPER_PAIR or read.mapping_quality < opts['min_mapq']:
+                continue
+            size = abs(read.template_length)
+            if size < opts['min_size'] or size > opts['max_size']:
+                continue
+
+            # Both mates contribute their 5' end motif
+            seq = read.query_sequence
+            if seq is not None and len(seq) >= MOTIF_LENGTH:
+                if flag & FLAG_REVERSE:
+                    acc.motif_bytes += seq[-MOTIF_LENGTH:].encode().translate(_COMPLEMENT)[::-1]
+                else:
+                    acc.motif_bytes += seq[:MOTIF_LENGTH].encode()
+
+            # The leftmost mate (positive TLEN) represents the fragment
+            if read.template_length <= 0:
+                continue
+            start = read.reference_start
+            acc.sizes.append(size)
+            acc.midpoints.append(start + size // 2)
+            lines.append(f"{chrom}\t{start}\t{start + size}\t{read.mapping_quality}\t{'-' if flag & FLAG_REVERSE else '+'}\n")
+
+            if len(acc.sizes) >= FLUSH_EVERY:
+                out.write("".join(lines))
+                lines = []
+                acc.flush()
+        out.write("".join(lines))
+        acc.flush()
+
+    return chrom, acc.size_hist, acc.short_windows, acc.long_windows, acc.motifs
+
+
+def summarize(sample_id, size_hist, short_windows, long_windows, motifs, short_threshold):
+    """One-row summary of the sample's fragment size distribution and end motifs."""
+    sizes = np.arange(len(size_hist))
+    n = size_hist.sum()
+    summary = {'sample_id': sample_id, 'n_fragments': int(n)}
+    if n == 0:
+        return summary
+
+    mean = (sizes * size_hist).sum() / n
+    cumulative = np.cumsum(size_hist)
+    n_short = size_hist[:short_threshold + 1].sum()
+    n_long = n - n_short
+    with np.errstate(divide='ignore', invalid='ignore'):
+        window_ratios = short_windows / long_windows
+    window_ratios = window_ratios[np.isfinite(window_ratios)]
+    motif_freq = motifs / motifs.sum() if motifs.sum() else motifs.astype(float)
+    nonzero = motif_freq[motif_freq > 0]
+
+    summary.update({
+        'mean_size': float(mean),
+        'median_size': int(np.searchsorted(cumulative, n / 2)),
+        'mode_size': int(size_hist.argmax()),
+        'sd_size': float(np.sqrt(((sizes - mean) ** 2 * size_hist).sum() / n)),
+        'short_fraction': float(n_short / n),
+        'short_long_ratio': float(n_short / n_long) if n_long else np.nan,
+        'window_ratio_mean': float(window_ratios.mean()) if len(window_ratios) else np.nan,
+        'window_ratio_sd': float(window_ratios.std()) if len(window_ratios) else np.nan,
+        # Normalized Shannon entropy of the 256 end motifs
+        'motif_diversity_score': float(-(nonzero * np.log(nonzero)).sum() / np.log(N_MOTIFS)),
+    })
+    return summary
+
+
+def plot_size_distribution(size_hist, short_threshold, path):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(8, 4))
+    ax.plot(np.arange(len(size_hist)), size_hist, color="steelblue")
+    ax.axvline(short_threshold, color="grey", linestyle="--", label=f"short threshold ({short_threshold} bp)")
+    ax.set_xlabel("Fragment size (bp)")
+    ax.set_ylabel("Fragments")
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(path, dpi=100)
+    plt.close(fig)
+
+
+def main(args):
+    """Extracts fragment metrics for one sample."""
+    with pysam.AlignmentFile(args.bam, "rb") as bam:
+        chromosomes = [(c, n) for c, n in zip(bam.references, bam.lengths) if CANONICAL_CHROM.match(c)]
+
+    opts = {
+        'min_size': args.min_fragment_size,
+        'max_size': args.max_fragment_size,
+        'short_threshold': args.short_fragment_threshold,
+        'window_size': args.window_size,
+        'min_mapq': args.min_mapq,
+        'keep_duplicates': args.keep_duplicates,
+    }
+    tasks = [(args.bam, c, n, f"{args.fragments}.{c}.part.gz", opts) for c, n in chromosomes]
+    print(f"Extracting fragments from {len(tasks)} chromosomes of {args.bam} with {args.threads} processes...")
+
+    size_hist = np.zeros(args.max_fragment_size + 1, dtype=np.int64)
+    motifs = np.zeros(N_MOTIFS, dtype=np.int64)
+    window_rows = []
+    with Pool(processes=max(1, args.threads)) as pool, open(args.fragments, "wb") as fragments_out:
+        for chrom, hist, short, long_, chrom_motifs in pool.imap(process_chromosome, tasks):
+            size_hist += hist
+            motifs += chrom_motifs
+            starts = np.arange(len(short)) * args.window_size
+            window_rows.append(pd.DataFrame({'chrom': chrom, 'start': starts, 'end': starts + args.window_size, 'short': short, 'long': long_}))
+            # Concatenated gzip members form a valid gzip stream
+            part_path = f"{args.fragments}.{chrom}.part.gz"
+            with open(part_path, "rb") as part:
+                shutil.copyfileobj(part, fragments_out)
+            os.remove(part_path)
+
+    windows = pd.concat(window_rows, ignore_index=True) if window_rows else pd.DataFrame(columns=['chrom', 'start', 'end', 'short', 'long'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        windows['short_long_ratio'] = windows['short'] / windows['long']
+    windows.to_csv(args.windows, sep='\t', index=False)
+
+    pd.DataFrame({'motif': [decode_motif(i) for i in range(N_MOTIFS)], 'count': motifs}).to_csv(args.motifs, sep='\t', index=False)
+
+    summary = summarize(args.sample_id, size_hist, windows['short'].to_numpy(), windows['long'].to_numpy(), motifs, args.short_fragment_threshold)
+    pd.DataFrame([summary]).to_csv(args.summary, sep='\t', index=False)
+    plot_size_distribution(size_hist, args.short_fragment_threshold, args.size_plot)
+    print(f"Processed {summary['n_fragments']} fragments; wrote {args.summary}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming fragment-length and end-motif metrics.")
+    parser.add_argument("--bam", required=True)
+    parser.add_argument("--sample_id", required=True)
+    parser.add_argument("--fragments", required=True, help="Output fragments file (.tsv.gz).")
+    parser.add_argument("--summary", required=True, help="Output one-row summary TSV.")
+    parser.add_argument("--windows", required=True, help="Output per-window short/long counts TSV.")
+    parser.add_argument("--motifs", required=True, help="Output end-motif counts TSV.")
+    parser.add_argument("--size_plot", required=True)
+    parser.add_argument("--min_fragment_size", type=int, default=30)
+    parser.add_argument("--max_fragment_size", type=int, default=700)
+    parser.add_argument("--short_fragment_threshold", type=int, default=150)
+    parser.add_argument("--window_size", type=int, default=5000000)
+    parser.add_argument("--min_mapq", type=int, default=20)
+    parser.add_argument("--keep_duplicates", action="store_true", help="Keep fragments flagged as PCR/optical duplicates.")
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+    main(args)
@@ -1,76 +1,105 @@
 # A robust script to merge all generated features into a single matrix.
+#
+# Per-sample feature files are read in parallel, stacked per feature group and
+# aligned to the sample sheet with a single indexed concat. The cohort matrix
+# is written as Parquet (typed, columnar) by default; TSV remains available as
+# the output format or as an additional export.
 import argparse
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
-from functools import reduce
 
-def load_and_rename(file_path, id_col, prefix):
-    """Loads a TSV, sets index, and prefixes columns."""
-    df = pd.read_csv(file_path, sep='\t')
-    df = df.rename(columns={id_col: 'sample_id'})
-    df = df.set_index('sample_id')
-    df.columns = [f"{prefix}_{c}" for c in df.columns]
-    return df
+TUMOR_FRACTION = re.compile(r"Tumor Fraction:\s*([-+0-9.eE]+)")
+PLOIDY = re.compile(r"Ploidy:\s*([-+0-9.eE]+)")
+
+
+def load_table(file_path):
+    """Loads a per-sample feature TSV indexed by sample_id."""
+    return pd.read_csv(file_path, sep='\t', index_col='sample_id')
+
+
+def load_ichor_params(file_path):
+    """
+    Tumor fraction and ploidy of a sample: read from the TSV of tumor_fraction.py,
+    or pulled out of an ichorCNA params.txt (not a clean TSV).
+    """
+    if not file_path.endswith('.params.txt'):
+        return load_table(file_path)[['TF', 'ploidy']]
+    with open(file_path) as fh:
+        text = fh.read()
+    tf = TUMOR_FRACTION.search(text)
+    ploidy = PLOIDY.search(text)
+    # results/{sample}/fragmentomics/ichorCNA/{sample}.params.txt
+    sample_id = os.path.basename(file_path)[:-len('.params.txt')]
+    return pd.DataFrame(
+        {'TF': [float(tf.group(1)) if tf else 0.0], 'ploidy': [float(ploidy.group(1)) if ploidy else float('nan')]},
+        index=pd.Index([sample_id], name='sample_id'),
+    )
+
+
+def load_group(pool, loader, files, prefix):
+    """Loads one feature group in parallel and stacks it into a single prefixed frame."""
+    if not files:
+        return None
+    frames = list(pool.map(loader, files))
+    group = pd.concat(frames)
+    group = group[~group.index.duplicated(keep='last')]
+    group.columns = [f"{prefix}_{c}" for c in group.columns]
+    return group
+
+
+def write_matrix(df, path):
+    """Writes the matrix as Parquet or TSV depending on the file extension."""
+    if path.endswith('.parquet'):
+        df.to_parquet(path, engine='pyarrow', index=True)
+    else:
+        df.to_csv(path, sep='\t', index=True)
+
 
 def main(args):
     """Merges all feature files into a single matrix."""
     # Start with the main sample sheet
-    base_df = pd.read_csv(args.sample_sheet, sep='\t').set_index('sample_id')
-    all_dfs = [base_df]
-
-    # Process each type of feature file
-    if args.frag_summaries:
-        # Conceptual: parse frag_summary files
-        pass # Add parsing logic here
-    
-    if args.ichor_summaries:
-        # ichorCNA params.txt is not a clean TSV, requires custom parsing
-        ichor_data = []
-        for f in args.ichor_summaries:
-            sample_id = f.split('/')[-3]
-            tf = 0.0
-            with open(f) as fh:
-                for line in fh:
-                    if "Tumor Fraction" in line:
-                        tf = float(line.strip().split(': ')[1])
-                        break
-            ichor_data.append({'sample_id': sample_id, 'ichor_TF': tf})
-        if ichor_data:
-            all_dfs.append(pd.DataFrame(ichor_data).set_index('sample_id'))
-
-    if args.meth_props:
-        meth_dfs = [load_and_rename(f, 'sample_id', 'meth_prop') for f in args.meth_props]
-        if meth_dfs:
-            all_dfs.append(pd.concat(meth_dfs))
-
-    if args.meth_qc:
-        qc_dfs = [load_and_rename(f, 'sample_id', 'meth_qc') for f in args.meth_qc]
-        if qc_dfs:
-            all_dfs.append(pd.concat(qc_dfs))
-            
-    if args.dl_features:
-        dl_dfs = [load_and_rename(f, 'sample_id', 'dl') for f in args.dl_features]
-        if dl_dfs:
-            all_dfs.append(pd.concat(dl_dfs))
-
-    # Merge all dataframes on the sample_id index
-    # Using reduce for a clean, sequential join
-    final_df = reduce(lambda left, right: pd.merge(left, right, on='sample_id', how='left'), all_dfs)
+    base_df = pd.read_csv(args.sample_sheet, sep='\t', dtype=str).set_index('sample_id')
+
+    groups = [
+        (load_table, args.frag_summaries, 'frag'),
+        (load_ichor_params, args.ichor_summaries, 'ichor'),
+        (load_table, args.meth_props, 'meth_prop'),
+        (load_table, args.meth_qc, 'meth_qc'),
+        (load_table, args.dl_features, 'dl'),
+    ]
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        blocks = [load_group(pool, loader, files, prefix) for loader, files, prefix in groups]
+    blocks = [b for b in blocks if b is not None]
 
+    # One aligned concat on the sample_id index; samples without a feature get NaN
+    final_df = pd.concat([base_df] + [b.reindex(base_df.index) for b in blocks], axis=1)
+
+    # Typed columns: the sample sheet stays categorical, features numeric
+    for col in base_df.columns:
+        final_df[col] = final_df[col].astype('category')
     # Add pipeline version for provenance
-    final_df['trace_pipeline_version'] = args.version
-    
-    final_df.to_csv(args.output, sep='\t', index=True)
-    print(f"Successfully merged {len(final_df)} samples into {args.output}")
+    final_df['trace_pipeline_version'] = pd.Categorical([args.version] * len(final_df))
+
+    write_matrix(final_df, args.output)
+    if args.tsv_export:
+        write_matrix(final_df, args.tsv_export)
+    print(f"Successfully merged {len(final_df)} samples x {final_df.shape[1]} columns into {args.output}")
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Feature Merger for TRACE.")
     parser.add_argument("--sample_sheet", required=True)
     parser.add_argument("--frag_summaries", nargs='*')
-    parser.add_argument("--ichor_summaries", nargs='*')
+    parser.add_argument("--ichor_summaries", nargs='*', help="ichorCNA params.txt or tumor_fraction.py summaries.")
     parser.add_argument("--meth_props", nargs='*')
     parser.add_argument("--meth_qc", nargs='*')
     parser.add_argument("--dl_features", nargs='*')
     parser.add_argument("--version", required=True)
-    parser.add_argument("--output", required=True)
+    parser.add_argument("--output", required=True, help="Output matrix (.parquet or .tsv).")
+    parser.add_argument("--tsv_export", help="Optional additional TSV export of the matrix.")
+    parser.add_argument("--threads", type=int, default=8, help="Parallel readers for per-sample files.")
     args = parser.parse_args()
-    main(args)
\ No newline at end of file
+    main(args)
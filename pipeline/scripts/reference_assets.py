@@ -0,0 +1,347 @@
+# Shared, checksum-versioned reference assets.
+#
+# Reference files that pipeline scripts would otherwise parse in every job
+# (the methylation reference panel, BED tracks) are converted once into
+# NumPy arrays stored under `reference_assets.dir`, in a directory named
+# after the source file's SHA-256 and the converter version. Scripts open
+# them with mmap, so concurrent jobs on a node share one copy in the page
+# cache instead of each holding its own parsed DataFrame, and a changed
+# source file gets a new version rather than a stale one.
+#
+# The first process that needs a missing version builds it under a file
+# lock while the others wait for it. Source checksums are remembered by
+# path, size and mtime, so a job only stats the file. Other configured
+# references (FASTA, mappability bigWig, panel of normals) are not
+# converted but their checksums are recorded, so `verify` can check them.
+#
+#   python pipeline/scripts/reference_assets.py warm --configfile pipeline/config.yaml --preload
+#   python pipeline/scripts/reference_assets.py verify --configfile pipeline/config.yaml
+#   python pipeline/scripts/reference_assets.py prune --configfile pipeline/config.yaml
+import argparse
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+REGISTRY_NAME = "sources.json"
+
+
+# --- Checksums ---
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while chunk := fh.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def _locked(path):
+    """Exclusive flock on `path`, shared by every process on the node (and hosts sharing the volume)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read_registry(asset_dir):
+    try:
+        with open(os.path.join(asset_dir, REGISTRY_NAME)) as fh:
+            return json.load(fh)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def source_checksum(path, asset_dir, rehash=False):
+    """SHA-256 of a source file, hashed only when its size or mtime changed since last time."""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    known = _read_registry(asset_dir).get(path)
+    if not rehash and known and known["size"] == st.st_size and known["mtime_ns"] == st.st_mtime_ns:
+        return known["sha256"]
+    sha256 = file_sha256(path)
+    with _locked(os.path.join(asset_dir, ".registry.lock")):
+        registry = _read_registry(asset_dir)
+        registry[path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha256}
+        tmp_path = os.path.join(asset_dir, f"{REGISTRY_NAME}.tmp.{os.getpid()}")
+        with open(tmp_path, "w") as fh:
+            json.dump(registry, fh, indent=2)
+        os.replace(tmp_path, os.path.join(asset_dir, REGISTRY_NAME))
+    return sha256
+
+
+# --- Converters ---
+# Each returns ({name: array}, metadata). Bump a converter's version when its
+# output changes; existing assets are then rebuilt on first use.
+def convert_methylation_panel(path):
+    """Reference panel TSV (CpG ID index, one beta column per tissue) as arrays sorted by CpG ID."""
+    panel = pd.read_csv(path, sep="\t", index_col=0)
+    panel = panel.dropna()
+    panel.index = panel.index.astype(str)
+    if not panel.index.is_unique:
+        panel = panel[~panel.index.duplicated(keep="first")]
+    ids = np.char.encode(panel.index.to_numpy(dtype=str), "utf-8")
+    order = np.argsort(ids, kind="stable")
+    values = np.ascontiguousarray(panel.to_numpy(dtype=np.float64)[order])
+    return {"ids": ids[order], "values": values}, {"tissues": panel.columns.tolist()}
+
+
+def convert_bed(path):
+    """BED-like intervals (chrom, start, end; a header line is skipped) sorted by chromosome and start."""
+    table = pd.read_csv(path, sep="\t", header=None, usecols=[0, 1, 2], comment="#", dtype=str)
+    if not table.empty and not table.iloc[0, 1].isdigit():
+        table = table.iloc[1:]
+    table = table.astype({1: np.int64, 2: np.int64}).sort_values([0, 1], kind="stable")
+    chroms = np.char.encode(table[0].to_numpy(dtype=str), "utf-8")
+    return {"chroms": chroms, "starts": table[1].to_numpy(), "ends": table[2].to_numpy()}, {}
+
+
+CONVERTERS = {
+    "methylation_panel": (1, convert_methylation_panel),
+    "bed": (1, convert_bed),
+}
+
+
+# --- Asset Store ---
+def asset_path(asset_dir, kind, sha256):
+    version = CONVERTERS[kind][0]
+    return os.path.join(asset_dir, kind, f"{sha256}.v{version}")
+
+
+def ensure(kind, source, asset_dir):
+    """Directory of the converted asset for `source`, building it on first use."""
+    sha256 = source_checksum(source, asset_dir)
+    path = asset_path(asset_dir, kind, sha256)
+    if os.path.exists(os.path.join(path, "manifest.json")):
+        return path
+    with _locked(f"{path}.lock"):
+        # Another process may have built it while we waited
+        if os.path.exists(os.path.join(path, "manifest.json")):
+            return path
+        print(f"Converting {kind} asset {source} ({sha256[:12]})...")
+        version, convert = CONVERTERS[kind]
+        arrays, meta = convert(source)
+        tmp_dir = f"{path}.tmp.{os.getpid()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        files = {}
+        for name, array in arrays.items():
+            file_path = os.path.join(tmp_dir, f"{name}.npy")
+            np.save(file_path, array)
+            files[name] = {"sha256": file_sha256(file_path), "dtype": str(array.dtype), "shape": list(array.shape)}
+        manifest = {
+            "kind": kind, "version": version, "source": os.path.abspath(source), "source_sha256": sha256,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "arrays": files, **meta,
+        }
+        # The manifest goes last and the directory is swapped in whole, so readers never see a partial asset
+        with open(os.path.join(tmp_dir, "manifest.json"), "w") as fh:
+            json.dump(manifest, fh, indent=2)
+        os.replace(tmp_dir, path)
+    try:
+        os.remove(f"{path}.lock")
+    except FileNotFoundError:
+        pass
+    return path
+
+
+def open_asset(path):
+    """(manifest, {name: read-only memory-mapped array}) of a converted asset."""
+    with open(os.path.join(path, "manifest.json")) as fh:
+        manifest = json.load(fh)
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in manifest["arrays"]}
+    return manifest, arrays
+
+
+def load(kind, source, asset_dir=None):
+    """
+    (metadata, arrays) of a reference file: memory-mapped from the shared
+    store when `asset_dir` is given, otherwise converted in memory.
+    """
+    if asset_dir is None:
+        arrays, meta = CONVERTERS[kind][1](source)
+        return meta, arrays
+    return open_asset(ensure(kind, source, asset_dir))
+
+
+class ReferencePanel:
+    """A methylation reference panel: sorted CpG IDs and their per-tissue betas (rows follow the IDs)."""
+
+    def __init__(self, ids, values, tissues):
+        self.ids = ids
+        self.values = values
+        self.tissues = tissues
+        self._index = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def positions(self, cpg_ids):
+        """Row of each CpG ID in the panel, -1 where it has none (like pandas' get_indexer)."""
+        if self._index is None:
+            # Decoded once per process; hashing is faster per chunk than searching the sorted bytes
+            self._index = pd.Index(np.char.decode(np.asarray(self.ids), "utf-8"))
+        return self._index.get_indexer(cpg_ids)
+
+
+def methylation_panel(source, asset_dir=None):
+    meta, arrays = load("methylation_panel", source, asset_dir)
+    return ReferencePanel(arrays["ids"], arrays["values"], meta["tissues"])
+
+
+def bed_intervals(source, asset_dir=None):
+    """{chrom: (starts, ends)} of a BED-like file, e.g. the centromere track."""
+    _, arrays = load("bed", source, asset_dir)
+    chroms = arrays["chroms"]
+    intervals = {}
+    for chrom in np.unique(chroms):
+        rows = np.flatnonzero(chroms == chrom)
+        intervals[chrom.decode()] = (arrays["starts"][rows], arrays["ends"][rows])
+    return intervals
+
+
+# --- Configured References ---
+def configured_assets(config):
+    """[(name, kind, path)] of the references in the pipeline config; kind None means checksummed only."""
+    ichor = config.get("fragmentomics", {}).get("ichorCNA", {})
+    assets = [
+        ("ref_genome", None, config.get("ref_genome")),
+        ("ref_genome_fai", None, f"{config['ref_genome']}.fai" if config.get("ref_genome") else None),
+        ("mappability", None, ichor.get("mappability")),
+        ("centromere", "bed", ichor.get("centromere")),
+        ("normal_panel", None, ichor.get("normal_panel")),
+        ("tumor_fraction_panel", None, config.get("fragmentomics", {}).get("tumor_fraction", {}).get("normal_panel")),
+        ("reference_panel", "methylation_panel", config.get("methylomics", {}).get("reference_panel")),
+    ]
+    return [(name, kind, path) for name, kind, path in assets if path]
+
+
+def asset_dir_of(config):
+    return config.get("reference_assets", {}).get("dir", "pipeline/references/assets")
+
+
+def load_config(path):
+    import yaml
+    with open(path) as fh:
+        return yaml.safe_load(fh)
+
+
+def preload(paths):
+    """Asks the kernel to read files into the page cache ahead of the first job."""
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+
+def warm(args):
+    """Records every configured reference's checksum and builds the converted assets."""
+    config = load_config(args.configfile)
+    asset_dir = args.asset_dir or asset_dir_of(config)
+    os.makedirs(asset_dir, exist_ok=True)
+    to_preload = []
+    for name, kind, path in configured_assets(config):
+        if not os.path.exists(path):
+            print(f"{name}: {path} is missing, skipped")
+            continue
+        start = time.perf_counter()
+        if kind is None:
+            print(f"{name}: {source_checksum(path, asset_dir)[:12]} ({time.perf_counter() - start:.1f}s)")
+            continue
+        asset = ensure(kind, path, asset_dir)
+        to_preload += glob.glob(os.path.join(asset, "*.npy"))
+        print(f"{name}: {os.path.relpath(asset, asset_dir)} ({time.perf_counter() - start:.1f}s)")
+    if args.preload:
+        # The GC/mappability block index is read by every ichorCNA job as well
+        index_dir = config.get("reference_index", {}).get("path")
+        if index_dir:
+            to_preload += glob.glob(os.path.join(index_dir, "*.npy"))
+        preload(to_preload)
+        print(f"Preloaded {len(to_preload)} files into the page cache")
+
+
+def verify(args):
+    """Re-hashes configured references and converted assets; exits 1 on any mismatch."""
+    config = load_config(args.configfile)
+    asset_dir = args.asset_dir or asset_dir_of(config)
+    registry = _read_registry(asset_dir)
+    problems = 0
+    for name, kind, path in configured_assets(config):
+        if not os.path.exists(path):
+            print(f"MISSING  {name}: {path}")
+            problems += 1
+            continue
+        recorded = registry.get(os.path.abspath(path))
+        st = os.stat(path)
+        sha256 = source_checksum(path, asset_dir, rehash=True)
+        if recorded is None:
+            print(f"NEW      {name}: {sha256[:12]} (not warmed before)")
+        elif recorded["sha256"] == sha256:
+            print(f"OK       {name}: {sha256[:12]}")
+        elif recorded["size"] == st.st_size and recorded["mtime_ns"] == st.st_mtime_ns:
+            # Same size and mtime but different content: the file was corrupted in place
+            print(f"CORRUPT  {name}: {recorded['sha256'][:12]} -> {sha256[:12]}")
+            problems += 1
+        else:
+            print(f"UPDATED  {name}: {recorded['sha256'][:12]} -> {sha256[:12]}")
+        if kind is None:
+            continue
+        asset = asset_path(asset_dir, kind, sha256)
+        if not os.path.exists(os.path.join(asset, "manifest.json")):
+            print(f"         {name}: not converted yet (run warm)")
+            continue
+        manifest, _ = open_asset(asset)
+        for array, info in manifest["arrays"].items():
+            if file_sha256(os.path.join(asset, f"{array}.npy")) != info["sha256"]:
+                print(f"CORRUPT  {name}: {os.path.relpath(asset, asset_dir)}/{array}.npy")
+                problems += 1
+    if problems:
+        print(f"{problems} problem(s) found")
+        sys.exit(1)
+    print("All reference assets verified.")
+
+
+def prune(args):
+    """Removes converted assets of sources that are no longer configured or have changed."""
+    config = load_config(args.configfile)
+    asset_dir = args.asset_dir or asset_dir_of(config)
+    keep = {
+        asset_path(asset_dir, kind, source_checksum(path, asset_dir))
+        for _, kind, path in configured_assets(config) if kind is not None and os.path.exists(path)
+    }
+    for kind in CONVERTERS:
+        for path in glob.glob(os.path.join(asset_dir, kind, "*.v*")):
+            if os.path.isdir(path) and path not in keep:
+                shutil.rmtree(path)
+                print(f"Removed {os.path.relpath(path, asset_dir)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared, checksum-versioned reference assets for TRACE.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command, func, help_text in (
+        ("warm", warm, "Checksum every configured reference and build the memory-mappable assets."),
+        ("verify", verify, "Re-hash references and assets and report any mismatch."),
+        ("prune", prune, "Remove assets of references that changed or are no longer configured."),
+    ):
+        sub = subparsers.add_parser(command, help=help_text)
+        sub.add_argument("--configfile", default="pipeline/config.yaml")
+        sub.add_argument("--asset_dir", help="Defaults to reference_assets.dir in the config.")
+        if command == "warm":
+            sub.add_argument("--preload", action="store_true", help="Also read the assets into the page cache.")
+        sub.set_defaults(func=func)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,176 @@
+# Per-block GC / mappability index for the reference genome.
+#
+# `build` scans the FASTA (and mappability bigWig) once and stores, for every
+# fixed-size base block, the G+C count, the A/C/G/T count and the summed
+# mappability as small NumPy arrays. `derive` memory-maps those arrays and
+# folds blocks into windows, so GC and mappability WIGs for any window size
+# that is a multiple of the block size take seconds instead of a FASTA scan.
+import argparse
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+import pysam
+
+INDEX_VERSION = 1
+# Bases fetched per FASTA read; a multiple of every sensible block size
+FETCH_SIZE = 10_000_000
+CANONICAL_CHROM = re.compile(r"^(chr)?([0-9]+|X|Y)$")
+
+# Byte lookup tables for upper/lower-case nucleotides
+_IS_GC = np.zeros(256, dtype=np.uint8)
+_IS_GC[np.frombuffer(b"GCgc", dtype=np.uint8)] = 1
+_IS_ACGT = np.zeros(256, dtype=np.uint8)
+_IS_ACGT[np.frombuffer(b"ACGTacgt", dtype=np.uint8)] = 1
+
+
+def _block_sums(values, block_size):
+    """Sums a 1-D array over consecutive blocks, the last one possibly partial."""
+    n_blocks = (len(values) + block_size - 1) // block_size
+    padded = np.zeros(n_blocks * block_size, dtype=values.dtype)
+    padded[:len(values)] = values
+    return padded.reshape(n_blocks, block_size).sum(axis=1)
+
+
+def index_chromosome(fasta, bigwig, chrom, length, block_size):
+    """Returns per-block (gc, acgt, mappability_sum) arrays for one chromosome."""
+    gc, acgt, mappability = [], [], []
+    fetch_size = FETCH_SIZE - FETCH_SIZE % block_size
+    for start in range(0, length, fetch_size):
+        end = min(start + fetch_size, length)
+        seq = np.frombuffer(fasta.fetch(chrom, start, end).encode(), dtype=np.uint8)
+        gc.append(_block_sums(_IS_GC[seq], block_size).astype(np.uint32))
+        acgt.append(_block_sums(_IS_ACGT[seq], block_size).astype(np.uint32))
+        if bigwig is not None:
+            values = np.nan_to_num(np.asarray(bigwig.values(chrom, start, end), dtype=np.float64))
+            mappability.append(_block_sums(values, block_size).astype(np.float32))
+    return (
+        np.concatenate(gc),
+        np.concatenate(acgt),
+        np.concatenate(mappability) if bigwig is not None else None,
+    )
+
+
+def build(args):
+    """Scans the reference once and writes the block index atomically."""
+    if not os.path.exists(args.fasta + ".fai"):
+        pysam.faidx(args.fasta)
+    fasta = pysam.FastaFile(args.fasta)
+    bigwig = None
+    if args.mappability:
+        import pyBigWig
+        bigwig = pyBigWig.open(args.mappability)
+        bigwig_chroms = bigwig.chroms()
+
+    chromosomes = [(c, n) for c, n in zip(fasta.references, fasta.lengths) if CANONICAL_CHROM.match(c)]
+    # Build next to the destination and swap it in, so readers never see a partial index
+    tmp_dir = f"{args.outdir}.tmp.{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    has_mappability = bigwig is not None
+    for chrom, length in chromosomes:
+        print(f"Indexing {chrom} ({length} bp)...")
+        use_bigwig = bigwig if has_mappability and chrom in bigwig_chroms else None
+        gc, acgt, mappability = index_chromosome(fasta, use_bigwig, chrom, length, args.block_size)
+        np.save(os.path.join(tmp_dir, f"{chrom}.gc.npy"), gc)
+        np.save(os.path.join(tmp_dir, f"{chrom}.acgt.npy"), acgt)
+        if has_mappability:
+            if mappability is None:
+                mappability = np.zeros(len(gc), dtype=np.float32)
+            np.save(os.path.join(tmp_dir, f"{chrom}.map.npy"), mappability)
+
+    manifest = {
+        "version": INDEX_VERSION,
+        "block_size": args.block_size,
+        "fasta": os.path.abspath(args.fasta),
+        "mappability": os.path.abspath(args.mappability) if args.mappability else None,
+        "chromosomes": [[c, n] for c, n in chromosomes],
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as fh:
+        json.dump(manifest, fh, indent=2)
+
+    if os.path.exists(args.outdir):
+        shutil.rmtree(args.outdir)
+    os.replace(tmp_dir, args.outdir)
+    print(f"Wrote reference index for {len(chromosomes)} chromosomes to {args.outdir}")
+
+
+def load_manifest(index_dir):
+    with open(os.path.join(index_dir, "manifest.json")) as fh:
+        manifest = json.load(fh)
+    if manifest["version"] != INDEX_VERSION:
+        raise ValueError(f"Reference index {index_dir} has version {manifest['version']}, expected {INDEX_VERSION}")
+    return manifest
+
+
+def window_values(index_dir, chrom, length, block_size, window_size):
+    """Per-window GC fraction and mean mappability (None if not indexed) for one chromosome."""
+    gc = np.load(os.path.join(index_dir, f"{chrom}.gc.npy"), mmap_mode="r")
+    acgt = np.load(os.path.join(index_dir, f"{chrom}.acgt.npy"), mmap_mode="r")
+    starts = np.arange(0, len(gc), window_size // block_size)
+    gc_sum = np.add.reduceat(gc, starts).astype(np.float64)
+    acgt_sum = np.add.reduceat(acgt, starts).astype(np.float64)
+    gc_fraction = np.divide(gc_sum, acgt_sum, out=np.zeros_like(gc_sum), where=acgt_sum > 0)
+
+    map_path = os.path.join(index_dir, f"{chrom}.map.npy")
+    if not os.path.exists(map_path):
+        return gc_fraction, None
+    mappability = np.load(map_path, mmap_mode="r")
+    window_bases = np.minimum(window_size, length - starts * block_size).astype(np.float64)
+    return gc_fraction, np.add.reduceat(mappability, starts).astype(np.float64) / window_bases
+
+
+def _write_wig(path, tracks, window_size):
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w") as out:
+        for chrom, values in tracks:
+            out.write(f"fixedStep chrom={chrom} start=1 step={window_size} span={window_size}\n")
+            out.write("\n".join(f"{v:.6f}" for v in values))
+            out.write("\n")
+    os.replace(tmp_path, path)
+
+
+def derive(args):
+    """Writes GC (and mappability) WIGs for one window size from the index."""
+    manifest = load_manifest(args.index)
+    block_size = manifest["block_size"]
+    if args.window_size % block_size:
+        raise ValueError(f"Window size {args.window_size} is not a multiple of the index block size {block_size}")
+
+    gc_tracks, map_tracks = [], []
+    for chrom, length in manifest["chromosomes"]:
+        gc_fraction, mappability = window_values(args.index, chrom, length, block_size, args.window_size)
+        gc_tracks.append((chrom, gc_fraction))
+        if mappability is not None:
+            map_tracks.append((chrom, mappability))
+
+    _write_wig(args.gc_out, gc_tracks, args.window_size)
+    print(f"Wrote GC WIG to {args.gc_out}")
+    if args.map_out:
+        if not map_tracks:
+            raise ValueError(f"Reference index {args.index} was built without mappability")
+        _write_wig(args.map_out, map_tracks, args.window_size)
+        print(f"Wrote mappability WIG to {args.map_out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reference GC/mappability block index for TRACE.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Scan the reference once and write the block index.")
+    build_parser.add_argument("--fasta", required=True)
+    build_parser.add_argument("--mappability", help="Mappability bigWig (optional).")
+    build_parser.add_argument("--block_size", type=int, default=10000)
+    build_parser.add_argument("--outdir", required=True)
+    build_parser.set_defaults(func=build)
+
+    derive_parser = subparsers.add_parser("derive", help="Derive window-level WIGs from the index.")
+    derive_parser.add_argument("--index", required=True)
+    derive_parser.add_argument("--window_size", type=int, required=True)
+    derive_parser.add_argument("--gc_out", required=True)
+    derive_parser.add_argument("--map_out")
+    derive_parser.set_defaults(func=derive)
+
+    args = parser.parse_args()
+    args.func(args)
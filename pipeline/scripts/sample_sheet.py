@@ -0,0 +1,56 @@
+# Cached, indexed access to a TRACE sample sheet.
+#
+# The sheet is parsed once per process (keyed by its path, size and mtime)
+# into rows indexed by sample_id, with the sample IDs of each data type
+# precomputed. The Snakefile builds its DAG from these lists, and per-sample
+# scripts look up their own row directly instead of scanning a DataFrame.
+# Values are kept as strings and empty cells as "", like
+# pd.read_csv(dtype=str, keep_default_na=False).
+import csv
+import os
+from functools import lru_cache
+
+
+class SampleSheet:
+    """Sample sheet rows keyed by sample_id, in sheet order."""
+
+    def __init__(self, rows):
+        self._rows = {}
+        self._by_type = {}
+        for row in rows:
+            sample_id = row["sample_id"]
+            # A repeated sample_id keeps its first row
+            if sample_id in self._rows:
+                continue
+            self._rows[sample_id] = row
+            self._by_type.setdefault(row.get("data_type", ""), []).append(sample_id)
+        self.samples = list(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, sample_id):
+        return sample_id in self._rows
+
+    def row(self, sample_id: str) -> dict:
+        """Returns the row of one sample as a dict of column -> string."""
+        try:
+            return self._rows[sample_id]
+        except KeyError:
+            raise KeyError(f"Sample {sample_id} is not in the sample sheet") from None
+
+    def of_type(self, data_type: str) -> list:
+        """Sample IDs with the given data_type, in sheet order."""
+        return self._by_type.get(data_type, [])
+
+
+@lru_cache(maxsize=8)
+def _parse(path: str, size: int, mtime_ns: int) -> SampleSheet:
+    with open(path, newline="") as fh:
+        return SampleSheet(csv.DictReader(fh, delimiter="\t", restval=""))
+
+
+def load(path: str) -> SampleSheet:
+    """Loads a sample sheet, reusing the parsed sheet while the file is unchanged."""
+    stat = os.stat(path)
+    return _parse(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
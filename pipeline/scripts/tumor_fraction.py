@@ -0,0 +1,399 @@
+# Tumor fraction from binned read depth: a NumPy alternative to ichorCNA.
+#
+# Window read counts (the WIG written by bin_coverage.py) are corrected for
+# GC content and mappability by stratified medians, normalized against a
+# panel of normals and segmented with a copy-number HMM. Tumor fraction and
+# ploidy are chosen by running Viterbi for every point of a (tumor fraction,
+# ploidy) grid at once, without an R session. The Snakefile runs one sample
+# per job so failures stay isolated; several WIGs can be passed at once to
+# load the references and the panel only once. Only autosomes are used, as
+# ichorCNA's chrTrain default.
+#
+#   python pipeline/scripts/tumor_fraction.py estimate --wigs a.wig b.wig --sample_ids a b \
+#       --gc_wig gc.wig --map_wig map.wig --summaries ... --segments ... --plots ...
+#   python pipeline/scripts/tumor_fraction.py panel --wigs normals/*.wig \
+#       --gc_wig gc.wig --map_wig map.wig --output panel_of_normals.tsv
+import argparse
+import math
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+import reference_assets
+
+AUTOSOME = re.compile(r"^(chr)?([0-9]+)$")
+# Quantile strata for the GC and mappability medians
+CORRECTION_STRATA = 100
+# Degrees of freedom of the Student-t emissions; heavy tails absorb outlier bins
+STUDENT_DF = 4.0
+# Probability that a chromosome starts in the neutral (ploidy) state
+NEUTRAL_START = 0.9
+# Bins whose emissions are computed in one vectorized step
+EMISSION_BLOCK = 64
+
+
+# --- Inputs ---
+def chrom_key(name):
+    """Chromosome name without a `chr` prefix, so BAM, FASTA and BED naming can differ."""
+    return name[3:] if name.startswith("chr") else name
+
+
+def read_wig(path):
+    """Reads a fixedStep WIG into ({chrom: values}, step)."""
+    tracks, step = {}, None
+    with open(path) as fh:
+        # Anything before the first declaration (a track line) is skipped
+        blocks = fh.read().split("fixedStep")[1:]
+    for block in blocks:
+        header, _, values = block.partition("\n")
+        fields = dict(f.split("=", 1) for f in header.split())
+        if step is not None and int(fields["step"]) != step:
+            raise ValueError(f"{path} mixes step sizes {step} and {fields['step']}")
+        step = int(fields["step"])
+        tracks[fields["chrom"]] = np.array(values.split(), dtype=np.float64)
+    return tracks, step
+
+
+def load_bins(gc_wig, map_wig=None, centromere=None, asset_dir=None, min_map_score=0.9, centromere_flank=100000):
+    """
+    Autosomal bins of the reference WIGs as a DataFrame (chrom, start, end, gc,
+    map, usable). Bins without GC, below the mappability cutoff or within
+    `centromere_flank` of a centromere are not usable.
+    """
+    gc_tracks, step = read_wig(gc_wig)
+    map_tracks = {}
+    if map_wig:
+        map_tracks, map_step = read_wig(map_wig)
+        if map_step != step:
+            raise ValueError(f"GC WIG step {step} does not match mappability WIG step {map_step}")
+    map_tracks = {chrom_key(c): v for c, v in map_tracks.items()}
+    centromeres = {}
+    if centromere:
+        centromeres = {chrom_key(c): v for c, v in reference_assets.bed_intervals(centromere, asset_dir).items()}
+
+    frames = []
+    for chrom, gc in gc_tracks.items():
+        if not AUTOSOME.match(chrom):
+            continue
+        key = chrom_key(chrom)
+        starts = np.arange(len(gc), dtype=np.int64) * step
+        mappability = map_tracks.get(key, np.ones_like(gc))[:len(gc)]
+        usable = (gc > 0) & (mappability >= min_map_score)
+        for c_start, c_end in zip(*centromeres.get(key, ((), ()))):
+            usable &= (starts + step <= c_start - centromere_flank) | (starts >= c_end + centromere_flank)
+        frames.append(pd.DataFrame({
+            "chrom": chrom, "start": starts, "end": starts + step, "gc": gc, "map": mappability, "usable": usable,
+        }))
+    bins = pd.concat(frames, ignore_index=True)
+    bins.attrs["step"] = step
+    return bins
+
+
+def load_counts(wig_paths, bins):
+    """Read counts of each sample WIG aligned to `bins` as an (samples x bins) array."""
+    counts = np.full((len(wig_paths), len(bins)), np.nan)
+    offsets = {}
+    for chrom, rows in bins.groupby("chrom", sort=False).indices.items():
+        offsets[chrom_key(chrom)] = (rows[0], len(rows))
+    for i, path in enumerate(wig_paths):
+        tracks, step = read_wig(path)
+        if step != bins.attrs["step"]:
+            raise ValueError(f"{path} has {step} bp windows, the reference WIGs {bins.attrs['step']} bp")
+        for chrom, values in tracks.items():
+            if chrom_key(chrom) in offsets:
+                first, n = offsets[chrom_key(chrom)]
+                n = min(n, len(values))
+                counts[i, first:first + n] = values[:n]
+    return counts
+
+
+# --- Depth Correction ---
+def stratified_median(x, y, mask):
+    """Median of `y` along `x`, from quantile strata of the masked bins, interpolated to every bin."""
+    strata = np.unique(np.quantile(x[mask], np.linspace(0, 1, CORRECTION_STRATA + 1)))
+    stratum = np.clip(np.searchsorted(strata, x[mask], side="right") - 1, 0, max(len(strata) - 2, 0))
+    grouped = pd.DataFrame({"x": x[mask], "y": y[mask]}).groupby(stratum)
+    centers, medians = grouped["x"].mean().to_numpy(), grouped["y"].median().to_numpy()
+    return np.interp(x, centers, medians)
+
+
+def corrected_log2(counts, bins, names):
+    """GC- and mappability-corrected log2 depth ratios, median-centered; NaN where a bin is not usable."""
+    usable = bins["usable"].to_numpy()
+    gc, mappability = bins["gc"].to_numpy(), bins["map"].to_numpy()
+    log2 = np.full(counts.shape, np.nan)
+    for i, sample_counts in enumerate(counts):
+        ok = usable & (sample_counts > 0)
+        if ok.sum() < 2:
+            print(f"{names[i]}: no usable bins with reads")
+            continue
+        ratio = sample_counts / stratified_median(gc, sample_counts, ok)
+        if np.ptp(mappability[ok]) > 0:
+            ratio = ratio / stratified_median(mappability, ratio, ok)
+        ok &= ratio > 0
+        values = np.log2(ratio[ok])
+        log2[i, ok] = values - np.median(values)
+    return log2
+
+
+def apply_panel(log2, bins, panel_path):
+    """Subtracts the panel-of-normals median of each bin and re-centers."""
+    panel = pd.read_csv(panel_path, sep="\t", dtype={"chrom": str})
+    panel_index = pd.MultiIndex.from_arrays([panel["chrom"].map(chrom_key), panel["start"]])
+    bins_index = pd.MultiIndex.from_arrays([bins["chrom"].map(chrom_key), bins["start"]])
+    median = panel.set_index(panel_index)["median"].reindex(bins_index).to_numpy()
+    log2 = log2 - median
+    centers = np.zeros(len(log2))
+    has_data = ~np.isnan(log2).all(axis=1)
+    centers[has_data] = np.nanmedian(log2[has_data], axis=1)
+    return log2 - centers[:, None]
+
+
+# --- Copy-Number HMM ---
+def state_means(tumor_fractions, ploidies, states):
+    """
+    Expected log2 ratio of each copy-number state at each (tumor fraction,
+    ploidy), and log start probabilities favouring the neutral state: both
+    (states, 1, grid), to broadcast over samples.
+    """
+    t, p = np.meshgrid(tumor_fractions, ploidies, indexing="ij")
+    t, p, c = t.ravel()[None, :], p.ravel()[None, :], states[:, None]
+    normal = 2 * (1 - t)
+    means = np.log2((normal + c * t) / (normal + p * t))
+    distance = np.abs(c - p)
+    neutral = distance == distance.min(axis=0, keepdims=True)
+    n_neutral = neutral.sum(axis=0, keepdims=True)
+    start = np.where(neutral, NEUTRAL_START / n_neutral, (1 - NEUTRAL_START) / (len(states) - n_neutral))
+    return means[:, None, :], np.log(start)[:, None, :]
+
+
+def noise_scale(log2, breaks):
+    """Robust per-sample noise SD from the spread of neighbouring-bin differences."""
+    diffs = np.diff(log2, axis=1)
+    diffs[:, breaks[1:]] = np.nan
+    scale = np.full(len(log2), np.nan)
+    has_data = ~np.isnan(diffs).all(axis=1)
+    scale[has_data] = 1.4826 * np.nanmedian(np.abs(diffs[has_data]), axis=1) / math.sqrt(2)
+    return np.fmax(scale, 1e-3)
+
+
+def emissions(x, means, scale):
+    """
+    Student-t log densities of a block of bins (samples, bins) for every
+    state, sample and grid point: (bins, states, samples, grid); 0 for missing
+    bins. Single precision: the scores they are added to stay in double.
+    """
+    x = x.T[:, None, :, None].astype(np.float32)
+    inv_scale = (1 / scale[:, None]).astype(np.float32)
+    constant = math.lgamma((STUDENT_DF + 1) / 2) - math.lgamma(STUDENT_DF / 2) - 0.5 * math.log(STUDENT_DF * math.pi)
+    z = x - means.astype(np.float32)
+    z *= inv_scale
+    np.square(z, out=z)
+    z *= np.float32(1 / STUDENT_DF)
+    np.log1p(z, out=z)
+    z *= np.float32(-(STUDENT_DF + 1) / 2)
+    z += (constant - np.log(scale)[:, None]).astype(np.float32)
+    z[np.broadcast_to(np.isnan(x), z.shape)] = 0.0
+    return z
+
+
+def viterbi(log2, breaks, means, log_start, scale, self_transition, backtrack=False):
+    """
+    Max-product pass over the bins for all samples and grid points at once.
+
+    `means` and `log_start` are (states, 1, grid) shared by all samples or
+    (states, samples, 1) per sample. Staying in a state costs
+    log(self_transition) and any change costs the same, so the best
+    predecessor of a state is either itself or the overall best, which keeps
+    every step O(states). States lead the arrays so those maxima are
+    element-wise over contiguous slabs. Each chromosome starts afresh.
+    Returns the scores (samples, grid) and, with `backtrack`, the state path (samples, bins).
+    """
+    n_states, n_samples, n_bins = len(means), log2.shape[0], log2.shape[1]
+    log_stay = math.log(self_transition)
+    log_move = math.log((1 - self_transition) / (n_states - 1))
+    pointers = np.zeros((n_bins, n_states, n_samples, means.shape[-1]), dtype=np.int8) if backtrack else None
+    states = np.arange(n_states, dtype=np.int8).reshape(-1, 1, 1)
+    score = None
+    for block in range(0, n_bins, EMISSION_BLOCK):
+        block_emissions = emissions(log2[:, block:block + EMISSION_BLOCK], means, scale)
+        for offset, e in enumerate(block_emissions):
+            b = block + offset
+            if score is None:
+                score = log_start + e
+            elif breaks[b]:
+                if backtrack:
+                    pointers[b] = score.argmax(axis=0)
+                score = score.max(axis=0) + log_start + e
+            else:
+                stay = score + log_stay
+                move = score.max(axis=0) + log_move
+                if backtrack:
+                    pointers[b] = np.where(stay >= move, states, score.argmax(axis=0))
+                score = np.maximum(stay, move) + e
+    if not backtrack:
+        return score.max(axis=0), None
+    path = np.zeros(log2.shape, dtype=np.int64)
+    state = score.argmax(axis=0)[:, 0]
+    samples = np.arange(n_samples)
+    for b in range(n_bins - 1, -1, -1):
+        path[:, b] = state
+        state = pointers[b][state, samples, 0]
+    return score.max(axis=0), path
+
+
+def segments(bins, log2, copy_number):
+    """Runs of equal copy number within each chromosome, summarized over bins with data."""
+    chrom = bins["chrom"].to_numpy()
+    new_run = np.r_[True, (copy_number[1:] != copy_number[:-1]) | (chrom[1:] != chrom[:-1])]
+    run = np.cumsum(new_run) - 1
+    has_data = ~np.isnan(log2)
+    table = pd.DataFrame({
+        "chrom": chrom, "start": bins["start"].to_numpy(), "end": bins["end"].to_numpy(),
+        "copy_number": copy_number, "log2": log2, "run": run,
+    })[has_data]
+    return table.groupby("run", sort=True).agg(
+        chrom=("chrom", "first"), start=("start", "first"), end=("end", "last"),
+        n_bins=("log2", "size"), copy_number=("copy_number", "first"), median_log2=("log2", "median"),
+    ).reset_index(drop=True)
+
+
+def estimate_batch(log2, bins, args):
+    """Tumor fraction, ploidy and copy-number path of every sample: (summary rows, copy numbers)."""
+    chrom = bins["chrom"].to_numpy()
+    breaks = np.r_[True, chrom[1:] != chrom[:-1]]
+    states = np.arange(0 if args.include_homd else 1, args.max_cn + 1)
+    tumor_fractions = np.arange(args.tf_grid_step, 1 - args.tf_grid_step / 2, args.tf_grid_step)
+    ploidies = np.asarray(args.ploidy, dtype=np.float64)
+    grid = np.array(np.meshgrid(tumor_fractions, ploidies, indexing="ij")).reshape(2, -1).T
+    means, log_start = state_means(tumor_fractions, ploidies, states)
+    scale = noise_scale(log2, breaks)
+
+    # Scores of every grid point, then the path of each sample's best one
+    scores, _ = viterbi(log2, breaks, means, log_start, scale, args.self_transition)
+    best = scores.argmax(axis=1)
+    log_likelihood, path = viterbi(
+        log2, breaks, means[:, 0, best, None], log_start[:, 0, best, None], scale, args.self_transition, backtrack=True,
+    )
+
+    rows, copy_numbers = [], states[path]
+    for i in range(len(log2)):
+        tf, ploidy = grid[best[i]]
+        has_data = ~np.isnan(log2[i])
+        cn = copy_numbers[i]
+        altered = has_data & (cn != ploidy)
+        table = segments(bins, log2[i], cn)
+        altered_runs = table.loc[table["copy_number"] != ploidy, "n_bins"]
+        largest = int(altered_runs.max()) if len(altered_runs) else 0
+        frac_altered = altered.sum() / max(has_data.sum(), 1)
+        # Like ichorCNA: too few or too small alterations mean no detectable tumor
+        if frac_altered < args.alt_frac_threshold or largest < args.min_segment_bins:
+            tf, tumor_ploidy = 0.0, ploidy
+        else:
+            tumor_ploidy = float(cn[has_data].mean())
+        rows.append({
+            "TF": round(float(tf), 4), "ploidy": round(tumor_ploidy, 3),
+            "frac_genome_altered": round(float(frac_altered), 4), "largest_segment_bins": largest,
+            "noise_sd": round(float(scale[i]), 5), "log_likelihood": round(float(log_likelihood[i, 0]), 3),
+            "n_bins": int(has_data.sum()), "segments": table,
+        })
+    return rows, copy_numbers
+
+
+def plot_copy_number(bins, log2, copy_number, title, path):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    x = np.arange(len(bins))
+    fig, ax = plt.subplots(figsize=(12, 4))
+    ax.scatter(x, log2, c=copy_number, cmap="coolwarm", vmin=0, vmax=4, s=4)
+    for boundary in np.flatnonzero(np.r_[False, bins["chrom"].to_numpy()[1:] != bins["chrom"].to_numpy()[:-1]]):
+        ax.axvline(boundary, color="lightgrey", linewidth=0.5)
+    ax.set_ylim(-2, 2)
+    ax.set_xlabel("Autosomal bins")
+    ax.set_ylabel("Corrected log2 ratio")
+    ax.set_title(title)
+    fig.tight_layout()
+    fig.savefig(path, dpi=100)
+    plt.close(fig)
+
+
+# --- Commands ---
+def estimate(args):
+    """Estimates tumor fraction for every sample WIG and writes the per-sample outputs."""
+    n = len(args.wigs)
+    for name in ("sample_ids", "summaries", "segments", "plots"):
+        if getattr(args, name) is not None and len(getattr(args, name)) != n:
+            raise ValueError(f"--{name} needs one entry per WIG ({n})")
+    bins = load_bins(args.gc_wig, args.map_wig, args.centromere, args.asset_dir, args.min_map_score, args.centromere_flank)
+    log2 = corrected_log2(load_counts(args.wigs, bins), bins, args.sample_ids)
+    if args.normal_panel and os.path.exists(args.normal_panel):
+        log2 = apply_panel(log2, bins, args.normal_panel)
+    else:
+        print(f"No panel of normals at {args.normal_panel}; using GC/mappability correction only")
+    print(f"Estimating tumor fraction for {n} samples over {int(bins['usable'].sum())} usable bins...")
+
+    rows, copy_numbers = estimate_batch(log2, bins, args)
+    for i, row in enumerate(rows):
+        table = row.pop("segments")
+        sample_id = args.sample_ids[i]
+        pd.DataFrame([{"sample_id": sample_id, **row}]).to_csv(args.summaries[i], sep="\t", index=False)
+        if args.segments:
+            table.to_csv(args.segments[i], sep="\t", index=False, float_format="%.4f")
+        if args.plots:
+            plot_copy_number(bins, log2[i], copy_numbers[i], f"{sample_id}: TF {row['TF']:.3f}, ploidy {row['ploidy']:.2f}", args.plots[i])
+        print(f"{sample_id}: tumor fraction {row['TF']:.3f}, ploidy {row['ploidy']:.2f}")
+
+
+def panel(args):
+    """Builds a panel of normals: the per-bin median corrected log2 ratio of normal samples."""
+    bins = load_bins(args.gc_wig, args.map_wig, args.centromere, args.asset_dir, args.min_map_score, args.centromere_flank)
+    log2 = corrected_log2(load_counts(args.wigs, bins), bins, args.wigs)
+    median = np.full(log2.shape[1], np.nan)
+    has_data = ~np.isnan(log2).all(axis=0)
+    median[has_data] = np.nanmedian(log2[:, has_data], axis=0)
+    table = bins.loc[~np.isnan(median), ["chrom", "start", "end"]].assign(median=median[~np.isnan(median)])
+    table.to_csv(args.output, sep="\t", index=False, float_format="%.6f")
+    print(f"Wrote panel of normals from {len(args.wigs)} samples ({len(table)} bins) to {args.output}")
+
+
+def add_reference_arguments(parser):
+    parser.add_argument("--wigs", nargs="+", required=True, help="Read-count WIGs from bin_coverage.py.")
+    parser.add_argument("--gc_wig", required=True)
+    parser.add_argument("--map_wig")
+    parser.add_argument("--centromere", help="Centromere BED; bins near centromeres are excluded.")
+    parser.add_argument("--asset_dir", help="Shared reference-asset store for the centromere BED.")
+    parser.add_argument("--min_map_score", type=float, default=0.9)
+    parser.add_argument("--centromere_flank", type=int, default=100000)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tumor fraction from binned read depth for TRACE.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    estimate_parser = subparsers.add_parser("estimate", help="Estimate tumor fraction and copy number for a batch of samples.")
+    add_reference_arguments(estimate_parser)
+    estimate_parser.add_argument("--sample_ids", nargs="+", required=True)
+    estimate_parser.add_argument("--summaries", nargs="+", required=True, help="Per-sample TSV with TF and ploidy.")
+    estimate_parser.add_argument("--segments", nargs="+", help="Per-sample copy-number segments TSV.")
+    estimate_parser.add_argument("--plots", nargs="+", help="Per-sample copy-number plot.")
+    estimate_parser.add_argument("--normal_panel", help="Panel of normals TSV written by the `panel` command.")
+    estimate_parser.add_argument("--ploidy", type=float, nargs="+", default=[2.0], help="Ploidies to consider.")
+    estimate_parser.add_argument("--max_cn", type=int, default=5)
+    estimate_parser.add_argument("--include_homd", action="store_true", help="Include the homozygous deletion state.")
+    estimate_parser.add_argument("--tf_grid_step", type=float, default=0.01)
+    estimate_parser.add_argument("--self_transition", type=float, default=0.999)
+    estimate_parser.add_argument("--alt_frac_threshold", type=float, default=0.05)
+    estimate_parser.add_argument("--min_segment_bins", type=int, default=50)
+    estimate_parser.set_defaults(func=estimate)
+
+    panel_parser = subparsers.add_parser("panel", help="Build a panel of normals from normal-sample WIGs.")
+    add_reference_arguments(panel_parser)
+    panel_parser.add_argument("--output", required=True)
+    panel_parser.set_defaults(func=panel)
+
+    args = parser.parse_args()
+    args.func(args)